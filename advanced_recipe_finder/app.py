@@ -2,21 +2,19 @@
 import os
 import json
 import mysql.connector
-from mysql.connector import pooling
 from mysql.connector import Error
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_file, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_file, send_from_directory, abort, g, has_app_context
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
 from PIL import Image
 import google.generativeai as genai
 from datetime import datetime, timedelta
 import pandas as pd
 from io import BytesIO
 import re
-import requests
 from uuid import uuid4
 import logging
 import urllib.parse
+import mimetypes
 import pyotp
 import qrcode
 from io import BytesIO
@@ -24,12 +22,34 @@ import base64
 import time
 import threading
 import random
-import tempfile
-import shutil
 from fpdf import FPDF 
-from functools import wraps
+import click
+from functools import partial, wraps
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from bytez_image_generator import BytezImageGenerator
 from config_backup import Config as AppConfig
+from recipe_retrieval import RecipeIndex, format_recipe_answer, format_grounding_context
+from chat_memory import ConversationMemory
+from semantic_cache import SemanticCache, is_follow_up
+from recipe_pool import CandidatePool, pool_key
+from meal_plan_cache import MealPlanTemplateCache, MealLibrary, plan_key, is_valid_plan, is_known_allergy, personalize_plan
+from image_backfill import find_sources, run_backfill
+from image_pipeline import create_derivatives, derivative_name, derivative_widths, parse_derivative_name, render_derivatives, supports_derivatives, describe_image_bytes, describe_image_file, DERIVATIVE_WIDTHS, DERIVATIVE_FORMATS
+from content_store import ContentStore, ETagCache
+from http_client import DownloadError, get_download_client
+from image_ingest import IngestError, UploadIngestor
+from upload_gc import QUARANTINE_DIR, collect_garbage, referenced_name
+from image_cache import GeneratedImageCache, image_cache_key
+from image_queue import ImageGenerationService, QueueFullError
+from upload_layout import TEMP_DIR, shard_name, flat_uploads, move_to_shard, reference_forms, resolve as resolve_upload
+from storage import create_storage
+from image_hash import PerceptualHashIndex, hash_image_bytes
+from tts_service import TTSService
+from logo_store import LogoStore, logo_hash
+from db_session import ConnectionManager
+from connection_pool import BlockingConnectionPool, PoolTimeoutError
 
 # Authentication decorator
 def login_required(f):
@@ -56,14 +76,116 @@ class Config(AppConfig):
     GEMINI_VERSION = 'v1'
     GEMINI_TEXT_MODEL = 'models/gemini-flash-latest'
 
+    # Chatbot retrieval over the local recipes table
+    RECIPE_INDEX_TTL = 300  # seconds before the index is rebuilt
+    CHATBOT_RETRIEVAL_CONFIDENCE = 0.35  # score needed to answer without Gemini
+    CHATBOT_RETRIEVAL_MIN_SCORE = 0.15  # score needed to use a recipe as grounding
+
+    # Chatbot conversation memory budgets (estimated tokens)
+    CHAT_MEMORY_WINDOW_TOKENS = 1200  # recent turns sent verbatim
+    CHAT_MEMORY_SUMMARY_TOKENS = 300  # running summary of older turns
+    CHAT_MEMORY_MAX_TURNS = 50  # unsummarized turns loaded per request
+
+    # Semantic cache of chatbot answers for rephrased questions
+    CHAT_CACHE_THRESHOLD = 0.85  # cosine similarity needed for a hit
+    CHAT_CACHE_MAX_ENTRIES = 2000
+    CHAT_CACHE_TTL = 86400  # 1 day
+    CHAT_CACHE_WARM_ROWS = 1000  # chat_history rows loaded on first use
+
+    # AI recipe generator candidate pool
+    RECIPE_CANDIDATES = 3  # recipes requested per background pool refill
+    RECIPE_POOL_TTL = 1800  # 30 minutes
+
+    # Meal plan template cache freshness policy
+    MEAL_PLAN_CACHE_MAX_AGE = 259200  # 3 days
+    MEAL_PLAN_CACHE_MAX_SERVES = 25  # personalized plans served per template
+    MEAL_PLAN_SUBSTITUTION_RATE = 0.3  # chance of swapping each meal for a library meal
+
+    # Seconds an image must go unused before releasing its last reference deletes it
+    IMAGE_RELEASE_GRACE = 300
+
+    # Browser cache lifetime for /uploads responses (upload names are immutable)
+    UPLOAD_CACHE_MAX_AGE = 31536000  # 1 year
+
+    # Let the front proxy stream /uploads: 'nginx' (X-Accel-Redirect), 'sendfile'
+    # (X-Sendfile for Apache/lighttpd) or None to stream from Python. Ignored in debug mode.
+    # For nginx, map the prefix to the upload folder in an internal location:
+    #   location /protected-uploads/ { internal; alias /path/to/advanced_recipe_finder/upload/; }
+    UPLOAD_OFFLOAD = os.environ.get('UPLOAD_OFFLOAD') or None
+    UPLOAD_ACCEL_PREFIX = '/protected-uploads/'
+
+    # Bytez images reused for repeated prompts, bounded by total image size
+    IMAGE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+    IMAGE_CACHE_MAX_ENTRIES = 2000
+
+    # Bytez generations run on a fixed worker pool with a per-user fair queue
+    IMAGE_GENERATION_WORKERS = 2  # concurrent model.run calls the upstream sustains
+    IMAGE_GENERATION_MAX_QUEUE = 50
+    IMAGE_GENERATION_MAX_PER_USER = 3
+
+    # Uploads are decoded in worker processes, EXIF-rotated, stripped of
+    # metadata and downscaled to this longest edge before they are stored
+    UPLOAD_INGEST_WORKERS = 2
+    UPLOAD_MAX_EDGE = 2048
+    UPLOAD_QUALITY = 85
+
+    # Unreferenced uploads younger than this are never garbage collected (seconds)
+    UPLOAD_GC_GRACE = 24 * 3600
+
+    # Where uploads, generated images and audio are stored: 'local' (the upload
+    # folder) or 's3' (any S3-API store, e.g. MinIO via S3_ENDPOINT_URL), which
+    # lets several app nodes share files. With s3, /uploads redirects clients to
+    # presigned URLs (or S3_PUBLIC_URL) so bytes are served by the object store.
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local')
+    S3_BUCKET = os.environ.get('S3_BUCKET')
+    S3_PREFIX = os.environ.get('S3_PREFIX', '')
+    S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')
+    S3_REGION = os.environ.get('S3_REGION')
+    S3_ACCESS_KEY = os.environ.get('S3_ACCESS_KEY')
+    S3_SECRET_KEY = os.environ.get('S3_SECRET_KEY')
+    S3_PUBLIC_URL = os.environ.get('S3_PUBLIC_URL')
+    STORAGE_URL_EXPIRES = 3600  # lifetime of presigned URLs in seconds
+
+    # Generated images whose perceptual hashes differ by at most this many of
+    # 64 bits are treated as the same picture and stored once
+    IMAGE_DUPLICATE_DISTANCE = 5
+
+    # Metadata (size, colour, placeholder) of recently ingested or generated images kept in
+    # memory, so rows saved with them are filled in without reopening the file
+    IMAGE_METADATA_CACHE_SIZE = 1000
+
+    # Recipe narration: one shared Google TTS client, audio cached in upload
+    # storage by (text, voice, gender, encoding), long texts synthesized in parallel chunks
+    TTS_VOICE = 'en-US-Neural2-F'
+    TTS_LANGUAGE_CODE = 'en-US'
+    TTS_SSML_GENDER = 'FEMALE'
+    TTS_WORKERS = 4
+
+    # Connections checked out by background threads are logged once held this long (seconds)
+    DB_HOLD_WARNING = 30
+
+    # Database pool: DB_POOL_SIZE connections stay open, up to DB_POOL_MAX_OVERFLOW
+    # more are opened under bursts, and checkouts wait up to DB_POOL_TIMEOUT seconds.
+    # Turning off DB_POOL_RESET_SESSION saves a round trip per checkout when no
+    # code relies on session variables or temporary tables. Connections idle for
+    # DB_POOL_PING_INTERVAL seconds are pinged before use.
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_POOL_MAX_OVERFLOW = int(os.environ.get('DB_POOL_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+    DB_POOL_RESET_SESSION = os.environ.get('DB_POOL_RESET_SESSION', '1') not in ('0', 'false', 'False')
+    DB_POOL_PING_INTERVAL = float(os.environ.get('DB_POOL_PING_INTERVAL', 30))
+
 
 
 # Initialize Flask app
 app = Flask(__name__)
 app.config.from_object(Config)
 
+# Brand logos decoded once and kept pre-resized for compositing
+logo_store = LogoStore()
+
 # Initialize Bytez Image Generator
-bytez_generator = BytezImageGenerator(api_key=Config.BYTEZ_API_KEY)
+bytez_generator = BytezImageGenerator(api_key=Config.BYTEZ_API_KEY, logo_store=logo_store)
 
 # Cache for Gemini API responses
 api_cache = {}
@@ -75,6 +197,68 @@ db_cache = {}
 db_cache_lock = threading.Lock()
 DB_CACHE_TTL = 60  # 1 minute
 
+# Local recipe index used by the chatbot before calling Gemini
+recipe_index = RecipeIndex(
+    ttl=Config.RECIPE_INDEX_TTL,
+    confidence=Config.CHATBOT_RETRIEVAL_CONFIDENCE,
+    min_score=Config.CHATBOT_RETRIEVAL_MIN_SCORE
+)
+recipe_index_lock = threading.Lock()
+
+# Rolling conversation memory for the chatbot
+chat_memory = ConversationMemory(
+    window_tokens=Config.CHAT_MEMORY_WINDOW_TOKENS,
+    summary_tokens=Config.CHAT_MEMORY_SUMMARY_TOKENS
+)
+chat_memory_folding = set()  # user ids with a summary update in progress
+chat_memory_lock = threading.Lock()
+
+# Near-duplicate answer cache for the chatbot, warmed from chat_history on first use
+chat_answer_cache = SemanticCache(
+    threshold=Config.CHAT_CACHE_THRESHOLD,
+    max_entries=Config.CHAT_CACHE_MAX_ENTRIES,
+    ttl=Config.CHAT_CACHE_TTL
+)
+chat_answer_cache_warmed = threading.Event()
+chat_answer_cache_lock = threading.Lock()
+
+# Unused AI recipe candidates per user and form input, served on "regenerate"
+recipe_pool = CandidatePool(ttl=Config.RECIPE_POOL_TTL)
+
+# Meal plan templates keyed by normalized inputs, and the meals they are personalized with
+meal_plan_cache = MealPlanTemplateCache(
+    max_age=Config.MEAL_PLAN_CACHE_MAX_AGE,
+    max_serves=Config.MEAL_PLAN_CACHE_MAX_SERVES
+)
+meal_library = MealLibrary()
+
+# Columns stored next to recipes.image_url and users.image_url so pages can
+# reserve the image's space and paint a placeholder before it loads
+IMAGE_METADATA_COLUMNS = (
+    ('image_width', 'INT'),
+    ('image_height', 'INT'),
+    ('image_color', 'CHAR(7)'),
+    ('image_lqip', 'VARCHAR(1024)'),
+)
+
+# File name of the image in generated_recipes.recipe_data, kept by MySQL in an
+# indexed column so counting references to an upload never scans the JSON
+GENERATED_IMAGE_NAME_COLUMN = """VARCHAR(255) AS (
+    IF(JSON_VALID(recipe_data),
+       LEFT(SUBSTRING_INDEX(SUBSTRING_INDEX(
+           NULLIF(JSON_UNQUOTE(JSON_EXTRACT(recipe_data, '$.image_url')), 'null'), '?', 1), '/', -1), 255),
+       NULL)
+) STORED"""
+
+# Background workers that create resized image derivatives after uploads
+image_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='image-derivatives')
+pending_derivatives = set()  # source images with derivatives queued or being created
+pending_derivatives_lock = threading.Lock()
+
+# Metadata of images computed when they were ingested or generated, by file name
+image_metadata_cache = OrderedDict()
+image_metadata_cache_lock = threading.Lock()
+
 def get_from_cache(key):
     with db_cache_lock:
         if key in db_cache:
@@ -95,6 +279,52 @@ logging.basicConfig(level=logging.INFO)
 app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path, 'upload')
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Blob storage for uploads, generated images and audio (local folder or S3)
+upload_storage = create_storage(app.config, app.config['UPLOAD_FOLDER'])
+
+# Content-addressed storage for uploaded and generated images
+content_store = ContentStore(upload_storage, layout=shard_name)
+upload_etags = ETagCache()
+
+# Worker processes that validate and normalize uploaded images
+upload_ingestor = UploadIngestor(
+    workers=Config.UPLOAD_INGEST_WORKERS,
+    max_edge=Config.UPLOAD_MAX_EDGE,
+    quality=Config.UPLOAD_QUALITY
+)
+
+# Shared keep-alive HTTP client for remote image downloads
+download_client = get_download_client()
+
+# Generated images keyed by enhanced prompt and logo hash
+generated_image_cache = GeneratedImageCache(
+    max_bytes=Config.IMAGE_CACHE_MAX_BYTES,
+    max_entries=Config.IMAGE_CACHE_MAX_ENTRIES,
+    on_evict=lambda filename: release_image(filename)
+)
+
+# Perceptual hashes of stored images, loaded from image_hashes on first use
+image_hash_index = PerceptualHashIndex(max_distance=Config.IMAGE_DUPLICATE_DISTANCE)
+image_hash_index_loaded = False
+image_hash_index_lock = threading.Lock()
+
+# Cached recipe narration
+tts_service = TTSService(
+    upload_storage,
+    voice=Config.TTS_VOICE,
+    language_code=Config.TTS_LANGUAGE_CODE,
+    ssml_gender=Config.TTS_SSML_GENDER,
+    workers=Config.TTS_WORKERS,
+    layout=shard_name
+)
+
+# Worker pool and fair queue for Bytez image generation
+image_service = ImageGenerationService(
+    workers=Config.IMAGE_GENERATION_WORKERS,
+    max_queue=Config.IMAGE_GENERATION_MAX_QUEUE,
+    max_per_user=Config.IMAGE_GENERATION_MAX_PER_USER
+)
+
 # Custom Jinja2 filter for splitting strings
 @app.template_filter('split')
 def split_filter(s, delimiter=','):
@@ -143,24 +373,55 @@ def format_analysis_filter(s):
 # Configure Gemini AI
 genai.configure(api_key=app.config['GEMINI_API_KEY'])
 
-# Database connection pooling
-db_pool = mysql.connector.pooling.MySQLConnectionPool(
-    pool_name="recipe_pool",
-    pool_size=10,
-    pool_reset_session=True,
-    host=app.config['MYSQL_HOST'],
-    user=app.config['MYSQL_USER'],
-    password=app.config['MYSQL_PASSWORD'],
-    database=app.config['MYSQL_DB']
+# Database connection pooling; checkouts wait for a free connection instead of failing
+db_pool = BlockingConnectionPool(
+    partial(
+        mysql.connector.connect,
+        host=app.config['MYSQL_HOST'],
+        user=app.config['MYSQL_USER'],
+        password=app.config['MYSQL_PASSWORD'],
+        database=app.config['MYSQL_DB']
+    ),
+    size=app.config['DB_POOL_SIZE'],
+    max_overflow=app.config['DB_POOL_MAX_OVERFLOW'],
+    timeout=app.config['DB_POOL_TIMEOUT'],
+    reset_session=app.config['DB_POOL_RESET_SESSION'],
+    ping_interval=app.config['DB_POOL_PING_INTERVAL']
 )
 
+# Each request or CLI command shares one pooled connection, returned at teardown
+db_connections = ConnectionManager(db_pool.checkout, logger=app.logger,
+                                   hold_warning=app.config['DB_HOLD_WARNING'])
+
 def get_db_connection():
+    """
+    Check out a pooled connection
+
+    Inside a request (or CLI command) every call returns the same connection,
+    which goes back to the pool once each caller has closed it and at the
+    latest when the request ends. Background threads get their own.
+
+    Returns:
+        Connection proxy, or None if the pool could not provide one
+    """
     try:
-        connection = db_pool.get_connection()
-        return connection
+        return db_connections.acquire(g._get_current_object() if has_app_context() else None, stacklevel=2)
+    except PoolTimeoutError as e:
+        app.logger.error(f"Database pool exhausted: {e}")
+        return None
     except Error as e:
         app.logger.error(f"Error connecting to MySQL: {e}")
         return None
+
+@app.teardown_request
+def release_request_db_connection(error):
+    """Return the request's connection to the pool, logging it if it was never closed"""
+    db_connections.teardown(g._get_current_object(), error=error, label=request.endpoint)
+
+@app.teardown_appcontext
+def release_db_connection(error):
+    """Return the connection of an app context without a request, e.g. a CLI command"""
+    db_connections.teardown(g._get_current_object(), error=error)
 # Initialize database tables
 def create_default_admin():
     connection = get_db_connection()
@@ -239,6 +500,20 @@ def init_db():
         
         if cursor.fetchone()[0] == 0:
             cursor.execute("ALTER TABLE recipes ADD COLUMN audio_url VARCHAR(300)")
+
+        # Check if the image metadata columns exist next to recipes.image_url and users.image_url
+        for table in ('recipes', 'users'):
+            for column, definition in IMAGE_METADATA_COLUMNS:
+                cursor.execute("""
+                    SELECT COUNT(*)
+                    FROM information_schema.columns
+                    WHERE table_schema = %s
+                    AND table_name = %s
+                    AND column_name = %s
+                """, (app.config['MYSQL_DB'], table, column))
+
+                if cursor.fetchone()[0] == 0:
+                    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
         
         # Create favorites table
         cursor.execute('''
@@ -273,10 +548,35 @@ def init_db():
                 user_id INT,
                 message TEXT NOT NULL,
                 response TEXT NOT NULL,
+                cacheable BOOLEAN NOT NULL DEFAULT FALSE,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL
             )
         ''')
+
+        # Check if cacheable column exists in chat_history
+        cursor.execute("""
+            SELECT COUNT(*)
+            FROM information_schema.columns
+            WHERE table_schema = %s
+            AND table_name = 'chat_history'
+            AND column_name = 'cacheable'
+        """, (app.config['MYSQL_DB'],))
+
+        if cursor.fetchone()[0] == 0:
+            # Existing rows may have been answered with context, so none are shared
+            cursor.execute("ALTER TABLE chat_history ADD COLUMN cacheable BOOLEAN NOT NULL DEFAULT FALSE")
+        
+        # Create chat_memory table (running summary of older chatbot turns per user)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS chat_memory (
+                user_id INT PRIMARY KEY,
+                summary TEXT,
+                summarized_through INT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+            )
+        ''')
         
         # Create generated_recipes table
         cursor.execute('''
@@ -304,7 +604,44 @@ def init_db():
         if cursor.fetchone()[0] == 0:
             cursor.execute("ALTER TABLE generated_recipes ADD COLUMN saved_recipe_id INT")
             cursor.execute("ALTER TABLE generated_recipes ADD FOREIGN KEY (saved_recipe_id) REFERENCES recipes(id) ON DELETE SET NULL")
+
+        # Check if image_name column exists in generated_recipes
+        cursor.execute("""
+            SELECT COUNT(*)
+            FROM information_schema.columns
+            WHERE table_schema = %s
+            AND table_name = 'generated_recipes'
+            AND column_name = 'image_name'
+        """, (app.config['MYSQL_DB'],))
+
+        if cursor.fetchone()[0] == 0:
+            cursor.execute(f"""
+                ALTER TABLE generated_recipes ADD COLUMN image_name {GENERATED_IMAGE_NAME_COLUMN},
+                ADD INDEX idx_generated_recipes_image_name (image_name)
+            """)
+
+        # Check if image_url is indexed, so image reference counts are index lookups
+        for table in ('recipes', 'users'):
+            cursor.execute("""
+                SELECT COUNT(*)
+                FROM information_schema.statistics
+                WHERE table_schema = %s
+                AND table_name = %s
+                AND index_name = %s
+            """, (app.config['MYSQL_DB'], table, f'idx_{table}_image_url'))
+
+            if cursor.fetchone()[0] == 0:
+                cursor.execute(f"CREATE INDEX idx_{table}_image_url ON {table} (image_url)")
         
+        # Create image_hashes table (perceptual hash of each stored image)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS image_hashes (
+                filename VARCHAR(255) PRIMARY KEY,
+                dhash BIGINT UNSIGNED NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
         # Create nutrition_analysis table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS nutrition_analysis (
@@ -459,31 +796,545 @@ init_db()
 
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    # Flat names from before the sharded layout still resolve, during and after migration
+    resolved = resolve_upload(upload_storage, filename)
+    if not resolved:
+        # Derivatives of images uploaded before the pipeline existed are made in the background
+        derivative = parse_derivative_name(filename)
+        source = resolve_upload(upload_storage, derivative[0]) if derivative else None
+        if not source:
+            abort(404)
+        schedule_image_derivatives(source)
+        # The source stands in for the derivative meanwhile, so it must not be cached under this URL
+        response = send_upload(source)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return send_upload(resolved)
+
+# Helper function to serve an upload with immutable caching
+def send_upload(filename):
+    """
+    Send a file from the upload folder
+
+    Upload names never get new content (content-addressed, uuid-named or
+    derived from such a name), so responses are cacheable forever and carry
+    a strong ETag of the content hash. Range requests are answered with
+    206 Partial Content for seeking in audio.
+
+    With UPLOAD_OFFLOAD set, the file itself is streamed by the front proxy
+    via X-Accel-Redirect or X-Sendfile so workers are not tied up by slow clients.
+    With object storage, clients are redirected to fetch the bytes from it directly.
+    """
+    file_path = upload_storage.local_path(filename)
+    if not file_path:
+        object_url = upload_storage.presigned_url(filename, expires=app.config['STORAGE_URL_EXPIRES'])
+        if not object_url:
+            abort(404)
+        # The redirect may be cached for half the presigned URL's lifetime
+        response = redirect(object_url)
+        response.headers['Cache-Control'] = f"public, max-age={app.config['STORAGE_URL_EXPIRES'] // 2}"
+        return response
+    if not os.path.isfile(file_path):
+        abort(404)
+
+    upload_folder = app.config['UPLOAD_FOLDER']
+
+    offload = None if app.debug else app.config['UPLOAD_OFFLOAD']
+    if offload in ('nginx', 'sendfile'):
+        # Python only authorizes; the proxy streams the bytes (and ranges) itself
+        response = app.response_class(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.set_etag(upload_etags.etag(file_path))
+        response.make_conditional(request)
+        if response.status_code != 304:
+            if offload == 'nginx':
+                response.headers['X-Accel-Redirect'] = app.config['UPLOAD_ACCEL_PREFIX'] + urllib.parse.quote(filename)
+            else:
+                response.headers['X-Sendfile'] = file_path
+    else:
+        response = send_from_directory(upload_folder, filename, etag=upload_etags.etag(file_path),
+                                       max_age=app.config['UPLOAD_CACHE_MAX_AGE'])
+    response.headers['Cache-Control'] = f"public, max-age={app.config['UPLOAD_CACHE_MAX_AGE']}, immutable"
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+# Custom Jinja2 global for the URL of a recipe or profile image
+@app.template_global()
+def image_src(image_url):
+    """Return a displayable URL for an image_url column value."""
+    if not image_url:
+        return None
+    if image_url.startswith('http') or image_url.startswith('/'):
+        return image_url
+    return url_for('uploaded_file', filename=image_url)
+
+# Custom Jinja2 global for responsive image sources
+@app.template_global()
+def image_sources(image_url, fallback='card', width=None):
+    """
+    Return WebP and JPEG srcset strings for an uploaded image, or None for remote images.
+
+    With the source width known (image_width), each distinct derivative is
+    listed at the width it was actually rendered at; otherwise only the
+    fallback size is offered.
+    """
+    if image_url and image_url.startswith('/uploads/'):
+        image_url = image_url[len('/uploads/'):]
+    if not image_url or image_url.startswith('http') or image_url.startswith('/') or not supports_derivatives(image_url):
+        return None
+
+    def srcset(ext):
+        if not width:
+            return url_for('uploaded_file', filename=derivative_name(image_url, fallback, ext))
+        return ', '.join(f"{url_for('uploaded_file', filename=derivative_name(image_url, size, ext))} {size_width}w"
+                         for size, size_width in derivative_widths(width))
+
+    return {
+        'webp': srcset('webp'),
+        'jpeg': srcset('jpg'),
+        'fallback': url_for('uploaded_file', filename=derivative_name(image_url, fallback, 'jpg'))
+    }
 
 # Helper function to check allowed file extensions
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
+# Helper function to create the resized derivatives of an uploaded image
+def create_image_derivatives(filename):
+    source_path = upload_storage.local_path(filename)
+    if source_path:
+        written = create_derivatives(source_path)
+    else:
+        with Image.open(BytesIO(upload_storage.get(filename))) as image:
+            rendered = render_derivatives(image)
+        written = {}
+        for (size, ext), data in rendered.items():
+            name = derivative_name(filename, size, ext)
+            upload_storage.put(name, data)
+            written[name] = len(data)
+    app.logger.info(f"Created {len(written)} derivatives for {filename} ({sum(written.values())} bytes)")
+    return written
+
+# Helper function to create image derivatives without blocking the request
+def schedule_image_derivatives(filename):
+    if not supports_derivatives(filename):
+        return None
+    with pending_derivatives_lock:
+        if filename in pending_derivatives:
+            return None
+        pending_derivatives.add(filename)
+
+    def run():
+        try:
+            return create_image_derivatives(filename)
+        except Exception as e:
+            app.logger.error(f"Error creating derivatives for {filename}: {e}")
+        finally:
+            with pending_derivatives_lock:
+                pending_derivatives.discard(filename)
+
+    return image_executor.submit(run)
+
+# Helper function to compute the width, height, dominant colour and placeholder of an image
+def image_metadata_values(image_url):
+    """Return (width, height, color, lqip) for an image_url column value, or Nones if it cannot be read."""
+    if not image_url:
+        return (None, None, None, None)
+    try:
+        if image_url.startswith('http'):
+            data, _ = download_client.fetch_image(image_url)
+            metadata = describe_image_bytes(data)
+        else:
+            filename = image_url[len('/uploads/'):] if image_url.startswith('/uploads/') else image_url
+            path = resolve_upload(upload_storage, filename)
+            if not path:
+                return (None, None, None, None)
+            local_path = upload_storage.local_path(path)
+            metadata = describe_image_file(local_path) if local_path else describe_image_bytes(upload_storage.get(path))
+    except Exception as e:
+        app.logger.warning(f"Could not read image metadata for {image_url}: {e}")
+        return (None, None, None, None)
+    return (metadata['width'], metadata['height'], metadata['color'], metadata['lqip'])
+
+# Helper function to remember the metadata computed for a stored image
+def remember_image_metadata(filename, metadata):
+    with image_metadata_cache_lock:
+        image_metadata_cache[os.path.basename(filename)] = metadata
+        image_metadata_cache.move_to_end(os.path.basename(filename))
+        while len(image_metadata_cache) > app.config['IMAGE_METADATA_CACHE_SIZE']:
+            image_metadata_cache.popitem(last=False)
+
+# Helper function to store image metadata next to a row's image_url (caller commits)
+def store_image_metadata(cursor, table, row_id, image_url):
+    """
+    Write the metadata computed when the image was ingested or generated.
+
+    Images without known metadata (remote URLs, files from earlier runs) get NULLs here and are
+    read in the background, so the caller's transaction never waits on file or network I/O.
+    """
+    metadata = None
+    if image_url and not image_url.startswith('http'):
+        with image_metadata_cache_lock:
+            metadata = image_metadata_cache.get(os.path.basename(image_url))
+    values = (metadata['width'], metadata['height'], metadata['color'], metadata['lqip']) if metadata else (None,) * 4
+    cursor.execute(f"""
+        UPDATE {table} SET image_width = %s, image_height = %s, image_color = %s, image_lqip = %s
+        WHERE id = %s
+    """, (*values, row_id))
+    if image_url and not metadata:
+        schedule_image_metadata(table, row_id, image_url)
+
+# Helper function to read an image's metadata in the background and store it on its row
+def schedule_image_metadata(table, row_id, image_url):
+    def run():
+        values = image_metadata_values(image_url)
+        if values[0] is None:
+            return
+        connection = get_db_connection()
+        if not connection:
+            return
+        try:
+            cursor = connection.cursor()
+            # Waits for the caller's commit; rows whose image changed meanwhile are left alone
+            cursor.execute(f"""
+                UPDATE {table} SET image_width = %s, image_height = %s, image_color = %s, image_lqip = %s
+                WHERE id = %s AND image_url = %s
+            """, (*values, row_id, image_url))
+            connection.commit()
+            cursor.close()
+        except Error as e:
+            app.logger.error(f"Database error storing image metadata for {image_url}: {e}")
+        finally:
+            connection.close()
+
+    return image_executor.submit(run)
+
+# Helper function to validate, normalize and store an uploaded image under its content hash
+def save_uploaded_image(file):
+    """Store an uploaded image, raising IngestError if it is not a valid image."""
+    # The request thread only waits here; decoding and resizing run in a worker process
+    data, ext, metadata = upload_ingestor.ingest(file.read())
+    filename, created = content_store.put_bytes(data, ext)
+    remember_image_metadata(filename, metadata)
+    if created:
+        schedule_image_derivatives(filename)
+        image_executor.submit(record_image_hash, filename, data)
+    return filename
+
+# Helper function to load the perceptual hash index from the database once
+def ensure_image_hash_index():
+    global image_hash_index_loaded
+    with image_hash_index_lock:
+        if image_hash_index_loaded:
+            return
+        connection = get_db_connection()
+        if not connection:
+            return
+        try:
+            cursor = connection.cursor()
+            cursor.execute('SELECT filename, dhash FROM image_hashes')
+            for filename, value in cursor.fetchall():
+                image_hash_index.add(filename, int(value))
+            cursor.close()
+            image_hash_index_loaded = True
+            app.logger.info(f"Loaded {image_hash_index.stats()['images']} image hashes")
+        except Error as e:
+            app.logger.error(f"Error loading image hashes: {e}")
+        finally:
+            connection.close()
+
+# Helper function to index the perceptual hash of a stored image
+def record_image_hash(filename, data=None, value=None):
+    """Hash a stored image (from data if given) and add it to the index and image_hashes table"""
+    try:
+        if value is None:
+            value = hash_image_bytes(data if data is not None else upload_storage.get(filename))
+    except Exception as e:
+        app.logger.warning(f"Could not hash image {filename}: {e}")
+        return None
+    ensure_image_hash_index()
+    image_hash_index.add(filename, value)
+    connection = get_db_connection()
+    if connection:
+        try:
+            cursor = connection.cursor()
+            cursor.execute('INSERT INTO image_hashes (filename, dhash) VALUES (%s, %s) '
+                           'ON DUPLICATE KEY UPDATE dhash = VALUES(dhash)', (filename, value))
+            connection.commit()
+            cursor.close()
+        except Error as e:
+            app.logger.error(f"Error saving image hash for {filename}: {e}")
+        finally:
+            connection.close()
+    return value
+
+# Helper function to drop a deleted image from the perceptual hash index
+def forget_image_hash(filename):
+    image_hash_index.remove(filename)
+    connection = get_db_connection()
+    if connection:
+        try:
+            cursor = connection.cursor()
+            cursor.execute('DELETE FROM image_hashes WHERE filename = %s', (filename,))
+            connection.commit()
+            cursor.close()
+        except Error as e:
+            app.logger.error(f"Error deleting image hash for {filename}: {e}")
+        finally:
+            connection.close()
+
+# Helper function to find a stored image that looks the same as a hash
+def find_near_duplicate_image(value, exclude=()):
+    """Return the filename of the closest stored near-duplicate of a perceptual hash, or None"""
+    ensure_image_hash_index()
+    exclude = set(exclude)
+    while True:
+        match = image_hash_index.nearest(value, exclude=exclude)
+        if not match:
+            return None
+        if upload_storage.exists(match[0]):
+            app.logger.info(f"Near-duplicate image {match[0]} found at distance {match[1]}")
+            return match[0]
+        # Deleted outside release_image(); drop it and keep looking
+        forget_image_hash(match[0])
+        exclude.add(match[0])
+
+# Helper function to swap a stored image for an existing near-duplicate
+def deduplicate_image(filename):
+    """Return the filename of another stored image that looks the same, or filename itself"""
+    if not filename or filename.startswith(('http', '/')):
+        return filename
+    ensure_image_hash_index()
+    value = image_hash_index.get(filename)
+    if value is None:
+        value = record_image_hash(filename)
+        if value is None:
+            return filename
+    return find_near_duplicate_image(value, exclude={filename}) or filename
+
+# Helper function to build the generation cache key for a prompt and optional logo
+def image_generation_key(prompt, logo_bytes=None):
+    return image_cache_key(prompt, logo_hash(logo_bytes) if logo_bytes else None)
+
+# Helper function to find an already generated image without queueing a generation
+def cached_image_result(description, ingredients="", logo_bytes=None):
+    prompt = bytez_generator.build_enhanced_prompt(description, ingredients)
+    key = image_generation_key(prompt, logo_bytes)
+    cached = generated_image_cache.get(key)
+    cached_path = resolve_upload(upload_storage, cached) if cached else None
+    if cached_path:
+        # Reuse counts as a write, so the upload garbage collector's grace period restarts
+        upload_storage.touch(cached_path)
+        app.logger.info(f"Image served from generation cache: {cached}")
+        return {'success': True, 'filename': cached, 'prompt': prompt, 'cached': True}
+    if cached:
+        generated_image_cache.discard(key)
+    return None
+
+# Helper function to write a placeholder shown while a recipe image generates
+def create_image_placeholder(title):
+    filename = shard_name(f"temp_{uuid4().hex}.png")
+    upload_storage.put(filename, bytez_generator.generate_placeholder_bytes(title), 'image/png')
+    return filename
+
+# Helper function to store a generated recipe's final image in its recipe_data
+def set_generated_recipe_image(cursor, generated_recipe, image_url, image_prompt):
+    """
+    Replace a generated recipe's image (dictionary cursor, caller commits)
+
+    Clears the placeholder state, and if the recipe was saved while its image
+    was still generating, gives the saved recipe the image as well.
+    """
+    recipe_data = json.loads(generated_recipe['recipe_data'])
+    placeholder = recipe_data.pop('temp_filename', None) if recipe_data.pop('image_pending', False) else None
+    recipe_data.pop('image_status_url', None)
+    if image_url:
+        recipe_data['image_url'] = image_url
+        recipe_data['image_prompt'] = image_prompt
+    else:
+        recipe_data.pop('image_url', None)
+    cursor.execute('UPDATE generated_recipes SET recipe_data = %s WHERE id = %s',
+                   (json.dumps(recipe_data, ensure_ascii=False), generated_recipe['id']))
+
+    if image_url and generated_recipe.get('saved_recipe_id'):
+        filename = image_url.replace('/uploads/', '', 1) if image_url.startswith('/uploads/') else image_url
+        cursor.execute('UPDATE recipes SET image_url = %s, image_prompt = %s WHERE id = %s AND image_url IS NULL',
+                       (filename, image_prompt, generated_recipe['saved_recipe_id']))
+        if cursor.rowcount:
+            store_image_metadata(cursor, 'recipes', generated_recipe['saved_recipe_id'], filename)
+    if placeholder:
+        placeholder_path = resolve_upload(upload_storage, placeholder)
+        if placeholder_path:
+            upload_storage.delete(placeholder_path)
+
+# Helper function to record a queued image generation's result on its generated recipe
+def finish_generated_recipe_image(generated_recipe_id, user_id, future):
+    try:
+        result = future.result()
+    except Exception as e:
+        result = {'success': False, 'error': str(e)}
+    image_url = f"/uploads/{result['filename']}" if result.get('success') else None
+    if not image_url:
+        app.logger.warning(f"Image for generated recipe {generated_recipe_id} failed: {result.get('error')}")
+
+    connection = get_db_connection()
+    if not connection:
+        return
+    try:
+        cursor = connection.cursor(dictionary=True)
+        # Locking read: a concurrent save either committed saved_recipe_id already or waits for this commit
+        cursor.execute('SELECT * FROM generated_recipes WHERE id = %s AND user_id = %s FOR UPDATE', (generated_recipe_id, user_id))
+        generated_recipe = cursor.fetchone()
+        if generated_recipe and json.loads(generated_recipe['recipe_data']).get('image_pending'):
+            set_generated_recipe_image(cursor, generated_recipe, image_url, result.get('prompt'))
+            connection.commit()
+        cursor.close()
+    except (Error, json.JSONDecodeError, OSError) as e:
+        app.logger.error(f"Error attaching image to generated recipe {generated_recipe_id}: {e}")
+    finally:
+        connection.close()
+
+# Helper function to read a generated recipe's current image, None while it is still generating
+def generated_recipe_image_url(generated_recipe_id, user_id):
+    if not generated_recipe_id:
+        return None
+    connection = get_db_connection()
+    if not connection:
+        return None
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute('SELECT recipe_data FROM generated_recipes WHERE id = %s AND user_id = %s', (generated_recipe_id, user_id))
+        row = cursor.fetchone()
+        cursor.close()
+        recipe_data = json.loads(row['recipe_data']) if row else {}
+        return None if recipe_data.get('image_pending') else recipe_data.get('image_url')
+    except (Error, json.JSONDecodeError) as e:
+        app.logger.error(f"Error reading generated recipe {generated_recipe_id}: {e}")
+        return None
+    finally:
+        connection.close()
+
+# Helper function to identify the requester for fair image generation queueing
+def image_generation_user():
+    return session.get('user_id') or request.remote_addr
+
+# Helper function to generate a Bytez image, reusing the stored image for a repeated prompt
+def generate_cached_image(description, ingredients="", logo_bytes=None, force_new=False):
+    """
+    Generate a recipe image into upload storage
+
+    Args:
+        description: Dish description
+        ingredients: Optional ingredients string
+        logo_bytes: Optional logo image bytes to composite
+        force_new: Skip the cache and run a new inference for variety
+
+    Returns:
+        dict with 'success', 'filename', 'prompt', 'cached' or 'error' keys
+    """
+    if not force_new:
+        cached = cached_image_result(description, ingredients, logo_bytes)
+        if cached:
+            return cached
+    prompt = bytez_generator.build_enhanced_prompt(description, ingredients)
+    key = image_generation_key(prompt, logo_bytes)
+
+    # Decoded, logo-composited and validated in memory; the only disk write is the final blob
+    result = bytez_generator.generate_image_bytes(description=description, ingredients=ingredients,
+                                                  logo_bytes=logo_bytes)
+    if not result['success']:
+        return result
+
+    try:
+        image_hash = hash_image_bytes(result['image_bytes'])
+    except Exception as e:
+        app.logger.warning(f"Could not hash generated image: {e}")
+        image_hash = None
+    if image_hash is not None and not force_new:
+        # Bytez often returns near-identical compositions for similar dishes; reuse the stored one
+        duplicate = find_near_duplicate_image(image_hash)
+        if duplicate:
+            generated_image_cache.put(key, duplicate, len(result['image_bytes']))
+            return {'success': True, 'filename': duplicate, 'prompt': result.get('prompt', prompt), 'cached': False}
+
+    filename, created = content_store.put_bytes(result['image_bytes'], result['format'])
+    try:
+        remember_image_metadata(filename, describe_image_bytes(result['image_bytes']))
+    except Exception as e:
+        app.logger.warning(f"Could not read generated image metadata: {e}")
+    if created:
+        schedule_image_derivatives(filename)
+        if image_hash is not None:
+            record_image_hash(filename, value=image_hash)
+    generated_image_cache.put(key, filename, len(result['image_bytes']))
+    return {'success': True, 'filename': filename, 'prompt': result.get('prompt', prompt), 'cached': False}
+
+# Helper function to count the rows referencing an uploaded image
+def count_image_references(cursor, filename):
+    """Count rows referencing an upload by its flat or sharded name, using indexed columns only"""
+    forms = reference_forms(filename)
+    placeholders = ', '.join(['%s'] * len(forms))
+    references = 0
+    for table in ('recipes', 'users'):
+        cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE image_url IN ({placeholders})", forms)
+        references += cursor.fetchone()[0]
+    # Upload names are unique (content hashes or uuids), so the base name identifies the file
+    cursor.execute("SELECT COUNT(*) FROM generated_recipes WHERE image_name = %s", (forms[0],))
+    references += cursor.fetchone()[0]
+    return references
+
+# Helper function to delete an uploaded image once nothing references it
+def release_image(filename):
+    """Delete an upload and its derivatives if no recipe, user or generated recipe uses it"""
+    if not filename or filename.startswith('http'):
+        return False
+    filename = filename.replace('/uploads/', '', 1) if filename.startswith('/uploads/') else filename
+    stored_path = resolve_upload(upload_storage, filename)
+    if not stored_path:
+        return False
+
+    connection = get_db_connection()
+    if not connection:
+        return False
+    try:
+        cursor = connection.cursor()
+        references = count_image_references(cursor, stored_path)
+        cursor.close()
+    except Error as e:
+        app.logger.error(f"Error counting references to {filename}: {e}")
+        return False
+    finally:
+        connection.close()
+    if references:
+        return False
+
+    # The grace period keeps blobs that a concurrent upload has just deduplicated against
+    if not content_store.delete(stored_path, grace=app.config['IMAGE_RELEASE_GRACE']):
+        return False
+    forget_image_hash(stored_path)
+    for size in DERIVATIVE_WIDTHS:
+        for ext in DERIVATIVE_FORMATS:
+            upload_storage.delete(derivative_name(stored_path, size, ext))
+    app.logger.info(f"Released unreferenced image: {filename}")
+    return True
+
 # Helper function to cleanup temporary files
 def cleanup_temp_files():
     """Remove temporary image files and database records older than 30 minutes"""
     try:
-        upload_folder = app.config['UPLOAD_FOLDER']
         current_time = time.time()
         thirty_minutes_ago = current_time - 1800  # 30 minutes in seconds
         
-        # Clean up temporary image files
-        for filename in os.listdir(upload_folder):
-            if filename.startswith('temp_') and filename.endswith('.png'):
-                file_path = os.path.join(upload_folder, filename)
-                if os.path.getctime(file_path) < thirty_minutes_ago:
+        # Clean up temporary image files (they live in their own small directory)
+        for key, _, modified in list(upload_storage.list(f"{TEMP_DIR}/")):
+            name = os.path.basename(key)
+            if name.startswith('temp_') and name.endswith('.png'):
+                if modified < thirty_minutes_ago:
                     try:
-                        os.remove(file_path)
-                        app.logger.info(f"Cleaned up temporary file: {filename}")
+                        upload_storage.delete(key)
+                        app.logger.info(f"Cleaned up temporary file: {name}")
                     except Exception as e:
-                        app.logger.error(f"Error removing temp file {filename}: {e}")
+                        app.logger.error(f"Error removing temp file {name}: {e}")
         
         # Clean up unsaved generated recipes older than 30 minutes
         connection = get_db_connection()
@@ -522,6 +1373,43 @@ def get_user_info(user_id):
         return user
     return None
 
+# Helper function to get a user's stored allergies
+def get_user_allergies(user_id):
+    if not user_id:
+        return []
+    connection = get_db_connection()
+    if not connection:
+        return []
+    try:
+        cursor = connection.cursor()
+        cursor.execute('SELECT allergy FROM user_allergies WHERE user_id = %s', (user_id,))
+        allergies = [row[0] for row in cursor.fetchall() if row[0]]
+        cursor.close()
+        return allergies
+    except Error as e:
+        app.logger.error(f"Error fetching user allergies: {e}")
+        return []
+    finally:
+        connection.close()
+
+# Helper function to get the chatbot's recipe index, rebuilding it when stale
+def get_recipe_index():
+    if recipe_index.is_stale():
+        with recipe_index_lock:
+            if recipe_index.is_stale():
+                connection = get_db_connection()
+                if connection:
+                    try:
+                        cursor = connection.cursor(dictionary=True)
+                        cursor.execute('SELECT id, title, ingredients, instructions, category FROM recipes')
+                        recipe_index.build(cursor.fetchall())
+                        cursor.close()
+                    except Error as e:
+                        app.logger.error(f"Error building recipe index: {e}")
+                    finally:
+                        connection.close()
+    return recipe_index
+
 def call_gemini_api(prompt, model=None):
     app.logger.info(f"Calling Gemini API with prompt: {prompt[:100]}...")
 
@@ -592,6 +1480,34 @@ def clean_json_response(response_text):
     
     return None
 
+def build_recipe_prompt(ingredients, cuisine, meal_type, difficulty, dietary_restrictions, count=1):
+    """Build the AI recipe generator prompt asking for `count` distinct candidate recipes."""
+    # Build prompt with difficulty and cooking time constraints
+    difficulty_text = ''
+    if difficulty:
+        if difficulty == 'Easy':
+            difficulty_text = f' - Difficulty level: {difficulty} (cooking time should be 30 minutes or less)'
+        elif difficulty == 'Medium':
+            difficulty_text = f' - Difficulty level: {difficulty} (cooking time should be between 30 minutes to 1 hour)'
+        elif difficulty == 'Hard':
+            difficulty_text = f' - Difficulty level: {difficulty} (cooking time should be 1 hour or more)'
+
+    return f'Create {count} different recipes with the following requirements: - Main ingredients: {ingredients} - Cuisine style: {cuisine} - Meal type: {meal_type}{difficulty_text} - Dietary restrictions: {dietary_restrictions}. Each recipe must take a clearly different approach from the others. Provide the result in JSON format as an object with a single key "recipes" whose value is a list of {count} recipe objects, each with these fields: title (create a unique, creative recipe name using the main ingredients provided - avoid generic names, make it specific and distinctive. DO NOT include any time-related words like "20-minute", "quick", "fast", "instant", "speedy", "rapid" in the title), description, ingredients (as a list of strings), instructions (as a list of strings), cooking_time (e.g., "30 minutes"), difficulty (must be exactly "Easy", "Medium", or "Hard"{" and set to " + difficulty if difficulty else ""}), category, nutritional_info (as a JSON object). Only return the JSON, no additional text.'
+
+def parse_recipe_candidates(response_text):
+    """Extract the list of candidate recipes from a recipe generator response."""
+    recipe_json = clean_json_response(response_text or '')
+    if not recipe_json:
+        return []
+    data = json.loads(recipe_json)
+    if isinstance(data, dict) and isinstance(data.get('recipes'), list):
+        candidates = data['recipes']
+    elif isinstance(data, dict):
+        candidates = [data]
+    else:
+        candidates = data if isinstance(data, list) else []
+    return [c for c in candidates if isinstance(c, dict) and c.get('title')]
+
 def normalize_cooking_time(cooking_time):
     """Normalize cooking_time to integer (minutes) for consistent processing"""
     if not cooking_time:
@@ -1215,12 +2131,8 @@ def add_recipe():
         if 'image' in request.files:
             file = request.files['image']
             if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                unique_filename = f"{uuid4().hex}_{filename}"
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
                 try:
-                    file.save(filepath)
-                    image_url = unique_filename
+                    image_url = save_uploaded_image(file)
                 except Exception as e:
                     flash(f'Error saving image: {str(e)}', 'danger')
             elif file and file.filename and not allowed_file(file.filename):
@@ -1257,9 +2169,12 @@ def add_recipe():
                 INSERT INTO recipes (title, ingredients, instructions, cooking_time, difficulty, category, image_url, nutritional_info, created_by)
                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
             """, (title, ingredients, instructions, cooking_time, difficulty, category, image_url, nutritional_info, session['user_id']))
+            if image_url:
+                store_image_metadata(cursor, 'recipes', cursor.lastrowid, image_url)
             connection.commit()
             cursor.close()
             connection.close()
+            recipe_index.invalidate()
             
             flash('Recipe added successfully', 'success')
             return redirect(url_for('manage_recipes'))
@@ -1289,27 +2204,31 @@ def edit_recipe(recipe_id):
         if 'image' in request.files:
             file = request.files['image']
             if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                unique_filename = f"{uuid4().hex}_{filename}"
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
                 try:
-                    file.save(filepath)
-                    image_url = unique_filename
+                    image_url = save_uploaded_image(file)
                 except Exception as e:
                     flash(f'Error saving image: {str(e)}', 'danger')
             elif file and file.filename and not allowed_file(file.filename):
                 flash('Invalid image file type.', 'danger')
         
         cursor = connection.cursor()
+        cursor.execute('SELECT image_url FROM recipes WHERE id = %s', (recipe_id,))
+        row = cursor.fetchone()
+        previous_image = row[0] if row else None
         cursor.execute("""
             UPDATE recipes 
             SET title = %s, ingredients = %s, instructions = %s, cooking_time = %s, 
                 difficulty = %s, category = %s, image_url = %s
             WHERE id = %s
         """, (title, ingredients, instructions, cooking_time, difficulty, category, image_url, recipe_id))
+        if image_url != previous_image:
+            store_image_metadata(cursor, 'recipes', recipe_id, image_url)
         connection.commit()
         cursor.close()
         connection.close()
+        recipe_index.invalidate()
+        if previous_image and previous_image != image_url:
+            release_image(previous_image)
         
         flash('Recipe updated successfully', 'success')
         return redirect(url_for('manage_recipes'))
@@ -1335,10 +2254,15 @@ def delete_recipe(recipe_id):
     connection = get_db_connection()
     if connection:
         cursor = connection.cursor()
+        cursor.execute('SELECT image_url FROM recipes WHERE id = %s', (recipe_id,))
+        row = cursor.fetchone()
         cursor.execute('DELETE FROM recipes WHERE id = %s', (recipe_id,))
         connection.commit()
         cursor.close()
         connection.close()
+        recipe_index.invalidate()
+        if row and row[0]:
+            release_image(row[0])
         
         flash('Recipe deleted successfully', 'success')
         return jsonify({'status': 'success'})
@@ -1477,6 +2401,73 @@ def admin_stats():
 
     return render_template('admin/stats.html')
 
+@app.route('/admin/api/metrics')
+def admin_metrics():
+    if 'user_id' not in session or not session.get('is_admin'):
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    return jsonify({
+        'chatbot_answer_cache': chat_answer_cache.stats(),
+        'recipe_candidate_pool': recipe_pool.stats(),
+        'meal_plan_template_cache': meal_plan_cache.stats(),
+        'content_store': content_store.stats(),
+        'generated_image_cache': generated_image_cache.stats(),
+        'image_generation_queue': image_service.stats(),
+        'upload_ingest': upload_ingestor.stats(),
+        'image_hash_index': image_hash_index.stats(),
+        'tts': tts_service.stats(),
+        'logo_store': logo_store.stats(),
+        'db_connections': db_connections.stats(),
+        'db_pool': db_pool.stats()
+    })
+
+@app.route('/admin/api/image_duplicates')
+def admin_image_duplicates():
+    """Report groups of stored images that look the same, with their references and sizes."""
+    if 'user_id' not in session or not session.get('is_admin'):
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    ensure_image_hash_index()
+    max_distance = request.args.get('max_distance', type=int)
+    limit = request.args.get('limit', 100, type=int)
+    clusters = image_hash_index.clusters(max_distance)
+
+    connection = get_db_connection()
+    if not connection:
+        return jsonify({'error': 'Database connection failed'}), 500
+    report = []
+    redundant_bytes = 0
+    try:
+        cursor = connection.cursor()
+        for cluster in clusters[:limit]:
+            images = []
+            for filename in cluster:
+                stat = upload_storage.stat(filename)
+                images.append({
+                    'filename': filename,
+                    'url': url_for('uploaded_file', filename=filename),
+                    'references': count_image_references(cursor, filename),
+                    'bytes': stat[0] if stat else None
+                })
+            # Keeping the most referenced image makes every other copy redundant
+            images.sort(key=lambda image: image['references'], reverse=True)
+            cluster_redundant = sum(image['bytes'] or 0 for image in images[1:])
+            redundant_bytes += cluster_redundant
+            report.append({'images': images, 'redundant_bytes': cluster_redundant})
+        cursor.close()
+    except Error as e:
+        app.logger.error(f"Error building duplicate image report: {e}")
+        return jsonify({'error': 'Database error'}), 500
+    finally:
+        connection.close()
+
+    return jsonify({
+        'clusters': report,
+        'cluster_count': len(clusters),
+        'redundant_bytes': redundant_bytes,
+        'index': image_hash_index.stats()
+    })
+
 @app.route('/admin/delete_review/<int:review_id>', methods=['POST'])
 def delete_review(review_id):
     if 'user_id' not in session or not session.get('is_admin'):
@@ -1507,6 +2498,34 @@ def chatbot():
         if not message:
             return jsonify({'error': 'Message is required'}), 400
 
+        # Look the question up in our own recipes before calling Gemini
+        index = get_recipe_index()
+        matches = index.search(message)
+        best_match = index.confident_match(matches)
+
+        if best_match:
+            app.logger.info(f"Chatbot answered from recipe catalog: {best_match.recipe.get('title')}")
+            response_text = format_recipe_answer(best_match.recipe)
+            save_chat_history(message, response_text)
+            return jsonify({'response': response_text, 'source': 'catalog', 'recipe_id': best_match.recipe.get('id')})
+
+        # Only follow-ups ("how long do I bake it?") are answered with the conversation; standalone
+        # questions are answered without it, so their replies can be shared through the cache
+        history = ''
+        if 'user_id' in session and is_follow_up(message):
+            history = load_chat_context(session['user_id'])
+
+        # The cache is shared by all users, so it only answers questions asked without context
+        cached_response, similarity = get_chat_answer_cache().lookup(message, context=history)
+        if cached_response:
+            app.logger.info(f"Chatbot answered from semantic cache (similarity {similarity:.2f})")
+            save_chat_history(message, cached_response)
+            return jsonify({'response': cached_response, 'source': 'cache'})
+
+        grounding = format_grounding_context(index.grounding_matches(matches))
+        if grounding:
+            grounding += '\n\n'
+
         prompt = f'''You are a helpful Recipe Assistant. Your goal is to provide clear and simple cooking instructions.
 
 When a user asks for a recipe, you must provide:
@@ -1535,28 +2554,119 @@ Heat a lightly oiled griddle or frying pan over medium-high heat.
 Pour or scoop the batter onto the griddle, using approximately 1/4 cup for each pancake.
 Cook until bubbles appear on the surface, then flip and cook until browned on the other side.
 
-The user asked: "{message}"'''
+{history}{grounding}The user asked: "{message}"'''
 
         response_text = call_gemini_api(prompt)
 
         # Clean the response to remove any markdown-like formatting
         response_text = response_text.replace('*', '').replace('#', '')
 
-        if 'user_id' in session:
-            try:
+        cacheable = not history and not response_text.startswith("Sorry")
+        if cacheable:
+            chat_answer_cache.add(message, response_text)
+        save_chat_history(message, response_text, cacheable=cacheable)
+
+        return jsonify({'response': response_text})
+
+    return render_template('chatbot.html')
+
+# Helper function to get the chatbot answer cache, loading past answers the first time
+def get_chat_answer_cache():
+    if not chat_answer_cache_warmed.is_set():
+        with chat_answer_cache_lock:
+            if not chat_answer_cache_warmed.is_set():
                 connection = get_db_connection()
                 if connection:
+                    try:
+                        cursor = connection.cursor(dictionary=True)
+                        # Only replies generated without conversation context may be shared
+                        cursor.execute('SELECT message, response, created_at FROM chat_history WHERE cacheable = TRUE ORDER BY id DESC LIMIT %s',
+                                       (app.config['CHAT_CACHE_WARM_ROWS'],))
+                        for row in reversed(cursor.fetchall()):
+                            if row['response'] and not row['response'].startswith("Sorry"):
+                                chat_answer_cache.add(row['message'], row['response'], timestamp=row['created_at'].timestamp())
+                        cursor.close()
+                    except Error as e:
+                        app.logger.error(f"Error warming chatbot answer cache: {e}")
+                    finally:
+                        connection.close()
+                chat_answer_cache_warmed.set()
+    return chat_answer_cache
+
+# Helper function to build the bounded conversation context for a user's next prompt
+def load_chat_context(user_id):
+    connection = get_db_connection()
+    if not connection:
+        return ''
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute('SELECT summary, summarized_through FROM chat_memory WHERE user_id = %s', (user_id,))
+        memory_row = cursor.fetchone() or {'summary': '', 'summarized_through': 0}
+        cursor.execute('SELECT id, message, response FROM chat_history WHERE user_id = %s AND id > %s ORDER BY id DESC LIMIT %s',
+                       (user_id, memory_row['summarized_through'], app.config['CHAT_MEMORY_MAX_TURNS']))
+        turns = list(reversed(cursor.fetchall()))
+        cursor.close()
+    except Error as e:
+        app.logger.error(f"Database error loading chat memory: {e}")
+        return ''
+    finally:
+        connection.close()
+
+    older_turns, window_turns = chat_memory.split_turns(turns)
+    if older_turns:
+        # Fold turns that left the window into the summary without delaying this reply
+        fold_chat_memory_async(user_id, memory_row['summary'], older_turns)
+    return chat_memory.build_context(memory_row['summary'], window_turns)
+
+# Helper function to fold older chatbot turns into the stored summary in the background
+def fold_chat_memory_async(user_id, summary, older_turns):
+    with chat_memory_lock:
+        if user_id in chat_memory_folding:
+            return
+        chat_memory_folding.add(user_id)
+
+    def fold():
+        try:
+            raw_summary = call_gemini_api(chat_memory.build_summary_prompt(summary, older_turns))
+            if raw_summary.startswith("Sorry"):
+                return
+            new_summary = chat_memory.clamp_summary(raw_summary)
+            connection = get_db_connection()
+            if connection:
+                try:
                     cursor = connection.cursor()
-                    cursor.execute('INSERT INTO chat_history (user_id, message, response) VALUES (%s, %s, %s)', (session['user_id'], message, response_text))
+                    cursor.execute('''
+                        INSERT INTO chat_memory (user_id, summary, summarized_through) VALUES (%s, %s, %s)
+                        ON DUPLICATE KEY UPDATE summary = VALUES(summary), summarized_through = VALUES(summarized_through)
+                    ''', (user_id, new_summary, older_turns[-1]['id']))
                     connection.commit()
                     cursor.close()
+                except Error as e:
+                    app.logger.error(f"Database error saving chat memory: {e}")
+                finally:
                     connection.close()
-            except Error as e:
-                app.logger.error(f"Database error in chatbot: {e}")
+        finally:
+            with chat_memory_lock:
+                chat_memory_folding.discard(user_id)
 
-        return jsonify({'response': response_text})
+    threading.Thread(target=fold, daemon=True).start()
 
-    return render_template('chatbot.html')
+# Helper function to record a chatbot exchange for the logged in user
+# (cacheable marks replies generated without conversation context, which may warm the shared answer cache)
+def save_chat_history(message, response_text, cacheable=False):
+    if 'user_id' not in session:
+        return
+    try:
+        connection = get_db_connection()
+        if connection:
+            cursor = connection.cursor()
+            cursor.execute('INSERT INTO chat_history (user_id, message, response, cacheable) VALUES (%s, %s, %s, %s)',
+                           (session['user_id'], message, response_text, cacheable))
+            connection.commit()
+            cursor.close()
+            connection.close()
+    except Error as e:
+        app.logger.error(f"Database error in chatbot: {e}")
 
 @app.route('/nutrition_helper', methods=['GET', 'POST'])
 @login_required
@@ -1629,54 +2739,74 @@ def meal_planner():
         days = int(request.form.get('days', 7))
         app.logger.info(f"Meal planner POST request with prefs: {dietary_preferences}, allergies: {allergies}, days: {days}")
         
-        prompt = f"""
-        Create a {days}-day meal plan with the following requirements:
-        - Dietary preferences: {dietary_preferences}
-        - Allergies: {allergies}
-
-        IMPORTANT: You must generate exactly {days} days in the meal plan. Each day must have a unique day name like "Day 1", "Day 2", up to "Day {days}".
-
-        Format your response as a JSON object with a single key "days".
-        The value of "days" should be a list of exactly {days} day objects.
-        Each day object should have a "day" name (e.g., "Day 1") and a list of "meals".
-        Each meal object should have "type", "name", "description", "ingredients" (as a list of strings), and "prep_time".
-
-        Example format:
-        {{
-          "days": [
+        # Reuse a cached plan for these inputs when it is still fresh, personalized for this user
+        template_key = plan_key(dietary_preferences, allergies, days)
+        meal_plan_nested = None
+        meal_plan_json = None
+        user_allergies = get_user_allergies(user_id) + list(template_key[1])
+        # Allergies the allergen table does not cover are left to the model
+        template = None
+        if all(is_known_allergy(allergy) for allergy in user_allergies):
+            template = meal_plan_cache.get(template_key)
+        if template:
+            meal_plan_nested = personalize_plan(template, meal_library, template_key[0], user_allergies,
+                                                app.config['MEAL_PLAN_SUBSTITUTION_RATE'])
+            if meal_plan_nested:
+                app.logger.info(f"Meal plan served from template cache for key: {template_key}")
+
+        if meal_plan_nested is None:
+            prompt = f"""
+            Create a {days}-day meal plan with the following requirements:
+            - Dietary preferences: {dietary_preferences}
+            - Allergies: {allergies}
+
+            IMPORTANT: You must generate exactly {days} days in the meal plan. Each day must have a unique day name like "Day 1", "Day 2", up to "Day {days}".
+
+            Format your response as a JSON object with a single key "days".
+            The value of "days" should be a list of exactly {days} day objects.
+            Each day object should have a "day" name (e.g., "Day 1") and a list of "meals".
+            Each meal object should have "type", "name", "description", "ingredients" (as a list of strings), and "prep_time".
+
+            Example format:
             {{
-              "day": "Day 1",
-              "meals": [
+              "days": [
                 {{
-                  "type": "Breakfast",
-                  "name": "Oatmeal",
-                  "description": "...",
-                  "ingredients": ["1 cup oats", "2 cups milk"],
-                  "prep_time": "5 minutes"
+                  "day": "Day 1",
+                  "meals": [
+                    {{
+                      "type": "Breakfast",
+                      "name": "Oatmeal",
+                      "description": "...",
+                      "ingredients": ["1 cup oats", "2 cups milk"],
+                      "prep_time": "5 minutes"
+                    }}
+                  ]
                 }}
               ]
             }}
-          ]
-        }}
 
-        Only return the JSON object, with no additional text or markdown.
-        """
+            Only return the JSON object, with no additional text or markdown.
+            """
         
-        raw_response = call_gemini_api(prompt)
+            raw_response = call_gemini_api(prompt)
         
-        if raw_response.startswith("Sorry"):
-            flash(raw_response, 'danger')
-            return render_template('meal_planner.html', form_data=request.form)
+            if raw_response.startswith("Sorry"):
+                flash(raw_response, 'danger')
+                return render_template('meal_planner.html', form_data=request.form)
 
-        meal_plan_json = clean_json_response(raw_response)
+            meal_plan_json = clean_json_response(raw_response)
 
-        if not meal_plan_json:
-            flash("Sorry, the AI returned an invalid format. Please try again.", 'danger')
-            app.logger.error(f"Meal Plan Clean Error: Could not extract JSON from response: {raw_response}")
-            return render_template('meal_planner.html', form_data=request.form)
+            if not meal_plan_json:
+                flash("Sorry, the AI returned an invalid format. Please try again.", 'danger')
+                app.logger.error(f"Meal Plan Clean Error: Could not extract JSON from response: {raw_response}")
+                return render_template('meal_planner.html', form_data=request.form)
 
         try:
-            meal_plan_nested = json.loads(meal_plan_json)
+            if meal_plan_nested is None:
+                meal_plan_nested = json.loads(meal_plan_json)
+                if is_valid_plan(meal_plan_nested, days):
+                    meal_plan_cache.put(template_key, meal_plan_nested)
+                    meal_library.add_plan(template_key[0], meal_plan_nested)
 
             # The user wants to see the generated meal plan on the meal_planner page,
             # not a diet plan page. We pass the generated plan to the template.
@@ -1864,69 +2994,41 @@ def generate_recipe_image_endpoint():
         prompt = data.get("prompt", "")
         ingredients = data.get("ingredients", "")
         logo_base64 = data.get("logo_file", None)
+        force_new = bool(data.get("force_new", False))
 
         if not prompt:
             return jsonify({"error": "Prompt is required"}), 400
         
         # Handle logo if provided
-        logo_path = None
+        logo_bytes = None
         if logo_base64:
             try:
-                # Save logo temporarily
                 logo_bytes = base64.b64decode(logo_base64.split(',')[1] if ',' in logo_base64 else logo_base64)
-                temp_dir = tempfile.gettempdir()
-                logo_path = os.path.join(temp_dir, f"logo_{uuid4().hex}.png")
-                with open(logo_path, 'wb') as f:
-                    f.write(logo_bytes)
+                # Decoded (and validated) once; later generations with this logo reuse it
+                logo_store.put(logo_bytes)
             except Exception as e:
                 app.logger.warning(f"Logo processing failed: {e}")
-                logo_path = None
+                logo_bytes = None
         
-        # Generate image using Bytez
-        result = bytez_generator.generate_image(
-            description=prompt,
-            ingredients=ingredients,
-            logo_path=logo_path
-        )
-        
-        # Clean up temp logo
-        if logo_path and os.path.exists(logo_path):
-            try:
-                os.remove(logo_path)
-            except:
-                pass
-        
-        if result['success']:
-            # Copy image to upload folder
-            temp_image_path = result['image_path']
-            unique_filename = f"{uuid4().hex}.png"
-            final_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-            
-            # Copy file
-            import shutil
-            shutil.copy2(temp_image_path, final_path)
-            
-            # Clean up temp file
-            try:
-                os.remove(temp_image_path)
-            except:
-                pass
-            
-            # Use relative URL for compatibility with port forwarding
-            final_image_url = url_for('uploaded_file', filename=unique_filename)
-            
-            return jsonify({
-                "success": True,
-                "image_prompt": result.get('prompt', prompt),
-                "image_url": final_image_url,
-                "user": "Bytez Photoreal AI",
-                "note": "Image generated by Bytez AI"
-            })
-        else:
-            return jsonify({
-                "success": False,
-                "error": result.get('error', 'Image generation failed')
-            }), 500
+        # Reuse the image for an identical prompt and logo without queueing
+        result = None if force_new else cached_image_result(prompt, ingredients, logo_bytes)
+        if result:
+            return jsonify(image_generation_response(result))
+
+        # Otherwise queue the generation; the client polls the status URL
+        try:
+            job_id, _ = image_service.submit(image_generation_user(), generate_cached_image, prompt, ingredients,
+                                             logo_bytes=logo_bytes, force_new=force_new)
+        except QueueFullError as e:
+            return jsonify({"success": False, "error": str(e)}), 429
+
+        return jsonify({
+            "success": True,
+            "queued": True,
+            "job_id": job_id,
+            "position": image_service.position(job_id),
+            "status_url": url_for('image_generation_status', job_id=job_id)
+        }), 202
             
     except Exception as e:
         app.logger.error(f"Error during image generation: {e}")
@@ -1936,6 +3038,35 @@ def generate_recipe_image_endpoint():
         }), 500
 
 
+@app.route('/generate_recipe_image/status/<job_id>')
+def image_generation_status(job_id):
+    """Report the queue position or result of a queued image generation"""
+    status = image_service.status(job_id, image_generation_user())
+    if status['state'] == 'unknown':
+        return jsonify({"success": False, "state": "unknown", "error": "Unknown image generation job"}), 404
+    if status['state'] == 'failed':
+        return jsonify({"success": False, "state": "failed", "error": status['error']}), 500
+    if status['state'] == 'done':
+        result = status['result']
+        if not result['success']:
+            return jsonify({"success": False, "state": "failed",
+                            "error": result.get('error', 'Image generation failed')}), 500
+        return jsonify(dict(image_generation_response(result), state='done'))
+    return jsonify({"success": True, "state": status['state'], "position": status.get('position')})
+
+# Helper function to build the JSON response for a finished image generation
+def image_generation_response(result):
+    return {
+        "success": True,
+        "image_prompt": result['prompt'],
+        # Use relative URL for compatibility with port forwarding
+        "image_url": url_for('uploaded_file', filename=result['filename']),
+        "cached": result['cached'],
+        "user": "Bytez Photoreal AI",
+        "note": "Image generated by Bytez AI"
+    }
+
+
 @app.route('/ai_recipe_generator', methods=['GET', 'POST'])
 @login_required
 def ai_recipe_generator():
@@ -1957,41 +3088,48 @@ def ai_recipe_generator():
             flash('Please enter at least some ingredients', 'danger')
             return redirect(url_for('ai_recipe_generator'))
         
-        # Build prompt with difficulty and cooking time constraints
-        difficulty_text = ''
-        if difficulty:
-            if difficulty == 'Easy':
-                difficulty_text = f' - Difficulty level: {difficulty} (cooking time should be 30 minutes or less)'
-            elif difficulty == 'Medium':
-                difficulty_text = f' - Difficulty level: {difficulty} (cooking time should be between 30 minutes to 1 hour)'
-            elif difficulty == 'Hard':
-                difficulty_text = f' - Difficulty level: {difficulty} (cooking time should be 1 hour or more)'
-        
-        prompt = f'Create a recipe with the following requirements: - Main ingredients: {ingredients} - Cuisine style: {cuisine} - Meal type: {meal_type}{difficulty_text} - Dietary restrictions: {dietary_restrictions}. Provide the recipe in JSON format with these fields: title (create a unique, creative recipe name using the main ingredients provided - avoid generic names, make it specific and distinctive. DO NOT include any time-related words like "20-minute", "quick", "fast", "instant", "speedy", "rapid" in the title), description, ingredients (as a list of strings), instructions (as a list of strings), cooking_time (e.g., "30 minutes"), difficulty (must be exactly "Easy", "Medium", or "Hard"{" and set to " + difficulty if difficulty else ""}), category, nutritional_info (as a JSON object). Only return the JSON, no additional text.'
-        
-        raw_response = call_gemini_api(prompt)
+        # "Regenerate" is served from unused candidates of earlier generations with the same inputs;
+        # a fresh submission always asks Gemini for a single recipe so it is not slowed down by the pool
+        regenerate = request.form.get('regenerate') == '1'
+        candidate_key = pool_key(user_id, request.form)
+        pooled = recipe_pool.take(candidate_key) if regenerate else None
+
+        if pooled:
+            # Keep the prompt of the batch the candidate came from for the history record
+            recipe, prompt = pooled
+            app.logger.info(f"Serving pooled recipe candidate: {recipe.get('title', 'Unknown')}")
+        else:
+            prompt = build_recipe_prompt(ingredients, cuisine, meal_type, difficulty, dietary_restrictions)
+            raw_response = call_gemini_api(prompt)
 
-        if raw_response.startswith("Sorry"):
-            flash(raw_response, 'danger')
-            return render_template('ai_recipe_generator.html', form_data=request.form)
-        
-        recipe_json = clean_json_response(raw_response)
+            if raw_response.startswith("Sorry"):
+                flash(raw_response, 'danger')
+                return render_template('ai_recipe_generator.html', form_data=request.form)
 
-        if not recipe_json:
-            flash("Sorry, the AI returned an invalid format. Please try again.", 'danger')
-            app.logger.error(f"AI Recipe Gen Clean Error: Could not extract JSON from response: {raw_response}")
-            return render_template('ai_recipe_generator.html', form_data=request.form)
+            candidates = parse_recipe_candidates(raw_response)
+
+            if not candidates:
+                flash("Sorry, the AI returned an invalid format. Please try again.", 'danger')
+                app.logger.error(f"AI Recipe Gen Clean Error: Could not extract JSON from response: {raw_response}")
+                return render_template('ai_recipe_generator.html', form_data=request.form)
+
+            recipe = candidates.pop(0)
+            recipe_pool.put_many(candidate_key, candidates, prompt)
+
+        # Keep candidates ready for the next "regenerate"; the batch is generated in the background
+        refill_prompt = build_recipe_prompt(ingredients, cuisine, meal_type, difficulty, dietary_restrictions,
+                                            app.config['RECIPE_CANDIDATES'])
+        recipe_pool.refill_async(candidate_key, lambda: parse_recipe_candidates(call_gemini_api(refill_prompt)),
+                                 refill_prompt)
 
         try:
-            recipe = json.loads(recipe_json)
-            
             # Normalize cooking_time to integer (minutes) for consistent processing
             recipe['cooking_time'] = normalize_cooking_time(recipe.get('cooking_time'))
             
             # Automatically generate image for the recipe
             recipe_image_url = None
             recipe_image_prompt = None
-            temp_image_path = None
+            image_future = None
             try:
                 # Clean up old temporary files first (older than 1 hour)
                 cleanup_temp_files()
@@ -2001,31 +3139,26 @@ def ai_recipe_generator():
                 # Generate image using Bytez with optimized description for speed
                 enhanced_description = f"{recipe.get('title', 'food')} - no white rice, fully mixed spiced dish"
                 
-                image_result = bytez_generator.generate_image(
-                    description=enhanced_description,
-                    ingredients=""
-                )
-                
-                if image_result['success']:
-                    # Copy to uploads immediately for display, but mark as temporary
-                    temp_image_path = image_result['image_path']
-                    unique_filename = f"temp_{uuid4().hex}.png"
-                    final_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-                    
-                    # Copy the file for immediate display
-                    try:
-                        shutil.copy2(temp_image_path, final_path)
-                        # Clean up original temp file
-                        os.remove(temp_image_path)
-                    except Exception as copy_error:
-                        app.logger.error(f"Error copying temp image: {copy_error}")
+                image_result = cached_image_result(enhanced_description)
+                if not image_result:
+                    # Render right away with a placeholder; the queued image is swapped in when it finishes
+                    image_job_id, image_future = image_service.submit(image_generation_user(), generate_cached_image,
+                                                                      enhanced_description)
+                    placeholder_filename = create_image_placeholder(recipe.get('title', 'food'))
+                    recipe['image_url'] = url_for('uploaded_file', filename=placeholder_filename)
+                    recipe['temp_filename'] = placeholder_filename
+                    recipe['image_pending'] = True
+                    recipe['image_status_url'] = url_for('image_generation_status', job_id=image_job_id)
+                    app.logger.info(f"Image queued as job {image_job_id}, showing placeholder {placeholder_filename}")
+                elif image_result['success']:
+                    # Stored in upload storage right away; repeated titles reuse the cached image
+                    unique_filename = image_result['filename']
                     
                     # Use relative URL for immediate display
                     recipe_image_url = url_for('uploaded_file', filename=unique_filename)
-                    recipe_image_prompt = image_result.get('prompt', '')
+                    recipe_image_prompt = image_result['prompt']
                     recipe['image_url'] = recipe_image_url
                     recipe['image_prompt'] = recipe_image_prompt
-                    recipe['temp_filename'] = unique_filename  # Store temp filename for cleanup
                     
                     app.logger.info(f"Image generated and ready for display: {unique_filename}")
                 else:
@@ -2048,6 +3181,13 @@ def ai_recipe_generator():
                 connection.commit()
                 cursor.close()
                 connection.close()
+
+            # Record the final image on the generated recipe even if the user has left the page
+            if image_future and generated_recipe_id:
+                image_future.add_done_callback(
+                    lambda future, recipe_id=generated_recipe_id, owner_id=user_id:
+                        finish_generated_recipe_image(recipe_id, owner_id, future)
+                )
             
             # Fetch updated recipe history including the newly generated recipe (only unsaved ones)
             recipe_history = []
@@ -2079,7 +3219,7 @@ def ai_recipe_generator():
                 error_message = "Sorry, the AI returned an invalid format. Please try again."
 
             flash(error_message, 'danger')
-            app.logger.error(f"AI Recipe Gen Error: {e}\nResponse was: {recipe_json}")
+            app.logger.error(f"AI Recipe Gen Error: {e}")
             return render_template('ai_recipe_generator.html', form_data=request.form)
     
     # For GET request, show history of generated recipes (only unsaved ones)
@@ -2175,16 +3315,21 @@ def save_generated_recipe():
     if not isinstance(recipe_data, dict):
         return jsonify({'error': 'Recipe data must be an object'}), 400
 
+    if recipe_data.get('image_pending'):
+        # Never save the placeholder; use the final image if it finished since the page was rendered,
+        # otherwise finish_generated_recipe_image() attaches it to the saved recipe later
+        image_url_to_save = generated_recipe_image_url(request.form.get('generated_recipe_id'), session['user_id'])
+        recipe_data.pop('temp_filename', None)
+
     image_url = None
-    if 'recipe_image' in request.files and request.files['recipe_image'].filename != '':
+    image_uploaded = 'recipe_image' in request.files and request.files['recipe_image'].filename != ''
+    if image_uploaded:
         file = request.files['recipe_image']
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            unique_filename = f"{uuid4().hex}_{filename}"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
             try:
-                file.save(filepath)
-                image_url = unique_filename
+                image_url = save_uploaded_image(file)
+            except IngestError as e:
+                return jsonify({'error': str(e)}), 400
             except Exception as e:
                 app.logger.error(f"Error saving uploaded image: {e}")
                 return jsonify({'error': f'Error saving image: {str(e)}'}), 500
@@ -2196,30 +3341,14 @@ def save_generated_recipe():
             # Extract just the filename from the path
             image_url = image_url_to_save.replace('/uploads/', '')
         elif image_url_to_save.startswith('http://') or image_url_to_save.startswith('https://'):
-            # It's an absolute URL, download it
+            # It's an absolute URL, stream it into storage through the shared pooled client
             try:
-                response = requests.get(image_url_to_save, stream=True, timeout=30)
-                response.raise_for_status()
-
-                file_ext = os.path.splitext(urllib.parse.urlparse(image_url_to_save).path)[1]
-                if not file_ext:
-                    content_type = response.headers.get('content-type')
-                    if content_type == 'image/png':
-                        file_ext = '.png'
-                    elif content_type == 'image/jpeg':
-                        file_ext = '.jpg'
-                    else:
-                        file_ext = '.jpg'
-
-                unique_filename = f"{uuid4().hex}{file_ext}"
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-
-                with open(filepath, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        f.write(chunk)
-
+                file_ext, chunks = download_client.open_image(image_url_to_save)
+                unique_filename, created = content_store.put_stream(chunks, file_ext)
                 image_url = unique_filename
-            except requests.exceptions.RequestException as e:
+                if created:
+                    schedule_image_derivatives(unique_filename)
+            except DownloadError as e:
                 app.logger.error(f"Error downloading image from URL: {e}")
                 return jsonify({'error': 'Could not download image from URL'}), 500
         else:
@@ -2228,16 +3357,16 @@ def save_generated_recipe():
 
     # Handle temporary image from generated recipe
     temp_filename = recipe_data.get('temp_filename')
-    if temp_filename:
-        temp_image_path = os.path.join(app.config['UPLOAD_FOLDER'], temp_filename)
-        if os.path.exists(temp_image_path):
+    if temp_filename and os.path.basename(temp_filename).startswith('temp_'):
+        temp_path = resolve_upload(upload_storage, temp_filename)
+        if temp_path:
             try:
-                # Rename the temporary file to permanent filename
-                unique_filename = f"{uuid4().hex}.png"
-                final_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-                
-                shutil.move(temp_image_path, final_path)
+                # Move the temporary file into content-addressed storage
+                unique_filename, created = content_store.put_bytes(upload_storage.get(temp_path), 'png')
+                upload_storage.delete(temp_path)
                 image_url = unique_filename
+                if created:
+                    schedule_image_derivatives(unique_filename)
                 app.logger.info(f"Made temporary image permanent: {unique_filename}")
             except Exception as e:
                 app.logger.error(f"Error making temporary image permanent: {e}")
@@ -2248,6 +3377,13 @@ def save_generated_recipe():
     if not image_url:
         image_url = None
 
+    # Share an already stored near-identical generated image instead of keeping another copy
+    replaced_image = None
+    if image_url and not image_uploaded:
+        duplicate = deduplicate_image(image_url)
+        if duplicate != image_url:
+            replaced_image, image_url = image_url, duplicate
+
     connection = get_db_connection()
     if connection:
         try:
@@ -2276,10 +3412,34 @@ def save_generated_recipe():
                 session['user_id']
             ))
             new_recipe_id = cursor.lastrowid
+            if image_url:
+                store_image_metadata(cursor, 'recipes', new_recipe_id, image_url)
             
             # Update the generated_recipe to mark it as saved (if it came from generated_recipes)
             generated_recipe_id = request.form.get('generated_recipe_id')
             if generated_recipe_id:
+                # Lock the row before marking it saved: an image finishing from now on waits for this
+                # commit and then sees saved_recipe_id, and one that finished already is read here
+                cursor.execute("SELECT recipe_data FROM generated_recipes WHERE id = %s AND user_id = %s FOR UPDATE",
+                               (generated_recipe_id, session['user_id']))
+                locked_row = cursor.fetchone()
+                if recipe_data.get('image_pending') and not image_url and locked_row:
+                    try:
+                        current_data = json.loads(locked_row[0])
+                    except (TypeError, ValueError):
+                        current_data = {}
+                    finished_url = None if current_data.get('image_pending') else current_data.get('image_url')
+                    if finished_url:
+                        image_url = finished_url.replace('/uploads/', '', 1) if finished_url.startswith('/uploads/') else finished_url
+                        image_prompt = current_data.get('image_prompt') or image_prompt
+                        cursor.execute("UPDATE recipes SET image_url = %s, image_prompt = %s WHERE id = %s",
+                                       (image_url, image_prompt, new_recipe_id))
+                        store_image_metadata(cursor, 'recipes', new_recipe_id, image_url)
+                if image_url:
+                    # The final image is known, so the stored copy must not stay in the placeholder state
+                    recipe_data.pop('image_pending', None)
+                    recipe_data.pop('image_status_url', None)
+
                 # Update the generated_recipes record with saved_recipe_id
                 cursor.execute(
                     "UPDATE generated_recipes SET saved_recipe_id = %s WHERE id = %s AND user_id = %s",
@@ -2299,6 +3459,9 @@ def save_generated_recipe():
             connection.commit()
             cursor.close()
             connection.close()
+            recipe_index.invalidate()
+            if replaced_image:
+                release_image(replaced_image)
 
             redirect_url = url_for('recipe_detail', recipe_id=new_recipe_id)
             return jsonify({'status': 'success', 'message': 'Recipe saved successfully!', 'redirect_url': redirect_url})
@@ -2338,12 +3501,7 @@ def update_generated_recipe_image(generated_recipe_id):
                 return jsonify({'error': 'Generated recipe not found or you do not have permission to update it'}), 404
 
             # Update the recipe_data JSON with the new image_url and image_prompt
-            recipe_data = json.loads(generated_recipe['recipe_data'])
-            recipe_data['image_url'] = image_url
-            recipe_data['image_prompt'] = image_prompt
-            updated_recipe_data = json.dumps(recipe_data, ensure_ascii=False)
-
-            cursor.execute('UPDATE generated_recipes SET recipe_data = %s WHERE id = %s', (updated_recipe_data, generated_recipe_id))
+            set_generated_recipe_image(cursor, generated_recipe, image_url, image_prompt)
             connection.commit()
             cursor.close()
             connection.close()
@@ -2393,44 +3551,14 @@ def generate_recipe_audio():
             else:
                 speech_text += str(instructions) + ". "
         
-        # Generate audio using Google Text-to-Speech API
+        # Generate audio using Google Text-to-Speech API (served from storage if already synthesized)
         try:
-            from google.cloud import texttospeech
-            
-            # Initialize the client
-            client = texttospeech.TextToSpeechClient()
-            
-            # Set the text input
-            synthesis_input = texttospeech.SynthesisInput(text=speech_text)
-            
-            # Build the voice request
-            voice = texttospeech.VoiceSelectionParams(
-                language_code="en-US",
-                name="en-US-Neural2-F",
-                ssml_gender=texttospeech.SsmlVoiceGender.FEMALE
-            )
-            
-            # Select the audio file type
-            audio_config = texttospeech.AudioConfig(
-                audio_encoding=texttospeech.AudioEncoding.MP3
-            )
-            
-            # Perform the text-to-speech request
-            response = client.synthesize_speech(
-                input=synthesis_input,
-                voice=voice,
-                audio_config=audio_config
-            )
-            
-            # Save the audio file
-            unique_filename = f"{uuid4().hex}_recipe_audio.mp3"
-            audio_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-            
-            with open(audio_path, 'wb') as out:
-                out.write(response.audio_content)
+            audio_filename, cached = tts_service.synthesize(speech_text.strip())
+            if cached:
+                app.logger.info(f"Recipe audio served from cache: {audio_filename}")
             
             # Use relative URL for compatibility with port forwarding
-            audio_url = url_for('uploaded_file', filename=unique_filename)
+            audio_url = url_for('uploaded_file', filename=audio_filename)
             
             # Update generated_recipes with audio URL if generated_recipe_id is provided
             if generated_recipe_id:
@@ -2783,10 +3911,13 @@ def not_found_error(error):
 @app.errorhandler(500)
 def internal_error(error):
     app.logger.error(f"Internal server error: {error}")
-    # Rollback database session in case of error
-    connection = get_db_connection()
+    # Roll back the request's own connection, if it has one; teardown returns it to the pool
+    connection = db_connections.current(g._get_current_object())
     if connection:
-        connection.rollback()
+        try:
+            connection.rollback()
+        except Error as e:
+            app.logger.error(f"Error rolling back after internal error: {e}")
     return render_template('500.html'), 500
 
 @app.route('/user/profile', methods=['GET', 'POST'])
@@ -2803,36 +3934,42 @@ def user_profile():
 
     cursor = connection.cursor(dictionary=True)
 
-    if request.method == 'POST':
-        username = request.form['username']
-        email = request.form['email']
-
-        image_url = request.form.get('current_image')
-        if 'image' in request.files and request.files['image'].filename != '':
-            file = request.files['image']
-            if file and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                unique_filename = f"{uuid4().hex}_{filename}"
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-                try:
-                    file.save(filepath)
-                    image_url = unique_filename
-                except Exception as e:
-                    app.logger.error(f"Error saving uploaded image: {e}")
-                    return jsonify({'error': f'Error saving image: {str(e)}'}), 500
-            else:
-                return jsonify({'error': 'Invalid image file type'}), 400
+    try:
+        if request.method == 'POST':
+            username = request.form['username']
+            email = request.form['email']
 
-        cursor.execute("UPDATE users SET username = %s, email = %s, image_url = %s WHERE id = %s",
-                       (username, email, image_url, user_id))
-        connection.commit()
-        flash('Profile updated successfully!', 'success')
-        return redirect(url_for('user_profile'))
+            image_url = request.form.get('current_image')
+            if 'image' in request.files and request.files['image'].filename != '':
+                file = request.files['image']
+                if file and allowed_file(file.filename):
+                    try:
+                        image_url = save_uploaded_image(file)
+                    except IngestError as e:
+                        return jsonify({'error': str(e)}), 400
+                    except Exception as e:
+                        app.logger.error(f"Error saving uploaded image: {e}")
+                        return jsonify({'error': f'Error saving image: {str(e)}'}), 500
+                else:
+                    return jsonify({'error': 'Invalid image file type'}), 400
+
+            cursor.execute("SELECT image_url FROM users WHERE id = %s", (user_id,))
+            previous_image = (cursor.fetchone() or {}).get('image_url')
+            cursor.execute("UPDATE users SET username = %s, email = %s, image_url = %s WHERE id = %s",
+                           (username, email, image_url, user_id))
+            if image_url != previous_image:
+                store_image_metadata(cursor, 'users', user_id, image_url)
+            connection.commit()
+            if previous_image and previous_image != image_url:
+                release_image(previous_image)
+            flash('Profile updated successfully!', 'success')
+            return redirect(url_for('user_profile'))
 
-    cursor.execute("SELECT * FROM users WHERE id = %s", (user_id,))
-    user = cursor.fetchone()
-    cursor.close()
-    connection.close()
+        cursor.execute("SELECT * FROM users WHERE id = %s", (user_id,))
+        user = cursor.fetchone()
+    finally:
+        cursor.close()
+        connection.close()
 
     return render_template('user/profile.html', user=user)
 
@@ -2859,6 +3996,8 @@ def change_password():
     user = cursor.fetchone()
 
     if not check_password_hash(user['password_hash'], current_password):
+        cursor.close()
+        connection.close()
         flash('Invalid current password', 'danger')
         return redirect(url_for('user_profile'))
 
@@ -2904,6 +4043,8 @@ def verify_2fa_login():
     cursor = connection.cursor(dictionary=True)
     cursor.execute("SELECT * FROM users WHERE id = %s", (user_id,))
     user = cursor.fetchone()
+    cursor.close()
+    connection.close()
 
     if not user or not user['is_2fa_enabled'] or not user['otp_secret']:
         return jsonify({'error': '2FA not enabled for this account'}), 400
@@ -2923,8 +4064,6 @@ def verify_2fa_login():
         else:
             flash('Invalid 2FA code', 'danger')
 
-    cursor.close()
-    connection.close()
     return render_template('verify_2fa_login.html')
 
 @app.route('/user/enable_2fa')
@@ -3009,21 +4148,23 @@ def get_notifications():
     if connection:
         cursor = connection.cursor(dictionary=True)
 
-        if request.method == 'POST':
-            notification_id = request.json.get('notification_id')
-            if notification_id:
-                cursor.execute("UPDATE notifications SET is_read = TRUE WHERE id = %s AND user_id = %s", (notification_id, user_id))
+        try:
+            if request.method == 'POST':
+                notification_id = request.json.get('notification_id')
+                if notification_id:
+                    cursor.execute("UPDATE notifications SET is_read = TRUE WHERE id = %s AND user_id = %s", (notification_id, user_id))
+                    connection.commit()
+                    return jsonify({'status': 'success'})
+            elif request.method == 'DELETE':
+                cursor.execute("DELETE FROM notifications WHERE user_id = %s", (user_id,))
                 connection.commit()
                 return jsonify({'status': 'success'})
-        elif request.method == 'DELETE':
-            cursor.execute("DELETE FROM notifications WHERE user_id = %s", (user_id,))
-            connection.commit()
-            return jsonify({'status': 'success'})
 
-        cursor.execute("SELECT * FROM notifications WHERE user_id = %s AND is_read = FALSE ORDER BY created_at DESC", (user_id,))
-        notifications = cursor.fetchall()
-        cursor.close()
-        connection.close()
+            cursor.execute("SELECT * FROM notifications WHERE user_id = %s AND is_read = FALSE ORDER BY created_at DESC", (user_id,))
+            notifications = cursor.fetchall()
+        finally:
+            cursor.close()
+            connection.close()
 
     return jsonify(notifications)
 
@@ -3034,47 +4175,41 @@ def diet_planner():
         return redirect(url_for('login'))
 
     user_id = session['user_id']
-    connection = get_db_connection()
-    diet_plans = []
-    if connection:
-        cursor = connection.cursor(dictionary=True)
+    if request.method == 'POST':
+        goal = request.form.get('goal')
+        if goal == 'custom':
+            goal = request.form.get('customGoal')
 
-        if request.method == 'POST':
-            goal = request.form.get('goal')
-            if goal == 'custom':
-                goal = request.form.get('customGoal')
+        if not goal:
+            flash('Please select a valid goal.', 'danger')
+            return render_template('diet_planner.html', form_data=request.form)
+        
+        try:
+            goal_amount = float(goal)
+        except ValueError:
+            flash('Invalid goal amount.', 'danger')
+            return render_template('diet_planner.html', form_data=request.form)
 
-            if not goal:
-                flash('Please select a valid goal.', 'danger')
-                return render_template('diet_planner.html', form_data=request.form)
+        goal_type = "gain" if goal_amount > 0 else "lose"
+        goal_abs = abs(goal_amount)
             
-            try:
-                goal_amount = float(goal)
-            except ValueError:
-                flash('Invalid goal amount.', 'danger')
-                return render_template('diet_planner.html', form_data=request.form)
-
-            goal_type = "gain" if goal_amount > 0 else "lose"
-            goal_abs = abs(goal_amount)
-                
-            days = int(request.form.get('days', 7))
-            allergies = request.form.get('allergies', '')
+        days = int(request.form.get('days', 7))
+        allergies = request.form.get('allergies', '')
 
-            # Store allergies in the database
-            user_id = session['user_id']
-            connection = get_db_connection()
-            if connection:
-                cursor = connection.cursor()
-                cursor.execute("DELETE FROM user_allergies WHERE user_id = %s", (user_id,))
-                if allergies:
-                    for allergy in allergies.split(','):
-                        cursor.execute("INSERT INTO user_allergies (user_id, allergy) VALUES (%s, %s)", (user_id, allergy.strip()))
-                connection.commit()
-                cursor.close()
-                connection.close()
+        # Store allergies in the database, then return the connection before the slow AI call
+        connection = get_db_connection()
+        if connection:
+            cursor = connection.cursor()
+            cursor.execute("DELETE FROM user_allergies WHERE user_id = %s", (user_id,))
+            if allergies:
+                for allergy in allergies.split(','):
+                    cursor.execute("INSERT INTO user_allergies (user_id, allergy) VALUES (%s, %s)", (user_id, allergy.strip()))
+            connection.commit()
+            cursor.close()
+            connection.close()
 
-            # Generate diet plan using Gemini
-            prompt = f"""Create a {days}-day diet plan for weight {goal_type} of {goal_abs} kg. Allergies: {allergies}.
+        # Generate diet plan using Gemini
+        prompt = f"""Create a {days}-day diet plan for weight {goal_type} of {goal_abs} kg. Allergies: {allergies}.
 
 Requirements:
 - EXACTLY {days} days (1 to {days})
@@ -3083,30 +4218,30 @@ Requirements:
 - Avoid: {allergies}
 
 Return JSON: {{"plan_name": "Weight {goal_type.capitalize()} Plan", "meals": [array of {days * 3} meal objects with day, meal_type, meal_name, description, ingredients array, prep_time]}}"""
-            
-            raw_response = call_gemini_api(prompt)
-            if raw_response.startswith("Sorry"):
-                flash(raw_response, 'danger')
-                return render_template('diet_planner.html', form_data=request.form)
+        
+        raw_response = call_gemini_api(prompt)
+        if raw_response.startswith("Sorry"):
+            flash(raw_response, 'danger')
+            return render_template('diet_planner.html', form_data=request.form)
 
-            meal_plan_json = clean_json_response(raw_response)
+        meal_plan_json = clean_json_response(raw_response)
 
-            if not meal_plan_json:
-                flash("Sorry, the AI returned an invalid format. Please try again.", 'danger')
-                return render_template('diet_planner.html', form_data=request.form)
+        if not meal_plan_json:
+            flash("Sorry, the AI returned an invalid format. Please try again.", 'danger')
+            return render_template('diet_planner.html', form_data=request.form)
 
-            try:
-                meal_plan = json.loads(meal_plan_json)
-                # Add created_at to the meal_plan for consistency with database plans
-                meal_plan['created_at'] = datetime.now()
-                meal_plan['goal'] = f"{goal_type.capitalize()} {goal_abs} kg" # Make goal more descriptive
-                meal_plan['generated'] = True  # Mark as generated plan
-                return render_template('user/my_diet_plan.html', diet_plans=[meal_plan])
-            except (json.JSONDecodeError, Error) as e:
-                flash(f"Error processing diet plan: {str(e)}", 'danger')
-                return render_template('diet_planner.html', form_data=request.form)
-
-        return render_template('diet_planner.html')
+        try:
+            meal_plan = json.loads(meal_plan_json)
+            # Add created_at to the meal_plan for consistency with database plans
+            meal_plan['created_at'] = datetime.now()
+            meal_plan['goal'] = f"{goal_type.capitalize()} {goal_abs} kg" # Make goal more descriptive
+            meal_plan['generated'] = True  # Mark as generated plan
+            return render_template('user/my_diet_plan.html', diet_plans=[meal_plan])
+        except (json.JSONDecodeError, Error) as e:
+            flash(f"Error processing diet plan: {str(e)}", 'danger')
+            return render_template('diet_planner.html', form_data=request.form)
+
+    return render_template('diet_planner.html')
 
 @app.route('/my_diet_plan', methods=['GET', 'POST'])
 def my_diet_plan():
@@ -3589,6 +4724,212 @@ def get_api_config():
         'textModel': app.config['GEMINI_TEXT_MODEL']
     })
 
+# Helper function to list upload filenames referenced from the database
+def get_referenced_image_files():
+    referenced = set()
+    connection = get_db_connection()
+    if not connection:
+        return referenced
+    try:
+        cursor = connection.cursor()
+        for table in ('recipes', 'users'):
+            cursor.execute(f"SELECT image_url FROM {table} WHERE image_url IS NOT NULL AND image_url != ''")
+            referenced.update(row[0] for row in cursor.fetchall())
+        cursor.close()
+    except Error as e:
+        app.logger.error(f"Error loading image references: {e}")
+    finally:
+        connection.close()
+    return referenced
+
+# Helper function to stream the base names of every upload the database references
+def get_live_upload_names(batch_size=1000):
+    """Collect image and audio references from recipes, users and generated_recipes.recipe_data"""
+    live = set()
+    connection = get_db_connection()
+    if not connection:
+        raise RuntimeError('Database connection failed')
+    try:
+        # Unbuffered so large tables stream through fetchmany instead of loading at once
+        cursor = connection.cursor(buffered=False)
+        for query in ("SELECT image_url, audio_url FROM recipes",
+                      "SELECT image_url FROM users WHERE image_url IS NOT NULL"):
+            cursor.execute(query)
+            for rows in iter(lambda: cursor.fetchmany(batch_size), []):
+                live.update(referenced_name(value) for row in rows for value in row)
+
+        cursor.execute("SELECT recipe_data FROM generated_recipes")
+        for rows in iter(lambda: cursor.fetchmany(batch_size), []):
+            for (recipe_json,) in rows:
+                try:
+                    recipe_data = json.loads(recipe_json)
+                except (TypeError, ValueError):
+                    continue
+                if isinstance(recipe_data, dict):
+                    live.update(referenced_name(recipe_data.get(key)) for key in ('image_url', 'audio_url', 'temp_filename'))
+        cursor.close()
+    finally:
+        connection.close()
+    live.discard(None)
+    return live
+
+@app.cli.command('gc-uploads')
+@click.option('--dry-run', is_flag=True, help='Only report what would be collected')
+@click.option('--delete', is_flag=True, help=f'Delete orphans instead of moving them to <upload folder>/{QUARANTINE_DIR}')
+@click.option('--grace', type=int, default=None, help='Minimum age in seconds of a collectable file (default: UPLOAD_GC_GRACE)')
+@click.option('--batch-size', type=int, default=500, help='Orphans handled per batch')
+def gc_uploads_command(dry_run, delete, grace, batch_size):
+    """Delete or quarantine uploaded images and audio that no database row references."""
+    grace = app.config['UPLOAD_GC_GRACE'] if grace is None else grace
+    live = get_live_upload_names()
+    click.echo(f"{len(live)} referenced uploads")
+
+    report = collect_garbage(upload_storage, live, grace=grace, quarantine=not delete,
+                             dry_run=dry_run, batch_size=batch_size, log=click.echo)
+    click.echo(f"Scanned {report['scanned']} files: {report['live']} live, {report['recent']} within the grace period, "
+               f"{report['orphaned']} orphaned ({report['orphaned_bytes']} bytes)")
+    if dry_run:
+        for path in report['sample']:
+            click.echo(f"  would collect {path}")
+        return
+    click.echo(f"Deleted {report['deleted']}, quarantined {report['quarantined']}, "
+               f"rescued {report['skipped_recent']} reused since the scan; {report['bytes_collected']} bytes collected")
+    for error in report['errors']:
+        click.echo(f"Error: {error}")
+
+@app.cli.command('index-image-hashes')
+@click.option('--workers', type=int, default=4, help='Threads hashing images')
+def index_image_hashes_command(workers):
+    """Compute perceptual hashes for stored images that are not in the duplicate index yet."""
+    ensure_image_hash_index()
+    pending = [key for key, _, _ in upload_storage.list()
+               if not key.startswith(f"{TEMP_DIR}/") and supports_derivatives(os.path.basename(key))
+               and image_hash_index.get(key) is None]
+    click.echo(f"Hashing {len(pending)} images")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        hashed = sum(1 for value in executor.map(record_image_hash, pending) if value is not None)
+    click.echo(f"Indexed {hashed} images ({len(pending) - hashed} unreadable); "
+               f"{len(image_hash_index.clusters())} near-duplicate groups")
+
+@app.cli.command('backfill-images')
+@click.option('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+@click.option('--checkpoint', default=None, help='Checkpoint file (default: <upload folder>/.backfill_checkpoint.json)')
+@click.option('--force', is_flag=True, help='Reprocess images already recorded in the checkpoint')
+def backfill_images_command(workers, checkpoint, force):
+    """Create responsive derivatives for every existing uploaded image."""
+    if app.config['STORAGE_BACKEND'] != 'local':
+        raise click.ClickException('This command works on the local upload folder; with object storage, derivatives are created on first request')
+    upload_folder = app.config['UPLOAD_FOLDER']
+    checkpoint = checkpoint or os.path.join(upload_folder, '.backfill_checkpoint.json')
+    sources, missing = find_sources(upload_folder, get_referenced_image_files())
+    for filename in missing:
+        click.echo(f"Referenced image missing on disk: {filename}")
+
+    report = run_backfill(upload_folder, sources, checkpoint, workers=workers, force=force, log=click.echo)
+    click.echo(f"Processed {report['processed']} images ({report['skipped']} skipped, {report['failed']} failed) "
+               f"in {report['seconds']}s at {report['images_per_second']} images/s")
+    click.echo(f"Original bytes: {report['source_bytes']}")
+    click.echo(f"Bytes saved per view: card {report['bytes_saved_card']}, detail {report['bytes_saved_detail']}")
+
+# Helper function to point database image references at moved uploads
+def rewrite_image_references(moves):
+    """Rewrite recipes, users and generated_recipes references for a batch of {old: new} upload paths"""
+    connection = get_db_connection()
+    if not connection:
+        raise RuntimeError('Database connection failed')
+    try:
+        cursor = connection.cursor()
+        pairs = [(new, old) for old, new in moves.items()]
+        pairs += [(f"/uploads/{new}", f"/uploads/{old}") for old, new in moves.items()]
+        for table in ('recipes', 'users'):
+            cursor.executemany(f"UPDATE {table} SET image_url = %s WHERE image_url = %s", pairs)
+        cursor.executemany(
+            "UPDATE generated_recipes SET recipe_data = REPLACE(recipe_data, %s, %s) WHERE recipe_data LIKE %s",
+            [(f"/uploads/{old}", f"/uploads/{new}", f"%/uploads/{old}%") for old, new in moves.items()]
+        )
+        connection.commit()
+        cursor.close()
+    finally:
+        connection.close()
+
+@app.cli.command('migrate-uploads')
+@click.option('--batch-size', type=int, default=500, help='Files moved per database transaction')
+def migrate_uploads_command(batch_size):
+    """Move flat uploads into the sharded layout and rewrite database references."""
+    if app.config['STORAGE_BACKEND'] != 'local':
+        raise click.ClickException('This command works on the local upload folder only')
+    upload_folder = app.config['UPLOAD_FOLDER']
+    moved = conflicts = 0
+    skipped = set()
+    while True:
+        batch = list(islice((name for name in flat_uploads(upload_folder) if name not in skipped), batch_size))
+        if not batch:
+            break
+
+        moves = {}
+        for name in batch:
+            target = move_to_shard(upload_folder, name)
+            if not target:
+                skipped.add(name)
+                conflicts += 1
+                click.echo(f"Skipped {name}: a different file already exists at {shard_name(name)}")
+                continue
+            moved += 1
+            # Derivatives and temp images are never stored in the database
+            if not parse_derivative_name(name) and not name.startswith('temp_'):
+                moves[name] = target
+
+        # Files are moved before references are rewritten; uploaded_file() resolves both names meanwhile
+        if moves:
+            rewrite_image_references(moves)
+        click.echo(f"Moved {moved} files ({len(moves)} references rewritten in this batch)")
+
+    click.echo(f"Migration finished: {moved} moved, {conflicts} conflicts")
+
+@app.cli.command('backfill-image-metadata')
+@click.option('--batch-size', type=int, default=200, help='Rows updated per database transaction')
+@click.option('--workers', type=int, default=4, help='Threads reading images')
+@click.option('--force', is_flag=True, help='Recompute rows that already have metadata')
+def backfill_image_metadata_command(batch_size, workers, force):
+    """Compute width, height, dominant colour and placeholder for existing recipe and profile images."""
+    connection = get_db_connection()
+    if not connection:
+        raise click.ClickException('Database connection failed')
+    try:
+        cursor = connection.cursor()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for table in ('recipes', 'users'):
+                updated = failed = 0
+                last_id = 0
+                while True:
+                    cursor.execute(f"""
+                        SELECT id, image_url FROM {table}
+                        WHERE id > %s AND image_url IS NOT NULL AND image_url != ''
+                        {'' if force else 'AND image_width IS NULL'}
+                        ORDER BY id LIMIT %s
+                    """, (last_id, batch_size))
+                    rows = cursor.fetchall()
+                    if not rows:
+                        break
+                    last_id = rows[-1][0]
+
+                    # Shared images (e.g. reused generations) are read once per batch
+                    image_urls = list({image_url for _, image_url in rows})
+                    values = dict(zip(image_urls, executor.map(image_metadata_values, image_urls)))
+                    params = [(*values[image_url], row_id) for row_id, image_url in rows if values[image_url][0]]
+                    if params:
+                        cursor.executemany(f"""
+                            UPDATE {table} SET image_width = %s, image_height = %s, image_color = %s, image_lqip = %s
+                            WHERE id = %s
+                        """, params)
+                        connection.commit()
+                    updated += len(params)
+                    failed += len(rows) - len(params)
+                    click.echo(f"{table}: {updated} rows updated, {failed} unreadable")
+        cursor.close()
+    finally:
+        connection.close()
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 4000))
     app.run(host='0.0.0.0', port=port)
@@ -6,10 +6,11 @@ Integrates Bytez AI for natural, realistic food image generation
 import os
 import base64
 import tempfile
-import ssl
 from datetime import datetime
 from PIL import Image
 from io import BytesIO
+from http_client import DownloadError, get_download_client
+from logo_store import LogoStore
 
 # Disable SSL warnings for image downloads
 import urllib3
@@ -32,14 +33,18 @@ class BytezImageGenerator:
     Designed specifically for natural, realistic food photography
     """
     
-    def __init__(self, api_key=None):
+    def __init__(self, api_key=None, http_client=None, logo_store=None):
         """
         Initialize Bytez image generator
         
         Args:
             api_key: Bytez API key (required, should be passed from config.py)
+            http_client: Optional DownloadClient for image URLs (defaults to the shared one)
+            logo_store: Optional LogoStore of decoded, pre-resized logos
         """
         self.api_key = api_key
+        self.http_client = http_client or get_download_client()
+        self.logo_store = logo_store or LogoStore()
         self.bytez_client = None
         self.model = None
         
@@ -94,6 +99,40 @@ class BytezImageGenerator:
         Returns:
             dict with 'success', 'image_path', 'error' keys
         """
+        logo_bytes = None
+        if logo_path and os.path.exists(logo_path):
+            with open(logo_path, 'rb') as f:
+                logo_bytes = f.read()
+        
+        result = self.generate_image_bytes(description, ingredients, logo_bytes)
+        if not result['success']:
+            return result
+        
+        # Single write of the final image
+        temp_dir = tempfile.gettempdir()
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        file_path = os.path.join(temp_dir, f"bytez_food_{timestamp}.{result['format']}")
+        with open(file_path, 'wb') as f:
+            f.write(result['image_bytes'])
+        print(f"Image successfully saved to: {file_path}")
+        return {
+            'success': True,
+            'image_path': file_path,
+            'prompt': result['prompt']
+        }
+    
+    def generate_image_bytes(self, description, ingredients="", logo_bytes=None):
+        """
+        Generate a food image entirely in memory
+        
+        Args:
+            description: Description of the dish to generate
+            ingredients: Optional ingredients string
+            logo_bytes: Optional logo image bytes to overlay
+            
+        Returns:
+            dict with 'success', 'image_bytes', 'format' ('png' or 'jpg'), 'prompt', 'error' keys
+        """
         if not self.is_available():
             return {
                 'success': False,
@@ -117,13 +156,14 @@ class BytezImageGenerator:
                 }
             
             # Process the result
-            image_path = self._process_bytez_output(result, logo_path)
+            processed = self._process_bytez_output(result, logo_bytes)
             
-            if image_path:
-                print(f"Image successfully saved to: {image_path}")
+            if processed:
+                image_bytes, image_format = processed
                 return {
                     'success': True,
-                    'image_path': image_path,
+                    'image_bytes': image_bytes,
+                    'format': image_format,
                     'prompt': prompt
                 }
             else:
@@ -133,7 +173,7 @@ class BytezImageGenerator:
                 }
                 
         except Exception as e:
-            print(f"Exception in generate_image: {e}")
+            print(f"Exception in generate_image_bytes: {e}")
             import traceback
             traceback.print_exc()
             return {
@@ -141,16 +181,16 @@ class BytezImageGenerator:
                 'error': f"Bytez generation error: {str(e)}"
             }
     
-    def _process_bytez_output(self, output, logo_path=None):
+    def _process_bytez_output(self, output, logo_bytes=None):
         """
-        Process Bytez API output and save image
+        Process Bytez API output in memory
         
         Args:
             output: Bytez API response
-            logo_path: Optional logo to overlay
+            logo_bytes: Optional logo to overlay
             
         Returns:
-            Path to saved image file, or None
+            Tuple of (image bytes, format extension), or None
         """
         try:
             print(f"Processing Bytez output, type: {type(output)}")
@@ -165,11 +205,6 @@ class BytezImageGenerator:
                     print("Skipping None image data")
                     continue
                 
-                # Create temp file
-                temp_dir = tempfile.gettempdir()
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
-                file_path = os.path.join(temp_dir, f"bytez_food_{timestamp}.png")
-                
                 # Get image bytes
                 image_bytes = self._extract_image_bytes(image_data)
                 
@@ -179,34 +214,11 @@ class BytezImageGenerator:
                 
                 print(f"Successfully extracted {len(image_bytes)} bytes")
                 
-                # Save and optionally process with logo
                 try:
-                    with open(file_path, 'wb') as f:
-                        f.write(image_bytes)
-                    print(f"Saved image to: {file_path}")
-                except Exception as save_error:
-                    print(f"Error saving image: {save_error}")
+                    return self._finalize_image(image_bytes, logo_bytes)
+                except Exception as decode_error:
+                    print(f"Image decoding failed: {decode_error}")
                     continue
-                
-                # Verify the image file is valid
-                try:
-                    test_img = Image.open(file_path)
-                    test_img.verify()
-                    print(f"Image verified successfully: {test_img.size}, {test_img.format}")
-                except Exception as verify_error:
-                    print(f"Image verification failed: {verify_error}")
-                    # Try to continue anyway, might still work
-                
-                # Overlay logo if provided
-                if logo_path and os.path.exists(logo_path):
-                    try:
-                        file_path = self._overlay_logo(file_path, logo_path)
-                        print(f"Logo overlay applied successfully")
-                    except Exception as e:
-                        print(f"Logo overlay failed: {e}")
-                        # Continue without logo
-                
-                return file_path
             
             print("No valid images found in output")
             return None
@@ -217,6 +229,43 @@ class BytezImageGenerator:
             traceback.print_exc()
             return None
     
+    def _finalize_image(self, image_bytes, logo_bytes=None):
+        """
+        Validate an image by decoding it once and apply the logo in memory
+        
+        Without a logo the original bytes are returned untouched, so there is
+        no re-encode.
+        
+        Args:
+            image_bytes: Encoded image from the model
+            logo_bytes: Optional logo to overlay
+            
+        Returns:
+            Tuple of (image bytes, format extension)
+        """
+        image = Image.open(BytesIO(image_bytes))
+        image.load()
+        print(f"Image decoded successfully: {image.size}, {image.format}")
+        
+        if logo_bytes:
+            try:
+                result = self._overlay_logo(image, logo_bytes)
+                print("Logo overlay applied successfully")
+                buffer = BytesIO()
+                result.save(buffer, "PNG")
+                return buffer.getvalue(), 'png'
+            except Exception as e:
+                print(f"Logo overlay failed: {e}")
+                # Continue without logo
+        
+        if image.format == 'JPEG':
+            return image_bytes, 'jpg'
+        if image.format == 'PNG':
+            return image_bytes, 'png'
+        buffer = BytesIO()
+        image.save(buffer, "PNG")
+        return buffer.getvalue(), 'png'
+    
     def _extract_image_bytes(self, image_data):
         """
         Extract image bytes from various data formats
@@ -275,33 +324,13 @@ class BytezImageGenerator:
             if isinstance(image_data, str) and (image_data.startswith('http://') or image_data.startswith('https://')):
                 print(f"DEBUG: Downloading from URL: {image_data}")
                 try:
-                    import requests
-                    headers = {
-                        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                        'Accept': 'image/*,*/*'
-                    }
-                    # Disable SSL verification for problematic certificates
-                    response = requests.get(image_data, timeout=90, headers=headers, stream=True, verify=False)
-                    response.raise_for_status()
-                    content = response.content
-                    print(f"DEBUG: Downloaded {len(content)} bytes from URL")
+                    # Pooled session with retries; SSL verification is off for problematic certificates
+                    content, ext = self.http_client.fetch_image(image_data, verify=False)
+                    print(f"DEBUG: Downloaded {len(content)} bytes ({ext}) from URL")
                     return content
-                except Exception as req_error:
-                    print(f"Error downloading from URL with requests: {req_error}")
-                    # Try alternative method without SSL verification
-                    try:
-                        import urllib.request
-                        import ssl
-                        # Create unverified SSL context
-                        ssl_context = ssl._create_unverified_context()
-                        req = urllib.request.Request(image_data, headers=headers)
-                        with urllib.request.urlopen(req, timeout=90, context=ssl_context) as url_response:
-                            content = url_response.read()
-                            print(f"DEBUG: Downloaded {len(content)} bytes via urllib")
-                            return content
-                    except Exception as urllib_error:
-                        print(f"Urllib also failed: {urllib_error}")
-                        return None
+                except DownloadError as download_error:
+                    print(f"Error downloading from URL: {download_error}")
+                    return None
             
             # Handle base64 data URL
             if isinstance(image_data, str) and 'data:image' in image_data:
@@ -351,37 +380,30 @@ class BytezImageGenerator:
             traceback.print_exc()
             return None
     
-    def _overlay_logo(self, image_path, logo_path):
+    def _overlay_logo(self, base_image, logo_bytes):
         """
-        Overlay logo on image
+        Overlay logo on image in memory
+        
+        The logo is decoded and resized once per logo and width by the logo
+        store, so each image only pays for the alpha paste.
         
         Args:
-            image_path: Path to base image
-            logo_path: Path to logo image
+            base_image: Decoded PIL image (modified in place when RGB/RGBA)
+            logo_bytes: Logo image bytes
             
         Returns:
-            Path to new image with logo
+            PIL image with logo
         """
-        # Open images
-        base_image = Image.open(image_path).convert("RGBA")
-        logo = Image.open(logo_path).convert("RGBA")
-        
-        # Calculate logo size (15% of image width)
-        logo_width = int(base_image.width * 0.15)
-        logo_height = int(logo_width * (logo.height / logo.width))
+        result = base_image if base_image.mode in ("RGB", "RGBA") else base_image.convert("RGBA")
         
-        # Resize logo
-        logo = logo.resize((logo_width, logo_height), Image.Resampling.LANCZOS)
+        # Logo is 15% of the image width
+        digest = self.logo_store.put(logo_bytes)
+        logo = self.logo_store.variant(digest, int(result.width * 0.15))
         
-        # Create composite
-        result = base_image.copy()
+        # The logo's own alpha channel is the paste mask
         result.paste(logo, (30, 30), logo)
         
-        # Save
-        output_path = image_path.replace(".png", "_with_logo.png")
-        result.save(output_path, "PNG")
-        
-        return output_path
+        return result
     
     def generate_placeholder(self, description, output_path=None):
         """
@@ -399,6 +421,20 @@ class BytezImageGenerator:
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
             output_path = os.path.join(temp_dir, f"placeholder_{timestamp}.png")
         
+        with open(output_path, 'wb') as f:
+            f.write(self.generate_placeholder_bytes(description))
+        return output_path
+    
+    def generate_placeholder_bytes(self, description):
+        """
+        Generate a simple placeholder image in memory
+        
+        Args:
+            description: Text to include in placeholder
+            
+        Returns:
+            PNG bytes
+        """
         # Create simple placeholder
         width, height = 800, 1200
         image = Image.new('RGB', (width, height), color='lightblue')
@@ -419,5 +455,6 @@ class BytezImageGenerator:
         except:
             pass
         
-        image.save(output_path, "PNG")
-        return output_path
+        buffer = BytesIO()
+        image.save(buffer, "PNG")
+        return buffer.getvalue()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Chatbot Conversation Memory Module
+Keeps chatbot prompts bounded by sending a rolling window of recent turns
+plus a running summary of everything older
+"""
+import math
+
+
+def estimate_tokens(text):
+    """
+    Estimate the number of model tokens in a string
+
+    Uses the common ~4 characters per token rule, which is close enough
+    for budgeting prompt size without a tokenizer dependency.
+    """
+    if not text:
+        return 0
+    return int(math.ceil(len(text) / 4.0))
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text down to roughly max_tokens, ending on a word boundary"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    cut = text[:max_tokens * 4]
+    if ' ' in cut:
+        cut = cut[:cut.rfind(' ')]
+    return cut.rstrip() + '...'
+
+
+class ConversationMemory:
+    """
+    Token-bounded conversation memory for the chatbot
+
+    Turns are dicts with 'id', 'message' and 'response' keys, as stored in
+    the chat_history table. The newest turns that fit in ``window_tokens``
+    are sent verbatim; older turns are folded into a summary that never
+    grows beyond ``summary_tokens``.
+    """
+
+    def __init__(self, window_tokens=1200, summary_tokens=300, max_turn_tokens=400):
+        """
+        Initialize memory budgets
+
+        Args:
+            window_tokens: Token budget for verbatim recent turns
+            summary_tokens: Token budget for the running summary
+            max_turn_tokens: Token cap for a single turn inside the window
+        """
+        self.window_tokens = window_tokens
+        self.summary_tokens = summary_tokens
+        self.max_turn_tokens = max_turn_tokens
+
+    def format_turn(self, turn):
+        """Format one exchange, truncated to the per-turn budget"""
+        text = f"User: {turn['message']}\nAssistant: {turn['response']}"
+        return truncate_to_tokens(text, self.max_turn_tokens)
+
+    def split_turns(self, turns):
+        """
+        Split turns into those to summarize and those to keep verbatim
+
+        Args:
+            turns: Unsummarized turns, oldest first
+
+        Returns:
+            Tuple of (older_turns, window_turns), both oldest first
+        """
+        used = 0
+        start = len(turns)
+        for position in range(len(turns) - 1, -1, -1):
+            cost = estimate_tokens(self.format_turn(turns[position]))
+            if used + cost > self.window_tokens:
+                break
+            used += cost
+            start = position
+        return turns[:start], turns[start:]
+
+    def build_context(self, summary, window_turns):
+        """
+        Build the conversation block that is added to the chatbot prompt
+
+        Args:
+            summary: Running summary of older turns, may be empty
+            window_turns: Recent turns, oldest first
+
+        Returns:
+            Context string, or an empty string for a new conversation
+        """
+        parts = []
+        if summary:
+            parts.append(f"Summary of the earlier conversation:\n{summary}")
+        if window_turns:
+            parts.append('Recent conversation:\n' + '\n'.join(self.format_turn(t) for t in window_turns))
+        if not parts:
+            return ''
+        return '\n\n'.join(parts) + '\n\n'
+
+    def build_summary_prompt(self, summary, turns):
+        """
+        Build the prompt that folds older turns into the running summary
+
+        Args:
+            summary: Current summary, may be empty
+            turns: Turns leaving the window, oldest first
+
+        Returns:
+            Prompt string for the text model
+        """
+        words = self.summary_tokens * 3 // 4
+        transcript = '\n'.join(self.format_turn(t) for t in turns)
+        previous = summary or 'None yet.'
+        return (f"You maintain a short memory of a cooking assistant's conversation with a user.\n"
+                f"Current summary: {previous}\n\n"
+                f"New exchanges to add:\n{transcript}\n\n"
+                f"Write an updated summary in at most {words} words. Keep the dishes discussed, "
+                f"ingredients the user has or avoids, dietary needs and preferences. "
+                f"Use plain text only, no lists or special formatting.")
+
+    def clamp_summary(self, text):
+        """Clean a model-written summary and enforce the summary budget"""
+        text = (text or '').replace('*', '').replace('#', '').strip()
+        return truncate_to_tokens(text, self.summary_tokens)
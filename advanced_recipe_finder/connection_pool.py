@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Connection Pool Module
+A MySQL connection pool that makes callers wait (first come, first served,
+up to a timeout) when every connection is busy instead of failing at once,
+opens a bounded number of overflow connections under bursts, and replaces
+connections that died while idle (e.g. after a MySQL restart)
+"""
+import threading
+import time
+from collections import deque
+
+
+class PoolTimeoutError(RuntimeError):
+    """Raised when no connection became free within the checkout timeout"""
+
+
+class PooledConnection:
+    """
+    Proxy of a connection checked out of a BlockingConnectionPool
+
+    close() returns the connection to the pool instead of disconnecting.
+    """
+
+    def __init__(self, pool, connection):
+        self._pool = pool
+        self._connection = connection
+        self._returned = False
+
+    def close(self):
+        """Return the connection to the pool"""
+        if not self._returned:
+            self._returned = True
+            self._pool.release(self._connection)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+class BlockingConnectionPool:
+    """
+    Thread-safe pool of DB-API connections with overflow and a wait queue
+
+    Up to size connections are kept open between checkouts; under load up to
+    max_overflow more are opened and closed again when returned. Callers that
+    find the pool at its limit queue in arrival order until a connection is
+    returned or timeout expires.
+    """
+
+    def __init__(self, connect, size=10, max_overflow=10, timeout=10.0, reset_session=True, ping_interval=30.0):
+        """
+        Initialize the pool (connections are opened on demand)
+
+        Args:
+            connect: Callable opening a new connection, e.g. functools.partial(mysql.connector.connect, ...)
+            size: Connections kept open while idle
+            max_overflow: Extra connections allowed while the pool is exhausted
+            timeout: Seconds checkout() waits for a free connection
+            reset_session: Reset session state (variables, temporary tables) on return;
+                when off, only an open transaction is rolled back, saving a round trip
+            ping_interval: Connections idle at least this many seconds are pinged
+                before being handed out; 0 pings on every checkout
+        """
+        self._connect = connect
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.reset_session = reset_session
+        self.ping_interval = ping_interval
+        self._cond = threading.Condition()
+        self._idle = deque()
+        self._waiters = deque()
+        self._open = 0
+        self._in_use = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.created = 0
+        self.discarded = 0
+        self.failed_pings = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def checkout(self, timeout=None):
+        """
+        Borrow a connection, waiting for one if the pool is exhausted
+
+        Args:
+            timeout: Seconds to wait (default: the pool's timeout)
+
+        Returns:
+            PooledConnection
+
+        Raises:
+            PoolTimeoutError: If no connection became free in time
+            Whatever connect() raises when a new connection cannot be opened
+        """
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        ticket = object()
+        with self._cond:
+            self._waiters.append(ticket)
+            try:
+                while True:
+                    # Only the longest-waiting caller may take a connection
+                    if self._waiters[0] is ticket:
+                        if self._idle:
+                            entry = self._idle.pop()
+                            break
+                        if self._open < self.size + self.max_overflow:
+                            self._open += 1
+                            entry = None
+                            break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeoutError(
+                            f"No database connection free after {timeout:g}s "
+                            f"({self._in_use} in use, {len(self._waiters) - 1} other waiters)"
+                        )
+                    self._cond.wait(remaining)
+            finally:
+                self._waiters.remove(ticket)
+                self._cond.notify_all()
+            waited = time.monotonic() - started
+            self._in_use += 1
+            self.checkouts += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+
+        try:
+            connection = self._healthy(entry)
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._open -= 1
+                self._cond.notify_all()
+            raise
+        return PooledConnection(self, connection)
+
+    def _healthy(self, entry):
+        """Return the idle connection if it still answers, otherwise a new one"""
+        if entry is not None:
+            connection, idle_since = entry
+            if time.monotonic() - idle_since < self.ping_interval:
+                return connection
+            try:
+                connection.ping()
+                return connection
+            except Exception:
+                with self._cond:
+                    self.failed_pings += 1
+                    self.discarded += 1
+                self._close_quietly(connection)
+        connection = self._connect()
+        with self._cond:
+            self.created += 1
+        return connection
+
+    def release(self, connection):
+        """
+        Take a connection back, closing it if it is broken or surplus
+
+        Args:
+            connection: Raw connection handed out by checkout()
+        """
+        discard = False
+        try:
+            if self.reset_session:
+                connection.reset_session()
+            elif connection.in_transaction:
+                connection.rollback()
+        except Exception:
+            discard = True
+
+        with self._cond:
+            self._in_use -= 1
+            # Overflow connections are kept only while callers are still queued for one
+            if discard or (self._open > self.size and not self._waiters):
+                self._open -= 1
+                self.discarded += 1
+            else:
+                self._idle.append((connection, time.monotonic()))
+                connection = None
+            self._cond.notify_all()
+        if connection is not None:
+            self._close_quietly(connection)
+
+    @staticmethod
+    def _close_quietly(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def stats(self):
+        """Return pool gauges and wait-time metrics"""
+        with self._cond:
+            return {
+                'size': self.size,
+                'max_overflow': self.max_overflow,
+                'open': self._open,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waiting': len(self._waiters),
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'created': self.created,
+                'discarded': self.discarded,
+                'failed_pings': self.failed_pings,
+                'avg_wait_ms': round(self.total_wait / self.checkouts * 1000, 2) if self.checkouts else 0.0,
+                'max_wait_ms': round(self.max_wait * 1000, 2),
+            }
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Content-Addressed Storage Module
+Stores uploaded and generated files under the SHA-256 of their bytes so
+identical images are kept once on disk and share one URL in browser and
+proxy caches
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# Bytes read per chunk when hashing files and streams
+CHUNK_SIZE = 64 * 1024
+
+# Extensions that name the same format
+EXTENSION_ALIASES = {'jpeg': 'jpg'}
+
+
+def normalize_extension(ext):
+    """Lowercase an extension without its dot, folding aliases such as jpeg -> jpg"""
+    ext = (ext or '').lower().lstrip('.')
+    return EXTENSION_ALIASES.get(ext, ext) or 'bin'
+
+
+def content_filename(digest, ext):
+    """
+    Filename of a blob
+
+    Args:
+        digest: Hex SHA-256 of the content
+        ext: File extension
+
+    Returns:
+        Filename, e.g. "9f86d08...0f00a08.png"
+    """
+    return f"{digest}.{normalize_extension(ext)}"
+
+
+def is_content_filename(filename):
+    """Check whether filename was produced by content_filename"""
+    name = os.path.basename(filename or '')
+    digest, _, ext = name.partition('.')
+    return len(digest) == 64 and ext.isalnum() and all(c in '0123456789abcdef' for c in digest)
+
+
+class ContentStore:
+    """
+    Thread-safe content-addressed blob store on top of a storage backend
+
+    Writes of content that is already stored short-circuit: nothing is
+    written and the existing filename is returned, with the blob's mtime
+    refreshed so a concurrent release does not delete it.
+    """
+
+    def __init__(self, storage, layout=None):
+        """
+        Initialize the store
+
+        Args:
+            storage: storage.StorageBackend blobs are written to
+            layout: Optional callable mapping a blob filename to its storage key
+        """
+        self.storage = storage
+        self.layout = layout or (lambda filename: filename)
+        self._lock = threading.Lock()
+        self.writes = 0
+        self.dedup_hits = 0
+        self.bytes_written = 0
+        self.bytes_deduplicated = 0
+
+    def exists(self, filename):
+        """Check whether a blob is stored"""
+        return self.storage.exists(filename)
+
+    def _count_write(self, size):
+        with self._lock:
+            self.writes += 1
+            self.bytes_written += size
+
+    def put_bytes(self, data, ext):
+        """
+        Store bytes
+
+        Returns:
+            Tuple of (filename, created) where filename is the storage key and
+            created is False if the blob already existed
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        filename = self.layout(content_filename(digest, ext))
+        if self._touch(filename, len(data)):
+            return filename, False
+        self.storage.put(filename, data)
+        self._count_write(len(data))
+        return filename, True
+
+    def put_stream(self, chunks, ext):
+        """
+        Store content from an iterable of byte chunks, hashing while spooling
+        it to a temp file (the key is only known once the stream ends)
+
+        Args:
+            chunks: Iterable of bytes, e.g. response.iter_content() or iter_file(stream)
+            ext: File extension
+
+        Returns:
+            Tuple of (filename, created)
+        """
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=self.storage.spool_dir, prefix='.tmp_')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    if chunk:
+                        digest.update(chunk)
+                        f.write(chunk)
+            return self._put_temp(temp_path, digest.hexdigest(), ext)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def put_file(self, source_path, ext=None, move=False):
+        """
+        Store an existing local file
+
+        Args:
+            source_path: File to store
+            ext: File extension, defaults to the source's extension
+            move: Remove the source file once stored
+
+        Returns:
+            Tuple of (filename, created)
+        """
+        ext = ext or os.path.splitext(source_path)[1]
+        filename, created = self._put_temp(source_path, file_digest(source_path), ext, move=move)
+        if move and os.path.exists(source_path):
+            os.remove(source_path)
+        return filename, created
+
+    def _put_temp(self, path, digest, ext, move=True):
+        """Store a fully written local file under its digest unless the blob already exists"""
+        filename = self.layout(content_filename(digest, ext))
+        size = os.path.getsize(path)
+        if self._touch(filename, size):
+            return filename, False
+        self.storage.put_file(filename, path, move=move)
+        self._count_write(size)
+        return filename, True
+
+    def _touch(self, filename, size):
+        """Short-circuit a write of an existing blob, returning True on a hit"""
+        if not self.storage.exists(filename):
+            return False
+        try:
+            self.storage.touch(filename)
+        except FileNotFoundError:
+            # Released in between; store it again
+            return False
+        with self._lock:
+            self.dedup_hits += 1
+            self.bytes_deduplicated += size
+        return True
+
+    def delete(self, filename, grace=0):
+        """
+        Delete a blob unless it was written or deduplicated within ``grace`` seconds
+
+        Returns:
+            True if the blob was deleted
+        """
+        stat = self.storage.stat(filename)
+        if not stat or time.time() - stat[1] < grace:
+            return False
+        return self.storage.delete(filename)
+
+    def stats(self):
+        """Return write and deduplication metrics"""
+        with self._lock:
+            puts = self.writes + self.dedup_hits
+            return {
+                'writes': self.writes,
+                'dedup_hits': self.dedup_hits,
+                'bytes_written': self.bytes_written,
+                'bytes_deduplicated': self.bytes_deduplicated,
+                'dedup_rate': round(self.dedup_hits / puts, 4) if puts else 0.0,
+            }
+
+
+def file_digest(path):
+    """Hex SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ETagCache:
+    """
+    Strong ETags derived from file contents
+
+    Content-addressed blobs use the hash in their name; other files are
+    hashed once and remembered until their size or mtime changes.
+    """
+
+    def __init__(self, max_entries=5000):
+        self.max_entries = max_entries
+        self._digests = OrderedDict()
+        self._lock = threading.Lock()
+
+    def etag(self, path):
+        """Return the content hash of a file for use as a strong ETag"""
+        name = os.path.basename(path)
+        if is_content_filename(name):
+            return name.partition('.')[0]
+
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            digest = self._digests.get(key)
+            if digest:
+                self._digests.move_to_end(key)
+                return digest
+        digest = file_digest(path)
+        with self._lock:
+            self._digests[key] = digest
+            while len(self._digests) > self.max_entries:
+                self._digests.popitem(last=False)
+        return digest
+
+
+def iter_file(stream):
+    """Iterate a binary file object in chunks"""
+    return iter(lambda: stream.read(CHUNK_SIZE), b'')
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Database Session Module
+Hands out pooled MySQL connections so that each request (or CLI command)
+holds at most one, shared by every get_db_connection() call it makes, and
+guarantees that connection goes back to the pool when the request ends,
+logging where any connection that was never closed was opened
+"""
+import os
+import sys
+import threading
+import time
+
+# Connections checked out outside a request are reported once held this long (seconds)
+HOLD_WARNING = 30.0
+
+# Attribute of the scope object (flask.g) the request's connection is kept under
+SCOPE_ATTR = '_db_connection'
+
+
+class ConnectionReleasedError(RuntimeError):
+    """Raised when a connection is used after it went back to the pool"""
+
+
+def _call_site(depth):
+    """Return "function (file:line)" of the frame depth levels above the calling function"""
+    try:
+        frame = sys._getframe(depth + 1)
+    except ValueError:
+        return 'unknown'
+    return f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})"
+
+
+class ManagedConnection:
+    """
+    Proxy of a pooled connection handed out by ConnectionManager
+
+    close() only returns the connection to the pool once every caller that
+    received it has closed it. Cursors are buffered unless asked otherwise,
+    so several callers can interleave queries on the shared connection.
+    Using it after that raises ConnectionReleasedError, since the pool may
+    already have handed the connection to someone else.
+    """
+
+    def __init__(self, manager, connection, scope, origin):
+        self._manager = manager
+        self._connection = connection
+        self._scope = scope
+        self.opened_at = origin
+        self.origins = [origin]
+        self.checked_out_at = time.monotonic()
+        self.released = False
+        self.warned = False
+
+    def cursor(self, *args, **kwargs):
+        """Open a cursor; buffered=True by default"""
+        if not args:
+            kwargs.setdefault('buffered', True)
+        return self._live().cursor(*args, **kwargs)
+
+    def close(self):
+        """Drop this caller's hold, returning the connection once nobody holds it"""
+        self._manager.release(self)
+
+    def _live(self):
+        if self.released:
+            raise ConnectionReleasedError(
+                f"Database connection opened at {self.opened_at} used after it was returned to the pool"
+            )
+        return self._connection
+
+    def __getattr__(self, name):
+        return getattr(self._live(), name)
+
+
+class ConnectionManager:
+    """
+    Request-scoped checkout of pooled connections with leak detection
+
+    Connections acquired with a scope (the request's flask.g) are reused
+    within it and force-returned by teardown(); connections acquired
+    without one (background threads) are tracked and reported when held
+    longer than hold_warning.
+    """
+
+    def __init__(self, acquire, logger=None, hold_warning=HOLD_WARNING):
+        """
+        Initialize the manager
+
+        Args:
+            acquire: Callable returning a raw pooled connection, e.g. db_pool.checkout
+            logger: Logger leaks and long holds are reported to
+            hold_warning: Seconds an unscoped connection may be held before it is reported
+        """
+        self._acquire = acquire
+        self.logger = logger
+        self.hold_warning = hold_warning
+        self._lock = threading.Lock()
+        self._active = set()
+        self.checkouts = 0
+        self.reused = 0
+        self.failures = 0
+        self.leaks = 0
+        self.long_holds = 0
+        self.peak_in_use = 0
+        self.total_hold = 0.0
+        self.max_hold = 0.0
+        self.released_count = 0
+
+    def acquire(self, scope=None, stacklevel=1):
+        """
+        Check out a connection, reusing the scope's connection if it has one open
+
+        Args:
+            scope: Object the connection is attached to (flask.g), or None
+            stacklevel: Frames above the caller to record as the checkout site
+
+        Returns:
+            ManagedConnection
+
+        Raises:
+            Whatever acquire() raises when the pool has no connection to give
+        """
+        origin = _call_site(stacklevel)
+        current = self.current(scope) if scope is not None else None
+        if current is not None:
+            current.origins.append(origin)
+            with self._lock:
+                self.reused += 1
+            return current
+
+        try:
+            connection = self._acquire()
+        except Exception:
+            with self._lock:
+                self.failures += 1
+            raise
+        managed = ManagedConnection(self, connection, scope, origin)
+        with self._lock:
+            self.checkouts += 1
+            self._active.add(managed)
+            self.peak_in_use = max(self.peak_in_use, len(self._active))
+        if scope is not None:
+            setattr(scope, SCOPE_ATTR, managed)
+        self._check_long_holds()
+        return managed
+
+    def current(self, scope):
+        """Return the scope's open connection, or None"""
+        managed = getattr(scope, SCOPE_ATTR, None)
+        return managed if managed is not None and not managed.released else None
+
+    def release(self, managed, force=False):
+        """
+        Drop one hold on a connection, returning it to the pool once none remain
+
+        Uncommitted work is rolled back first, as the pool's session reset would.
+
+        Args:
+            managed: ManagedConnection to release
+            force: Return it now regardless of outstanding holds
+        """
+        if managed.released:
+            return
+        if managed.origins and not force:
+            managed.origins.pop()
+        if managed.origins and not force:
+            return
+
+        managed.released = True
+        connection = managed._connection
+        try:
+            if connection.in_transaction:
+                connection.rollback()
+        except Exception as e:
+            if self.logger:
+                self.logger.warning(f"Rollback before returning a connection failed: {e}")
+        try:
+            connection.close()
+        except Exception as e:
+            if self.logger:
+                self.logger.warning(f"Error returning a connection to the pool: {e}")
+        if managed._scope is not None and getattr(managed._scope, SCOPE_ATTR, None) is managed:
+            setattr(managed._scope, SCOPE_ATTR, None)
+
+        held = time.monotonic() - managed.checked_out_at
+        with self._lock:
+            self._active.discard(managed)
+            self.released_count += 1
+            self.total_hold += held
+            self.max_hold = max(self.max_hold, held)
+
+    def teardown(self, scope, error=None, label=None):
+        """
+        Return the scope's connection to the pool at the end of a request
+
+        Args:
+            scope: Object passed to acquire()
+            error: Exception the request ended with, if any
+            label: Name of the request (endpoint) for the leak report
+        """
+        managed = self.current(scope)
+        if managed is None:
+            return
+        if managed.origins:
+            with self._lock:
+                self.leaks += 1
+            if self.logger:
+                self.logger.warning(
+                    f"Database connection leak in {label or 'request'}: "
+                    f"{len(managed.origins)} checkout(s) never closed, opened at {', '.join(managed.origins)}"
+                )
+        if error is not None:
+            try:
+                managed._connection.rollback()
+            except Exception:
+                pass
+        self.release(managed, force=True)
+
+    def _check_long_holds(self):
+        """Report unscoped connections held longer than hold_warning, once each"""
+        now = time.monotonic()
+        with self._lock:
+            overdue = [managed for managed in self._active
+                       if managed._scope is None and not managed.warned
+                       and now - managed.checked_out_at > self.hold_warning]
+            for managed in overdue:
+                managed.warned = True
+            self.long_holds += len(overdue)
+        if self.logger:
+            for managed in overdue:
+                self.logger.warning(
+                    f"Database connection held for {now - managed.checked_out_at:.0f}s, "
+                    f"opened at {', '.join(managed.origins) or 'unknown'}"
+                )
+
+    def stats(self):
+        """Return checkout, hold-time and leak metrics"""
+        self._check_long_holds()
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'in_use': len(self._active),
+                'peak_in_use': self.peak_in_use,
+                'checkouts': self.checkouts,
+                'reused': self.reused,
+                'failures': self.failures,
+                'leaks': self.leaks,
+                'long_holds': self.long_holds,
+                'avg_hold_ms': round(self.total_hold / self.released_count * 1000, 2) if self.released_count else 0.0,
+                'max_hold_ms': round(self.max_hold * 1000, 2),
+                'oldest_hold_s': round(max((now - m.checked_out_at for m in self._active), default=0.0), 2),
+            }
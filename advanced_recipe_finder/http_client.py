@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP Download Client Module
+Shared keep-alive session for fetching remote images, streaming each
+download with a hard size cap and identifying the image type from its
+first bytes instead of trusting URLs or headers
+"""
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Bytes read per chunk while streaming
+CHUNK_SIZE = 64 * 1024
+
+# Leading bytes -> image extension
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': 'image/*,*/*'
+}
+
+
+class DownloadError(Exception):
+    """Raised when a remote image cannot be downloaded"""
+
+
+class DownloadTooLarge(DownloadError):
+    """Raised when a download exceeds the byte cap"""
+
+
+def sniff_image_type(head):
+    """
+    Identify an image from its first bytes
+
+    Args:
+        head: At least the first 12 bytes of the file
+
+    Returns:
+        Extension ('png', 'jpg', 'gif' or 'webp'), or None if not a known image
+    """
+    for signature, ext in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+class DownloadClient:
+    """
+    Pooled, retrying HTTP client for image downloads
+
+    One requests.Session is shared by all threads, so connections (and their
+    TLS sessions) are reused across downloads to the same host.
+    """
+
+    def __init__(self, max_bytes=20 * 1024 * 1024, timeout=(10, 90), retries=3, backoff=0.5, pool_size=10):
+        """
+        Initialize the session
+
+        Args:
+            max_bytes: Hard cap on the size of one download
+            timeout: (connect, read) timeout in seconds
+            retries: Retries for connection errors and 429/5xx responses
+            backoff: Exponential backoff factor between retries
+            pool_size: Keep-alive connections kept per host
+        """
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=frozenset(['GET', 'HEAD']), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def open_image(self, url, verify=True, max_bytes=None):
+        """
+        Start streaming a remote image
+
+        The first chunk is read to identify the image type; the returned
+        iterator yields the whole body and raises DownloadTooLarge as soon as
+        the cap is passed, so memory use stays at one chunk.
+
+        Args:
+            url: Image URL
+            verify: Verify TLS certificates
+            max_bytes: Optional cap overriding the client default
+
+        Returns:
+            Tuple of (extension, iterator of byte chunks)
+
+        Raises:
+            DownloadError: On HTTP errors, oversized or non-image content
+        """
+        limit = max_bytes or self.max_bytes
+        try:
+            response = self.session.get(url, stream=True, timeout=self.timeout, verify=verify)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            raise DownloadError(f'Could not download {url}: {e}') from e
+
+        length = response.headers.get('Content-Length')
+        if length and length.isdigit() and int(length) > limit:
+            response.close()
+            raise DownloadTooLarge(f'{url} is {length} bytes, over the {limit} byte limit')
+
+        chunks = response.iter_content(chunk_size=CHUNK_SIZE)
+        try:
+            head = b''
+            while len(head) < 12:
+                chunk = next(chunks, b'')
+                if not chunk:
+                    break
+                head += chunk
+        except requests.exceptions.RequestException as e:
+            response.close()
+            raise DownloadError(f'Could not download {url}: {e}') from e
+
+        ext = sniff_image_type(head)
+        if not ext:
+            response.close()
+            raise DownloadError(f'{url} did not return an image')
+
+        def stream():
+            received = len(head)
+            try:
+                if received > limit:
+                    raise DownloadTooLarge(f'{url} exceeded the {limit} byte limit')
+                yield head
+                for chunk in chunks:
+                    received += len(chunk)
+                    if received > limit:
+                        raise DownloadTooLarge(f'{url} exceeded the {limit} byte limit')
+                    yield chunk
+            except requests.exceptions.RequestException as e:
+                raise DownloadError(f'Download of {url} failed: {e}') from e
+            finally:
+                response.close()
+
+        return ext, stream()
+
+    def fetch_image(self, url, verify=True, max_bytes=None):
+        """
+        Download a remote image into memory, bounded by the byte cap
+
+        Returns:
+            Tuple of (image bytes, extension)
+        """
+        ext, chunks = self.open_image(url, verify=verify, max_bytes=max_bytes)
+        return b''.join(chunks), ext
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_download_client():
+    """Return the process-wide DownloadClient, creating it on first use"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = DownloadClient()
+        return _client
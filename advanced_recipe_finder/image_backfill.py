@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Image Backfill Module
+Creates responsive derivatives for images uploaded before the image
+pipeline existed, spreading the work over all CPU cores and checkpointing
+progress so an interrupted run can resume where it stopped
+"""
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from image_pipeline import create_derivatives, parse_derivative_name, supports_derivatives, write_atomic
+from upload_layout import TEMP_DIR
+
+# Checkpoint is flushed to disk after this many finished images
+CHECKPOINT_EVERY = 25
+
+
+def find_sources(upload_folder, referenced=()):
+    """
+    List the images in the upload folder that derivatives can be made for
+
+    Hidden directories (the GC quarantine, checkpoints) and TEMP_DIR are
+    skipped, since nothing in them is served.
+
+    Args:
+        upload_folder: Path of the upload folder
+        referenced: Filenames referenced from the database (recipes.image_url, users.image_url)
+
+    Returns:
+        Tuple of (sorted filenames to process, sorted referenced filenames missing on disk)
+    """
+    sources = set()
+    for root, dirs, files in os.walk(upload_folder):
+        dirs[:] = [d for d in dirs
+                   if not d.startswith('.') and not (root == upload_folder and d == TEMP_DIR)]
+        for name in files:
+            relative = os.path.relpath(os.path.join(root, name), upload_folder).replace(os.sep, '/')
+            if not name.startswith(('.tmp_', 'temp_')) and supports_derivatives(relative):
+                sources.add(relative)
+
+    missing = set()
+    for filename in referenced:
+        if not filename or filename.startswith('http'):
+            continue
+        filename = filename[len('/uploads/'):] if filename.startswith('/uploads/') else filename
+        if supports_derivatives(filename) and filename not in sources:
+            missing.add(filename)
+    return sorted(sources), sorted(missing)
+
+
+def load_checkpoint(path):
+    """Return the {filename: [mtime_ns, size]} map of finished images, empty if there is no checkpoint"""
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('done', {})
+    except (OSError, ValueError):
+        return {}
+
+
+def save_checkpoint(path, done):
+    """Atomically write the checkpoint file"""
+    if path:
+        write_atomic(path, json.dumps({'done': done, 'updated_at': time.time()}).encode('utf-8'))
+
+
+def _fingerprint(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def transcode(upload_folder, filename):
+    """
+    Create the derivatives of one image (runs in a worker process)
+
+    Returns:
+        Tuple of (filename, fingerprint, source bytes, {"size.ext": derivative bytes})
+    """
+    source_path = os.path.join(upload_folder, filename)
+    fingerprint = _fingerprint(source_path)
+    sizes = {}
+    for path, length in create_derivatives(source_path).items():
+        _, size, ext = parse_derivative_name(os.path.basename(path))
+        sizes[f'{size}.{ext}'] = length
+    return filename, fingerprint, fingerprint[1], sizes
+
+
+def run_backfill(upload_folder, filenames, checkpoint_path=None, workers=None, force=False, log=print):
+    """
+    Create derivatives for many images in parallel
+
+    Images whose size and modification time match the checkpoint are
+    skipped unless ``force`` is set.
+
+    Args:
+        upload_folder: Path of the upload folder
+        filenames: Filenames relative to the upload folder
+        checkpoint_path: Path of the JSON checkpoint file, or None to disable resuming
+        workers: Worker processes, defaults to the CPU count
+        force: Reprocess images already recorded in the checkpoint
+        log: Callable used for progress messages
+
+    Returns:
+        Report dict with counts, bytes and throughput
+    """
+    workers = workers or os.cpu_count() or 1
+    done = {} if force else load_checkpoint(checkpoint_path)
+    pending = []
+    for filename in filenames:
+        path = os.path.join(upload_folder, filename)
+        if os.path.exists(path) and done.get(filename) != _fingerprint(path):
+            pending.append(filename)
+
+    report = {
+        'total': len(filenames),
+        'skipped': len(filenames) - len(pending),
+        'processed': 0,
+        'failed': 0,
+        'workers': workers,
+        'source_bytes': 0,
+        'derivative_bytes': {},
+    }
+    log(f"Backfilling {len(pending)} images with {workers} workers ({report['skipped']} already done)")
+
+    started = time.time()
+    unsaved = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(transcode, upload_folder, filename): filename for filename in pending}
+            for future in as_completed(futures):
+                filename = futures[future]
+                try:
+                    _, fingerprint, source_bytes, sizes = future.result()
+                except Exception as e:
+                    report['failed'] += 1
+                    log(f"Failed {filename}: {e}")
+                    continue
+
+                done[filename] = fingerprint
+                report['processed'] += 1
+                report['source_bytes'] += source_bytes
+                for key, length in sizes.items():
+                    report['derivative_bytes'][key] = report['derivative_bytes'].get(key, 0) + length
+
+                unsaved += 1
+                if unsaved >= CHECKPOINT_EVERY:
+                    save_checkpoint(checkpoint_path, done)
+                    unsaved = 0
+                    log(f"{report['processed']}/{len(pending)} images done")
+    finally:
+        save_checkpoint(checkpoint_path, done)
+
+    elapsed = time.time() - started
+    report['seconds'] = round(elapsed, 2)
+    report['images_per_second'] = round(report['processed'] / elapsed, 2) if elapsed else 0.0
+    # Savings per view when pages serve the WebP derivative instead of the original
+    for size in ('card', 'detail'):
+        served = report['derivative_bytes'].get(f'{size}.webp', 0)
+        report[f'bytes_saved_{size}'] = report['source_bytes'] - served
+    return report
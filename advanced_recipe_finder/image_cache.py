@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Generated Image Cache Module
+Remembers which stored upload a Bytez prompt (and logo) produced, so a
+repeated generation is answered from upload storage instead of a new
+image inference
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def image_cache_key(prompt, logo_hash=None):
+    """
+    Cache key for an image generation
+
+    Args:
+        prompt: Enhanced prompt sent to the model
+        logo_hash: Optional hex hash of the logo composited onto the image
+
+    Returns:
+        Hex SHA-256 key
+    """
+    normalized = ' '.join(prompt.lower().split())
+    return hashlib.sha256(f"{normalized}\0{logo_hash or ''}".encode('utf-8')).hexdigest()
+
+
+class GeneratedImageCache:
+    """
+    Thread-safe LRU map of cache key -> stored upload filename
+
+    The cache is bounded by the total size of the images it points at and
+    by entry count. Several keys may share one file (near-duplicate reuse,
+    content-addressed dedupe), so files are reference counted: a file is
+    counted once towards max_bytes and is passed to ``on_evict`` only when
+    the last key pointing at it leaves the cache, so storage can release it
+    if nothing else references it.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, max_entries=2000, on_evict=None):
+        """
+        Initialize an empty cache
+
+        Args:
+            max_bytes: Total image bytes the cache may point at
+            max_entries: Maximum number of cached prompts
+            on_evict: Optional callable receiving the filename of an evicted entry
+        """
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.on_evict = on_evict
+        self._entries = OrderedDict()
+        self._files = {}  # filename -> [keys pointing at it, size]
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Return the cached filename for key
+
+        Returns:
+            Filename relative to upload storage, or None
+        """
+        with self._lock:
+            filename = self._entries.get(key)
+            if filename is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return filename
+
+    def _ref(self, filename, size):
+        """Count one more key pointing at filename"""
+        refs = self._files.get(filename)
+        if refs:
+            refs[0] += 1
+        else:
+            self._files[filename] = [1, size]
+            self._bytes += size
+
+    def _unref(self, filename):
+        """Count one key fewer pointing at filename; returns True once no key is left"""
+        refs = self._files[filename]
+        refs[0] -= 1
+        if refs[0]:
+            return False
+        del self._files[filename]
+        self._bytes -= refs[1]
+        return True
+
+    def put(self, key, filename, size):
+        """Cache the stored image for key, evicting least recently used entries over the bounds"""
+        evicted = []
+        with self._lock:
+            # Take the new reference first so a key re-pointed at the same file never frees it
+            self._ref(filename, size)
+            previous = self._entries.pop(key, None)
+            if previous and self._unref(previous):
+                evicted.append(previous)
+            self._entries[key] = filename
+            while len(self._entries) > 1 and (self._bytes > self.max_bytes or len(self._entries) > self.max_entries):
+                _, evicted_filename = self._entries.popitem(last=False)
+                self.evictions += 1
+                if self._unref(evicted_filename):
+                    evicted.append(evicted_filename)
+
+        if self.on_evict:
+            for evicted_filename in evicted:
+                self.on_evict(evicted_filename)
+
+    def discard(self, key):
+        """Forget key, e.g. when its file no longer exists"""
+        with self._lock:
+            filename = self._entries.pop(key, None)
+            if filename:
+                self._unref(filename)
+
+    def stats(self):
+        """Return hit-rate and size metrics"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'files': len(self._files),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
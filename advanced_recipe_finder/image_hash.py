@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Perceptual Image Hash Module
+64-bit difference hashes (dHash) that stay nearly equal for visually
+near-identical images, and an in-memory index answering "is there a
+stored image within N bits of this one" without comparing against every
+image
+"""
+import threading
+from io import BytesIO
+
+from PIL import Image
+
+# dHash grid: HASH_SIZE x HASH_SIZE comparisons -> 64 bits
+HASH_SIZE = 8
+HASH_BITS = HASH_SIZE * HASH_SIZE
+
+
+def dhash(image):
+    """
+    Difference hash of an image
+
+    The image is shrunk to 9x8 grayscale and each bit records whether a
+    pixel is brighter than its right neighbour, so re-encoding, resizing
+    and small edits change only a few bits.
+
+    Args:
+        image: Opened PIL image
+
+    Returns:
+        64-bit int
+    """
+    small = image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hash_image_bytes(data):
+    """Decode encoded image bytes and return their dhash()"""
+    with Image.open(BytesIO(data)) as image:
+        image.draft('L', (HASH_SIZE * 16, HASH_SIZE * 16))
+        return dhash(image)
+
+
+def hamming(a, b):
+    """Number of differing bits between two hashes"""
+    return bin(a ^ b).count('1')
+
+
+class PerceptualHashIndex:
+    """
+    Thread-safe multi-index of image hashes for Hamming-distance lookups
+
+    The 64 bits are split into max_distance + 1 bands with one exact-match
+    table each. Two hashes within max_distance bits must agree on at least
+    one whole band, so only images sharing a band are compared.
+    """
+
+    def __init__(self, max_distance=5):
+        """
+        Initialize an empty index
+
+        Args:
+            max_distance: Largest Hamming distance lookups can be asked for
+        """
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        widths = [HASH_BITS // bands + (1 if i < HASH_BITS % bands else 0) for i in range(bands)]
+        self._bands = []
+        shift = HASH_BITS
+        for width in widths:
+            shift -= width
+            self._bands.append((shift, (1 << width) - 1))
+        self._tables = [{} for _ in self._bands]
+        self._hashes = {}
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.matches = 0
+
+    def _keys(self, value):
+        return [(value >> shift) & mask for shift, mask in self._bands]
+
+    def add(self, filename, value):
+        """Index filename under hash value, replacing any previous hash"""
+        with self._lock:
+            self._remove(filename)
+            self._hashes[filename] = value
+            for table, key in zip(self._tables, self._keys(value)):
+                table.setdefault(key, set()).add(filename)
+
+    def remove(self, filename):
+        """Drop filename from the index"""
+        with self._lock:
+            self._remove(filename)
+
+    def _remove(self, filename):
+        value = self._hashes.pop(filename, None)
+        if value is None:
+            return
+        for table, key in zip(self._tables, self._keys(value)):
+            bucket = table.get(key)
+            if bucket:
+                bucket.discard(filename)
+                if not bucket:
+                    del table[key]
+
+    def get(self, filename):
+        """Return the indexed hash of filename, or None"""
+        with self._lock:
+            return self._hashes.get(filename)
+
+    def _candidates(self, value):
+        candidates = set()
+        for table, key in zip(self._tables, self._keys(value)):
+            candidates.update(table.get(key, ()))
+        return candidates
+
+    def nearest(self, value, max_distance=None, exclude=()):
+        """
+        Find the closest indexed image
+
+        Args:
+            value: Hash to look up
+            max_distance: Largest accepted distance (at most the index's max_distance)
+            exclude: Filenames to ignore, e.g. the image itself
+
+        Returns:
+            Tuple of (filename, distance), or None if nothing is close enough
+        """
+        limit = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        with self._lock:
+            self.lookups += 1
+            best = None
+            for filename in self._candidates(value):
+                if filename in exclude:
+                    continue
+                distance = hamming(value, self._hashes[filename])
+                if distance <= limit and (best is None or (distance, filename) < best[::-1]):
+                    best = (filename, distance)
+            if best:
+                self.matches += 1
+            return best
+
+    def clusters(self, max_distance=None):
+        """
+        Group indexed images into near-duplicate clusters
+
+        Returns:
+            List of clusters (sorted lists of filenames, two or more each), largest first
+        """
+        limit = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        with self._lock:
+            parent = {}
+
+            def find(name):
+                while parent.get(name, name) != name:
+                    name = parent[name]
+                return name
+
+            for filename, value in self._hashes.items():
+                for other in self._candidates(value):
+                    if other < filename and hamming(value, self._hashes[other]) <= limit:
+                        parent[find(filename)] = find(other)
+
+            groups = {}
+            for filename in parent:
+                root = find(filename)
+                groups.setdefault(root, {root}).add(filename)
+        return sorted((sorted(group) for group in groups.values() if len(group) > 1), key=len, reverse=True)
+
+    def stats(self):
+        """Return index size and lookup metrics"""
+        with self._lock:
+            return {
+                'images': len(self._hashes),
+                'max_distance': self.max_distance,
+                'lookups': self.lookups,
+                'matches': self.matches,
+            }
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Upload Ingestion Module
+Decodes uploaded images in worker processes, rejecting anything that is
+not really an image, applying EXIF orientation, dropping metadata and
+capping the longest edge, so phone photos are stored at a size worth
+serving
+"""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+from image_pipeline import describe_image
+
+# Decoded PIL format -> (stored extension, save format)
+ACCEPTED_FORMATS = {
+    'JPEG': ('jpg', 'JPEG'),
+    'PNG': ('png', 'PNG'),
+    'WEBP': ('webp', 'WEBP'),
+    # Only the first frame of a GIF is kept
+    'GIF': ('png', 'PNG'),
+}
+
+# Refuse images that would decode to more pixels than this (decompression bombs)
+MAX_PIXELS = 64 * 1000 * 1000
+
+
+class IngestError(ValueError):
+    """Raised when an upload is not an acceptable image"""
+
+
+def ingest_image(data, max_edge=2048, quality=85):
+    """
+    Normalize an uploaded image
+
+    Runs in a worker process, so it only takes and returns plain bytes.
+
+    Args:
+        data: Uploaded file bytes
+        max_edge: Longest edge of the stored image in pixels
+        quality: JPEG/WebP encoder quality
+
+    Returns:
+        Tuple of (encoded bytes, extension, describe_image() metadata of the stored image)
+
+    Raises:
+        IngestError: If the content is not a supported image
+    """
+    try:
+        with Image.open(BytesIO(data)) as image:
+            if image.format not in ACCEPTED_FORMATS:
+                raise IngestError(f'Unsupported image format: {image.format or "unknown"}')
+            if image.width * image.height > MAX_PIXELS:
+                raise IngestError(f'Image is too large ({image.width}x{image.height})')
+            ext, save_format = ACCEPTED_FORMATS[image.format]
+            icc_profile = image.info.get('icc_profile')
+
+            if image.format == 'JPEG':
+                # Let libjpeg scale down while decoding; the final resize stays high quality
+                image.draft('RGB', (max_edge, max_edge))
+            image.load()
+            image = ImageOps.exif_transpose(image)
+            if image.mode == 'CMYK':
+                # The embedded profile describes CMYK values, not the converted RGB
+                icc_profile = None
+            if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+                image = image.convert('RGBA' if 'transparency' in image.info or image.mode == 'PA' else 'RGB')
+            if max(image.size) > max_edge:
+                image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+    except IngestError:
+        raise
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        raise IngestError('File is not a valid image') from e
+
+    # Re-encoding without passing exif/xmp drops camera, GPS and editor metadata;
+    # only the colour profile is carried over
+    options = {'icc_profile': icc_profile} if icc_profile else {}
+    if save_format == 'JPEG':
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        options.update(quality=quality, optimize=True, progressive=True)
+    elif save_format == 'WEBP':
+        options.update(quality=quality, method=4)
+    else:
+        options.update(optimize=True)
+
+    buffer = BytesIO()
+    image.save(buffer, save_format, **options)
+    # Size, colour and placeholder come from the decoded image, so pages never reopen the file for them
+    return buffer.getvalue(), ext, describe_image(image)
+
+
+def _worker_context():
+    """Multiprocessing context that does not fork the (multithreaded) web process"""
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+class UploadIngestor:
+    """
+    Process pool running ingest_image for request handlers
+
+    The pool is created on first use. Request threads only wait on the
+    result, so decoding and resizing never hold the web process's GIL.
+
+    Workers are started from a fork server (spawn where that is not
+    available) rather than forked from the web process: by the time the
+    first upload arrives it runs image, TTS and queue threads, and a child
+    forked while one of them holds a lock can deadlock. The fork server
+    only preloads this module. When the app is started as a script the
+    workers import it once as __mp_main__, as they would under spawn.
+    """
+
+    def __init__(self, workers=2, max_edge=2048, quality=85, timeout=60):
+        """
+        Initialize the ingestor
+
+        Args:
+            workers: Worker processes
+            max_edge: Longest edge of stored images
+            quality: JPEG/WebP encoder quality
+            timeout: Seconds to wait for one image
+        """
+        self.workers = workers
+        self.max_edge = max_edge
+        self.quality = quality
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self.processed = 0
+        self.rejected = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_worker_context())
+            return self._executor
+
+    def ingest(self, data):
+        """
+        Normalize an upload in a worker process
+
+        Args:
+            data: Uploaded file bytes
+
+        Returns:
+            Tuple of (encoded bytes, extension, image metadata dict)
+
+        Raises:
+            IngestError: If the content is not a supported image
+        """
+        executor = self._pool()
+        try:
+            result, ext, metadata = executor.submit(ingest_image, data, self.max_edge, self.quality).result(timeout=self.timeout)
+        except IngestError:
+            with self._lock:
+                self.rejected += 1
+            raise
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool for the next upload
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False)
+            raise
+        with self._lock:
+            self.processed += 1
+            self.bytes_in += len(data)
+            self.bytes_out += len(result)
+        return result, ext, metadata
+
+    def stats(self):
+        """Return ingestion metrics"""
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_edge': self.max_edge,
+                'processed': self.processed,
+                'rejected': self.rejected,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+            }
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Responsive Image Pipeline Module
+Creates resized WebP and JPEG derivatives of uploaded images so pages
+can serve small card thumbnails through srcset instead of full-size files
+"""
+import base64
+import os
+import tempfile
+from collections import OrderedDict
+from io import BytesIO
+
+from PIL import Image, ImageFilter
+
+# Derivative name -> target width in pixels
+DERIVATIVE_WIDTHS = OrderedDict([
+    ('card', 400),
+    ('detail', 800),
+    ('detail2x', 1600),
+])
+
+# Extension -> (PIL format, save options)
+DERIVATIVE_FORMATS = OrderedDict([
+    ('webp', ('WEBP', {'quality': 80, 'method': 4})),
+    ('jpg', ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True})),
+])
+
+# Source images we know how to derive from
+SOURCE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+
+DERIVATIVE_SEPARATOR = '__'
+
+
+def derivative_name(filename, size, ext):
+    """
+    Name of a derivative file, stored next to its source
+
+    Args:
+        filename: Source filename (may include a sub-directory)
+        size: Key of DERIVATIVE_WIDTHS
+        ext: Key of DERIVATIVE_FORMATS
+
+    Returns:
+        Derivative filename, e.g. "abc.png__card.webp"
+    """
+    return f"{filename}{DERIVATIVE_SEPARATOR}{size}.{ext}"
+
+
+def parse_derivative_name(filename):
+    """
+    Split a derivative filename into its parts
+
+    Returns:
+        Tuple of (source_filename, size, ext), or None if filename is not a derivative
+    """
+    if DERIVATIVE_SEPARATOR not in filename:
+        return None
+    source, suffix = filename.rsplit(DERIVATIVE_SEPARATOR, 1)
+    size, _, ext = suffix.partition('.')
+    if size not in DERIVATIVE_WIDTHS or ext not in DERIVATIVE_FORMATS:
+        return None
+    return source, size, ext
+
+
+def derivative_widths(source_width):
+    """
+    Widths the derivatives of an image actually have
+
+    Derivatives are never upscaled, so every size wider than the source is
+    encoded at the source width; only the first size of each distinct
+    width is listed.
+
+    Args:
+        source_width: Width of the source image in pixels
+
+    Returns:
+        List of (size, width) pairs, narrowest first
+    """
+    widths = []
+    for size, target in DERIVATIVE_WIDTHS.items():
+        width = min(target, source_width)
+        if not widths or widths[-1][1] != width:
+            widths.append((size, width))
+    return widths
+
+
+def is_derivative(filename):
+    """Check whether filename names a derivative"""
+    return parse_derivative_name(filename) is not None
+
+
+def supports_derivatives(filename):
+    """Check whether derivatives can be made for filename"""
+    if not filename or '.' not in filename or is_derivative(filename):
+        return False
+    return filename.rsplit('.', 1)[1].lower() in SOURCE_EXTENSIONS
+
+
+def _flatten(image):
+    """Convert to RGB, compositing any transparency onto white for JPEG"""
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        return background
+    return image.convert('RGB')
+
+
+def render_derivatives(image):
+    """
+    Render every derivative of an image in memory
+
+    Images are never upscaled; a source narrower than a target width is
+    encoded at its own size.
+
+    Args:
+        image: Opened PIL image
+
+    Returns:
+        Dict of (size, ext) -> encoded bytes
+    """
+    image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or image.mode == 'P' else 'RGB')
+
+    outputs = {}
+    for size, width in DERIVATIVE_WIDTHS.items():
+        resized = image
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            resized = image.resize((width, height), Image.Resampling.LANCZOS)
+        for ext, (pil_format, options) in DERIVATIVE_FORMATS.items():
+            buffer = BytesIO()
+            frame = _flatten(resized) if pil_format == 'JPEG' else resized
+            frame.save(buffer, pil_format, **options)
+            outputs[(size, ext)] = buffer.getvalue()
+    return outputs
+
+
+def write_atomic(path, data):
+    """
+    Write bytes so readers never see a partially written file
+
+    Args:
+        path: Destination path
+        data: Bytes to write
+    """
+    directory = os.path.dirname(path) or '.'
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp_')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def create_derivatives(source_path):
+    """
+    Create all derivatives of an image file next to it
+
+    Args:
+        source_path: Path of the source image
+
+    Returns:
+        Dict of derivative path -> size in bytes
+    """
+    with Image.open(source_path) as image:
+        outputs = render_derivatives(image)
+
+    written = {}
+    for (size, ext), data in outputs.items():
+        path = derivative_name(source_path, size, ext)
+        write_atomic(path, data)
+        written[path] = len(data)
+    return written
+
+
+# Longest edge of the inline blurred placeholder
+LQIP_SIZE = 16
+
+
+def describe_image(image, size=None):
+    """
+    Compute the metadata pages need to reserve space for an image
+
+    Args:
+        image: Opened PIL image
+        size: Original (width, height) if image was decoded at reduced scale
+
+    Returns:
+        Dict with 'width', 'height', 'color' (dominant colour as #rrggbb) and
+        'lqip' (a tiny blurred WebP as a data URI, a few hundred bytes)
+    """
+    width, height = size or image.size
+    rgb = _flatten(image)
+
+    # The most common colour of an 8-colour quantized thumbnail
+    small = rgb.resize((32, 32), Image.Resampling.BILINEAR)
+    palette_image = small.quantize(colors=8)
+    palette = palette_image.getpalette()
+    index = max(palette_image.getcolors(), key=lambda item: item[0])[1]
+    color = '#{:02x}{:02x}{:02x}'.format(*palette[index * 3:index * 3 + 3])
+
+    scale = LQIP_SIZE / max(width, height)
+    thumbnail = rgb.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.Resampling.BILINEAR)
+    thumbnail = thumbnail.filter(ImageFilter.GaussianBlur(1))
+    buffer = BytesIO()
+    thumbnail.save(buffer, 'WEBP', quality=40)
+    lqip = 'data:image/webp;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+    return {'width': width, 'height': height, 'color': color, 'lqip': lqip}
+
+
+def describe_image_file(path):
+    """
+    Open an image file and return describe_image() for it
+
+    JPEGs are decoded at reduced scale, which is plenty for a 16px
+    placeholder and much cheaper than a full decode.
+    """
+    with Image.open(path) as image:
+        size = image.size
+        image.draft('RGB', (LQIP_SIZE * 16, LQIP_SIZE * 16))
+        image.load()
+        return describe_image(image, size)
+
+
+def describe_image_bytes(data):
+    """Decode encoded image bytes and return describe_image() for them"""
+    with Image.open(BytesIO(data)) as image:
+        image.load()
+        return describe_image(image)
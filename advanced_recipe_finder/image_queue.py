@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Image Generation Queue Module
+Runs image generations on a fixed number of worker threads so bursts of
+requests queue up at the rate the upstream model can sustain, serving
+users round-robin so one user's batch cannot starve everybody else
+"""
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when the generation queue has no room for another job"""
+
+
+class ImageGenerationService:
+    """
+    Fixed-size worker pool with a per-user fair FIFO queue
+
+    Each user has their own FIFO; workers take the next job from users in
+    round-robin order. Jobs are tracked by id so clients can poll their
+    queue position and result.
+    """
+
+    def __init__(self, workers=2, max_queue=100, max_per_user=3, result_ttl=600):
+        """
+        Start the worker threads
+
+        Args:
+            workers: Concurrent generations (the upstream's sustainable concurrency)
+            max_queue: Maximum queued jobs across all users
+            max_per_user: Maximum queued jobs per user
+            result_ttl: Seconds finished jobs stay available for polling
+        """
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.result_ttl = result_ttl
+        self._queues = OrderedDict()  # user -> deque of job ids, in round-robin order
+        self._jobs = {}
+        self._ids = itertools.count(1)
+        self._condition = threading.Condition()
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self._workers = [threading.Thread(target=self._work, name=f'image-generation-{i}', daemon=True)
+                         for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, user, fn, *args, **kwargs):
+        """
+        Queue a generation
+
+        Args:
+            user: Key used for fairness (user id or client address)
+            fn: Callable to run on a worker
+            *args, **kwargs: Arguments for fn
+
+        Returns:
+            Tuple of (job_id, concurrent.futures.Future)
+
+        Raises:
+            QueueFullError: If the queue or the user's share of it is full
+        """
+        with self._condition:
+            self._purge()
+            queued = sum(len(q) for q in self._queues.values())
+            if queued >= self.max_queue:
+                raise QueueFullError('Image generation queue is full')
+            if len(self._queues.get(user, ())) >= self.max_per_user:
+                raise QueueFullError('You already have image generations waiting')
+
+            job_id = str(next(self._ids))
+            future = Future()
+            self._jobs[job_id] = {
+                'user': user, 'future': future, 'call': (fn, args, kwargs),
+                'queued_at': time.time(), 'finished_at': None
+            }
+            self._queues.setdefault(user, deque()).append(job_id)
+            self._condition.notify()
+            return job_id, future
+
+    def position(self, job_id):
+        """
+        Number of jobs that will start before job_id (0 = next), or None if it is not queued
+
+        The round-robin order is simulated over the current queues.
+        """
+        with self._condition:
+            queues = [list(q) for q in self._queues.values()]
+        ahead = 0
+        for depth in range(max((len(q) for q in queues), default=0)):
+            for queue in queues:
+                if depth < len(queue):
+                    if queue[depth] == job_id:
+                        return ahead
+                    ahead += 1
+        return None
+
+    def status(self, job_id, user=None):
+        """
+        Describe a job for polling
+
+        Args:
+            job_id: Id returned by submit
+            user: If given, jobs of other users are reported as unknown
+
+        Returns:
+            dict with 'state' ('queued', 'running', 'done', 'failed' or 'unknown') and
+            'position', 'result' or 'error' where applicable
+        """
+        with self._condition:
+            job = self._jobs.get(job_id)
+        if not job or (user is not None and job['user'] != user):
+            return {'state': 'unknown'}
+        future = job['future']
+        if future.done():
+            if future.exception():
+                return {'state': 'failed', 'error': str(future.exception())}
+            return {'state': 'done', 'result': future.result()}
+        if future.running():
+            return {'state': 'running'}
+        return {'state': 'queued', 'position': self.position(job_id)}
+
+    def _next_job(self):
+        """Pop the next job in round-robin order (condition held)"""
+        for user in list(self._queues):
+            queue = self._queues.pop(user)
+            job_id = queue.popleft()
+            if queue:
+                # The user goes to the back of the rotation
+                self._queues[user] = queue
+            return job_id
+        return None
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._queues:
+                    self._condition.wait()
+                job_id = self._next_job()
+                job = self._jobs[job_id]
+
+            future = job['future']
+            if not future.set_running_or_notify_cancel():
+                with self._condition:
+                    job['finished_at'] = time.time()
+                continue
+            fn, args, kwargs = job['call']
+            wait = time.time() - job['queued_at']
+            try:
+                future.set_result(fn(*args, **kwargs))
+                succeeded = True
+            except Exception as e:
+                logger.error(f"Image generation job {job_id} failed: {e}")
+                future.set_exception(e)
+                succeeded = False
+            with self._condition:
+                job['finished_at'] = time.time()
+                job['call'] = None
+                self.total_wait += wait
+                if succeeded:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+
+    def _purge(self):
+        """Forget finished jobs older than result_ttl (condition held)"""
+        cutoff = time.time() - self.result_ttl
+        for job_id in [j for j, job in self._jobs.items() if job['finished_at'] and job['finished_at'] < cutoff]:
+            del self._jobs[job_id]
+
+    def stats(self):
+        """Return queue metrics"""
+        with self._condition:
+            finished = self.completed + self.failed
+            return {
+                'workers': len(self._workers),
+                'queued': sum(len(q) for q in self._queues.values()),
+                'users_waiting': len(self._queues),
+                'running': sum(1 for job in self._jobs.values() if job['future'].running()),
+                'completed': self.completed,
+                'failed': self.failed,
+                'avg_wait_seconds': round(self.total_wait / finished, 2) if finished else 0.0,
+            }
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Logo Asset Store Module
+Keeps uploaded brand logos decoded in memory, keyed by the hash of their
+bytes, together with RGBA copies already resized to each width they are
+composited at, so stamping a logo onto an image is one alpha paste
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from PIL import Image
+
+# Logos are decoded at most this large; composited logos are far smaller
+MAX_LOGO_EDGE = 1024
+
+
+def logo_hash(logo_bytes):
+    """Hex SHA-256 of a logo's encoded bytes"""
+    return hashlib.sha256(logo_bytes).hexdigest()
+
+
+class LogoStore:
+    """
+    Thread-safe LRU of decoded logos and their resized variants
+
+    Each logo keeps up to max_variants widths; logos themselves are evicted
+    least recently used beyond max_logos.
+    """
+
+    def __init__(self, max_logos=64, max_variants=8):
+        """
+        Initialize an empty store
+
+        Args:
+            max_logos: Logos kept decoded
+            max_variants: Resized widths kept per logo
+        """
+        self.max_logos = max_logos
+        self.max_variants = max_variants
+        self._logos = OrderedDict()
+        self._lock = threading.Lock()
+        self.decodes = 0
+        self.resizes = 0
+        self.hits = 0
+
+    def put(self, logo_bytes):
+        """
+        Decode a logo unless it is already stored
+
+        Args:
+            logo_bytes: Encoded logo image
+
+        Returns:
+            Hex hash the logo is stored under
+
+        Raises:
+            OSError: If the bytes are not a readable image
+        """
+        digest = logo_hash(logo_bytes)
+        with self._lock:
+            if digest in self._logos:
+                self._logos.move_to_end(digest)
+                self.hits += 1
+                return digest
+
+        with Image.open(BytesIO(logo_bytes)) as image:
+            image.load()
+            logo = image.convert('RGBA')
+        if max(logo.size) > MAX_LOGO_EDGE:
+            logo.thumbnail((MAX_LOGO_EDGE, MAX_LOGO_EDGE), Image.Resampling.LANCZOS)
+
+        with self._lock:
+            self.decodes += 1
+            self._logos[digest] = {'image': logo, 'variants': OrderedDict()}
+            self._logos.move_to_end(digest)
+            while len(self._logos) > self.max_logos:
+                self._logos.popitem(last=False)
+        return digest
+
+    def variant(self, digest, width):
+        """
+        Return the logo resized to width (aspect ratio kept) as an RGBA image
+
+        The returned image is shared; callers must not modify it.
+
+        Returns:
+            PIL RGBA image, or None if the logo is not stored
+        """
+        width = max(1, int(width))
+        with self._lock:
+            entry = self._logos.get(digest)
+            if not entry:
+                return None
+            self._logos.move_to_end(digest)
+            variants = entry['variants']
+            logo = variants.get(width)
+            if logo is not None:
+                variants.move_to_end(width)
+                self.hits += 1
+                return logo
+            source = entry['image']
+
+        height = max(1, round(width * source.height / source.width))
+        logo = source.resize((width, height), Image.Resampling.LANCZOS)
+        with self._lock:
+            self.resizes += 1
+            variants[width] = logo
+            while len(variants) > self.max_variants:
+                variants.popitem(last=False)
+        return logo
+
+    def stats(self):
+        """Return store metrics"""
+        with self._lock:
+            return {
+                'logos': len(self._logos),
+                'variants': sum(len(entry['variants']) for entry in self._logos.values()),
+                'decodes': self.decodes,
+                'resizes': self.resizes,
+                'hits': self.hits,
+            }
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+Meal Plan Template Cache Module
+Reuses AI meal plans for common inputs and personalizes them locally
+by shuffling days and swapping in meals from a validated meal library
+"""
+import copy
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from recipe_retrieval import tokenize
+
+# Allergy answers that mean "no allergies"
+NO_ALLERGY_WORDS = {'', 'none', 'no', 'nil', 'na', 'n/a', 'no allergies', 'nothing'}
+
+# Common allergen groups and the ingredients that belong to them; an allergy
+# naming a group also rules out every ingredient listed for it
+ALLERGEN_GROUPS = {
+    'nut': ('nut', 'almond', 'cashew', 'walnut', 'pecan', 'pistachio', 'hazelnut', 'macadamia',
+            'brazil nut', 'pine nut', 'chestnut', 'praline', 'marzipan', 'nutella', 'peanut'),
+    'peanut': ('peanut', 'groundnut', 'satay'),
+    'milk': ('milk', 'cheese', 'butter', 'cream', 'yogurt', 'yoghurt', 'paneer', 'ghee', 'whey',
+             'casein', 'curd', 'kefir', 'custard', 'mozzarella', 'parmesan', 'cheddar', 'feta',
+             'ricotta', 'mascarpone', 'halloumi', 'lassi', 'raita', 'tzatziki', 'bechamel'),
+    'egg': ('egg', 'mayonnaise', 'mayo', 'meringue', 'aioli', 'omelette', 'omelet', 'frittata',
+            'quiche', 'custard', 'shakshuka'),
+    'gluten': ('wheat', 'flour', 'bread', 'breadcrumb', 'pasta', 'spaghetti', 'noodle', 'barley',
+               'rye', 'couscous', 'semolina', 'bulgur', 'spelt', 'seitan', 'cracker', 'pastry',
+               'pizza', 'naan', 'pita', 'roti', 'chapati', 'paratha', 'tortilla', 'bagel', 'croissant',
+               'muffin', 'pancake', 'waffle', 'cake', 'cookie', 'biscuit', 'soy sauce', 'beer'),
+    'fish': ('fish', 'salmon', 'tuna', 'cod', 'tilapia', 'trout', 'sardine', 'anchovy', 'mackerel',
+             'halibut', 'haddock', 'sea bass', 'snapper', 'catfish', 'pollock', 'worcestershire'),
+    'shellfish': ('shellfish', 'shrimp', 'prawn', 'crab', 'lobster', 'crayfish', 'scallop', 'clam',
+                  'mussel', 'oyster', 'squid', 'calamari', 'octopus'),
+    'soy': ('soy', 'soya', 'soybean', 'tofu', 'tempeh', 'edamame', 'miso'),
+    'sesame': ('sesame', 'tahini', 'hummus', 'halva'),
+}
+
+# Other names users give the allergen groups
+ALLERGEN_ALIASES = {
+    'tree nut': ('nut',),
+    'dairy': ('milk',),
+    'lactose': ('milk',),
+    'wheat': ('gluten',),
+    'celiac': ('gluten',),
+    'coeliac': ('gluten',),
+    'crustacean': ('shellfish',),
+    'seafood': ('fish', 'shellfish'),
+    'soybean': ('soy',),
+    'soya': ('soy',),
+}
+
+# Words around an allergen that are not part of it ("nut allergy", "gluten-free")
+ALLERGY_FILLER_WORDS = {'allergy', 'allergic', 'intolerance', 'intolerant', 'free', 'sensitivity', 'product'}
+
+
+def _allergen_key(text):
+    return ' '.join(term for term in tokenize(text) if term not in ALLERGY_FILLER_WORDS)
+
+
+_GROUP_TERMS = {_allergen_key(group): [tuple(tokenize(item)) for item in items]
+                for group, items in ALLERGEN_GROUPS.items()}
+_GROUP_ALIASES = {_allergen_key(alias): [_allergen_key(group) for group in groups]
+                  for alias, groups in ALLERGEN_ALIASES.items()}
+_KNOWN_INGREDIENTS = {terms for items in _GROUP_TERMS.values() for terms in items}
+
+
+def allergen_terms(allergy):
+    """
+    Expand an allergy into the ingredient terms it rules out
+
+    Args:
+        allergy: Allergy string, e.g. "nuts" or "dairy"
+
+    Returns:
+        List of term tuples; a meal containing all terms of any tuple is unsafe
+    """
+    key = _allergen_key(allergy)
+    if not key:
+        return []
+    terms = [tuple(key.split())]
+    for group in _GROUP_ALIASES.get(key, [key]):
+        terms.extend(_GROUP_TERMS.get(group, ()))
+    return terms
+
+
+def is_known_allergy(allergy):
+    """Check whether an allergy is an allergen group, one of its aliases or one of its ingredients"""
+    key = _allergen_key(allergy)
+    return (not key or key in _GROUP_TERMS or key in _GROUP_ALIASES
+            or tuple(key.split()) in _KNOWN_INGREDIENTS)
+
+
+def _normalize_list(text):
+    items = {' '.join(item.lower().split()) for item in re.split(r'[,;/]', text or '')}
+    return tuple(sorted(item for item in items if item and item not in NO_ALLERGY_WORDS))
+
+
+def plan_key(dietary_preferences, allergies, days):
+    """
+    Build the template cache key for a meal plan request
+
+    Args:
+        dietary_preferences: Free-text dietary preferences
+        allergies: Free-text allergies
+        days: Number of days
+
+    Returns:
+        Hashable key
+    """
+    return (_normalize_list(dietary_preferences), _normalize_list(allergies), int(days))
+
+
+def is_valid_meal(meal):
+    """Check that a meal has everything the meal planner templates display"""
+    return (isinstance(meal, dict)
+            and isinstance(meal.get('name'), str) and meal['name'].strip()
+            and isinstance(meal.get('type'), str) and meal['type'].strip()
+            and isinstance(meal.get('ingredients'), list)
+            and all(isinstance(i, str) for i in meal['ingredients']))
+
+
+def is_valid_plan(plan, days):
+    """Check that a plan has exactly `days` days made of valid meals"""
+    if not isinstance(plan, dict) or not isinstance(plan.get('days'), list) or len(plan['days']) != days:
+        return False
+    for day in plan['days']:
+        if not isinstance(day, dict) or not isinstance(day.get('meals'), list) or not day['meals']:
+            return False
+        if not all(is_valid_meal(meal) for meal in day['meals']):
+            return False
+    return True
+
+
+def contains_allergen(meal, allergies):
+    """
+    Check whether a meal mentions any of the given allergies
+
+    Allergen groups are expanded first, so "nuts" also matches almonds and
+    "dairy" matches cheese or paneer.
+
+    Args:
+        meal: Meal dict
+        allergies: Iterable of allergy strings
+
+    Returns:
+        True if any allergy term appears in the meal name, description or ingredients
+    """
+    terms = set(tokenize(' '.join([meal.get('name', ''), meal.get('description', '') or ''] + meal.get('ingredients', []))))
+    for allergy in allergies:
+        for allergen in allergen_terms(allergy):
+            if all(term in terms for term in allergen):
+                return True
+    return False
+
+
+class MealLibrary:
+    """
+    Validated meals collected from generated plans, grouped by diet and meal type
+    """
+
+    def __init__(self, max_per_type=200):
+        self.max_per_type = max_per_type
+        self._meals = {}
+        self._lock = threading.Lock()
+
+    def add_plan(self, diet, plan):
+        """
+        Add every valid meal of a plan to the library
+
+        Args:
+            diet: Normalized dietary preferences (first element of a plan key)
+            plan: Meal plan dict with a 'days' list
+        """
+        with self._lock:
+            by_type = self._meals.setdefault(diet, {})
+            for day in plan.get('days', []):
+                for meal in day.get('meals', []):
+                    if not is_valid_meal(meal):
+                        continue
+                    meals = by_type.setdefault(meal['type'].strip().lower(), OrderedDict())
+                    meals[meal['name'].strip().lower()] = copy.deepcopy(meal)
+                    meals.move_to_end(meal['name'].strip().lower())
+                    while len(meals) > self.max_per_type:
+                        meals.popitem(last=False)
+
+    def meals_for(self, diet, meal_type):
+        """Return library meals for a diet and meal type"""
+        with self._lock:
+            return list(self._meals.get(diet, {}).get(meal_type.strip().lower(), {}).values())
+
+
+class MealPlanTemplateCache:
+    """
+    Template cache with a freshness policy
+
+    A template is reused until it is ``max_age`` seconds old or has been
+    served ``max_serves`` times, after which the next request regenerates it.
+    """
+
+    def __init__(self, max_age=259200, max_serves=25, max_entries=500):
+        """
+        Initialize an empty cache
+
+        Args:
+            max_age: Seconds before a template is regenerated
+            max_serves: Number of personalized plans served from one template
+            max_entries: Maximum number of cached templates
+        """
+        self.max_age = max_age
+        self.max_serves = max_serves
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Return a fresh template for key, counting the serve
+
+        Returns:
+            Deep copy of the template plan, or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and (time.time() - entry['created_at'] > self.max_age or entry['serves'] >= self.max_serves):
+                del self._entries[key]
+                entry = None
+            if not entry:
+                self.misses += 1
+                return None
+            entry['serves'] += 1
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry['plan'])
+
+    def put(self, key, plan):
+        """Store a freshly generated plan as the template for key"""
+        with self._lock:
+            self._entries[key] = {'plan': copy.deepcopy(plan), 'created_at': time.time(), 'serves': 0}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        """Return cache metrics"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'templates': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def personalize_plan(plan, library, diet, allergies, substitution_rate=0.3, rng=None):
+    """
+    Turn a cached template into a plan for one user
+
+    Days are shuffled and relabelled, meals containing the user's allergies
+    are always replaced, and other meals are replaced at random with
+    ``substitution_rate`` so repeat users see variety. Allergies that are
+    not a known allergen group or ingredient cannot be checked reliably, so
+    templates are not personalized for them.
+
+    Args:
+        plan: Template plan (will be modified)
+        library: MealLibrary to draw substitutes from
+        diet: Normalized dietary preferences used to pick library meals
+        allergies: List of the user's allergy strings
+        substitution_rate: Chance of swapping a safe meal for a library meal
+        rng: Optional random.Random
+
+    Returns:
+        Personalized plan, or None if an allergy is not recognised or an
+        allergen could not be substituted
+    """
+    if not all(is_known_allergy(allergy) for allergy in allergies):
+        return None
+    rng = rng or random.Random()
+    days = plan['days']
+    rng.shuffle(days)
+    used = {meal['name'].strip().lower() for day in days for meal in day['meals']}
+
+    for number, day in enumerate(days, 1):
+        day['day'] = f"Day {number}"
+        for position, meal in enumerate(day['meals']):
+            unsafe = contains_allergen(meal, allergies)
+            if not unsafe and rng.random() >= substitution_rate:
+                continue
+            substitutes = [m for m in library.meals_for(diet, meal['type'])
+                           if m['name'].strip().lower() not in used and not contains_allergen(m, allergies)]
+            if not substitutes:
+                if unsafe:
+                    return None
+                continue
+            substitute = copy.deepcopy(rng.choice(substitutes))
+            used.add(substitute['name'].strip().lower())
+            day['meals'][position] = substitute
+    return plan
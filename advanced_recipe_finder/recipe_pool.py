@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Recipe Candidate Pool Module
+Keeps unused AI recipe candidates per user and form input so that
+"regenerate" can be answered instantly while the pool refills in the background
+"""
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Form fields that identify a generation request
+FORM_FIELDS = ('ingredients', 'cuisine', 'meal_type', 'difficulty', 'dietary_restrictions')
+
+
+def _normalize(value):
+    return ' '.join(str(value or '').lower().split())
+
+
+def pool_key(user_id, form):
+    """
+    Build the pool key for a user's generator form input
+
+    Ingredient order and letter case do not matter, so "Tomato, Chicken"
+    and "chicken,tomato" share candidates.
+
+    Args:
+        user_id: Current user id
+        form: Mapping with the generator form fields
+
+    Returns:
+        Hashable key
+    """
+    values = []
+    for field in FORM_FIELDS:
+        value = _normalize(form.get(field))
+        if field == 'ingredients':
+            value = ','.join(sorted(item.strip() for item in value.split(',') if item.strip()))
+        values.append(value)
+    return (user_id,) + tuple(values)
+
+
+class CandidatePool:
+    """
+    Thread-safe per-key pool of pre-generated recipe candidates with a TTL
+    """
+
+    def __init__(self, ttl=1800, low_water=1, max_workers=2):
+        """
+        Initialize an empty pool
+
+        Args:
+            ttl: Seconds a candidate stays servable
+            low_water: Refill when a key has this many candidates or fewer
+            max_workers: Background refill threads
+        """
+        self.ttl = ttl
+        self.low_water = low_water
+        self._pools = {}
+        self._refilling = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='recipe-pool')
+        self.served = 0
+        self.misses = 0
+        self.refills = 0
+
+    def _live(self, key, now):
+        """Return the deque for key with expired candidates dropped (lock held)"""
+        candidates = self._pools.get(key)
+        if candidates is None:
+            return None
+        while candidates and now - candidates[0][0] > self.ttl:
+            candidates.popleft()
+        if not candidates:
+            del self._pools[key]
+            return None
+        return candidates
+
+    def take(self, key):
+        """
+        Pop the oldest unexpired candidate for key
+
+        Returns:
+            Tuple of (candidate recipe dict, prompt it was generated from),
+            or None if the pool is empty
+        """
+        with self._lock:
+            candidates = self._live(key, time.time())
+            if not candidates:
+                self.misses += 1
+                return None
+            self.served += 1
+            _, candidate, prompt = candidates.popleft()
+            return candidate, prompt
+
+    def put_many(self, key, candidates, prompt=None):
+        """
+        Add candidates for key
+
+        Args:
+            key: Pool key
+            candidates: Candidate recipe dicts
+            prompt: Prompt the candidates were generated from
+        """
+        if not candidates:
+            return
+        now = time.time()
+        with self._lock:
+            # Drop keys whose candidates all expired so abandoned inputs do not pile up
+            for other in list(self._pools):
+                self._live(other, now)
+            pool = self._pools.setdefault(key, deque())
+            pool.extend((now, candidate, prompt) for candidate in candidates)
+
+    def size(self, key):
+        """Number of servable candidates for key"""
+        with self._lock:
+            candidates = self._live(key, time.time())
+            return len(candidates) if candidates else 0
+
+    def refill_async(self, key, produce, prompt=None):
+        """
+        Top the pool up in the background if it is running low
+
+        Args:
+            key: Pool key
+            produce: Callable returning a list of new candidates
+            prompt: Prompt produce() sends, stored with the candidates
+        """
+        if self.size(key) > self.low_water:
+            return
+        with self._lock:
+            if key in self._refilling:
+                return
+            self._refilling.add(key)
+
+        def refill():
+            try:
+                candidates = produce()
+                self.put_many(key, candidates, prompt)
+                self.refills += 1
+                logger.info(f"Recipe pool refilled with {len(candidates or [])} candidates")
+            except Exception as e:
+                logger.error(f"Recipe pool refill failed: {e}")
+            finally:
+                with self._lock:
+                    self._refilling.discard(key)
+
+        self._executor.submit(refill)
+
+    def stats(self):
+        """Return pool metrics"""
+        with self._lock:
+            now = time.time()
+            for key in list(self._pools):
+                self._live(key, now)
+            return {
+                'keys': len(self._pools),
+                'candidates': sum(len(c) for c in self._pools.values()),
+                'served': self.served,
+                'misses': self.misses,
+                'refills': self.refills,
+                'refilling': len(self._refilling),
+            }
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Local Recipe Retrieval Module
+Answers chatbot recipe questions from the curated recipes table
+before falling back to the Gemini API
+"""
+import json
+import math
+import re
+import threading
+import time
+from collections import Counter, namedtuple
+
+# Words that carry no meaning for matching a recipe
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can', 'do', 'for', 'from',
+    'how', 'i', 'in', 'is', 'it', 'me', 'my', 'of', 'on', 'or', 'some', 'the',
+    'to', 'what', 'with', 'you', 'your',
+}
+
+# Conversational words that only appear in questions ("how do I make ...")
+QUERY_STOPWORDS = STOPWORDS | {
+    'cook', 'cooking', 'dish', 'give', 'help', 'instruction', 'let', 'make',
+    'making', 'method', 'need', 'please', 'prepare', 'recipe', 'show', 'tell',
+    'want', 'way', 'would', 'like', 'know', 'teach', 'steps',
+}
+
+# Title terms count more than ingredient terms when scoring
+TITLE_WEIGHT = 3
+
+RecipeMatch = namedtuple('RecipeMatch', ['recipe', 'score', 'title_coverage'])
+
+
+def _singularize(word):
+    """Crude plural folding so "pancakes" matches "Pancake" and "tomatoes" matches "tomato"."""
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 4 and word.endswith('oes'):
+        return word[:-2]
+    if len(word) > 4 and word.endswith(('ches', 'shes', 'xes', 'sses')):
+        return word[:-2]
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def tokenize(text, stopwords=STOPWORDS):
+    """
+    Split text into normalized search terms
+
+    Args:
+        text: Text to tokenize
+        stopwords: Words to drop
+
+    Returns:
+        List of terms
+    """
+    if not text:
+        return []
+    words = re.findall(r'[a-z]+', str(text).lower())
+    return [_singularize(w) for w in words if len(w) > 1 and w not in stopwords]
+
+
+def as_list(value, separator):
+    """
+    Normalize an ingredients/instructions column to a list of strings
+
+    Recipes store these either as JSON lists (AI generated) or as
+    plain text separated by commas or newlines (admin entered).
+    """
+    if not value:
+        return []
+    if isinstance(value, list):
+        return [str(item).strip() for item in value if str(item).strip()]
+    text = str(value).strip()
+    if text.startswith('['):
+        try:
+            return [str(item).strip() for item in json.loads(text) if str(item).strip()]
+        except (json.JSONDecodeError, TypeError):
+            pass
+    return [item.strip() for item in text.split(separator) if item.strip()]
+
+
+class RecipeIndex:
+    """
+    In-memory TF-IDF index over the recipes table
+
+    The index is rebuilt from the database when it is older than ``ttl``
+    seconds or after ``invalidate()`` is called by a route that changes recipes.
+    """
+
+    def __init__(self, ttl=300, confidence=0.35, min_score=0.15, margin=0.1):
+        """
+        Initialize an empty index
+
+        Args:
+            ttl: Seconds before the index is considered stale
+            confidence: Minimum score for answering directly from a recipe
+            min_score: Minimum score for a recipe to be used as grounding context
+            margin: Required lead over the runner-up for a confident answer
+        """
+        self.ttl = ttl
+        self.confidence = confidence
+        self.min_score = min_score
+        self.margin = margin
+        self._lock = threading.Lock()
+        self._docs = []
+        self._idf = {}
+        self._built_at = 0
+
+    def is_stale(self):
+        """Check whether the index needs to be rebuilt"""
+        return not self._built_at or time.time() - self._built_at > self.ttl
+
+    def invalidate(self):
+        """Force a rebuild on next use"""
+        self._built_at = 0
+
+    def build(self, recipes):
+        """
+        Build the index from recipe rows
+
+        Args:
+            recipes: List of recipe dicts with title, ingredients, instructions and category
+        """
+        term_counts = []
+        document_frequency = Counter()
+        for recipe in recipes:
+            title_terms = tokenize(recipe.get('title'))
+            terms = Counter()
+            for term in title_terms:
+                terms[term] += TITLE_WEIGHT
+            for ingredient in as_list(recipe.get('ingredients'), ','):
+                terms.update(tokenize(ingredient))
+            terms.update(tokenize(recipe.get('category')))
+            document_frequency.update(terms.keys())
+            term_counts.append((recipe, set(title_terms), terms))
+
+        total = len(recipes)
+        idf = {term: math.log((1 + total) / (1 + count)) + 1 for term, count in document_frequency.items()}
+
+        docs = []
+        for recipe, title_terms, terms in term_counts:
+            weights = {term: count * idf[term] for term, count in terms.items()}
+            norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            docs.append((recipe, title_terms, weights, norm))
+
+        with self._lock:
+            self._docs = docs
+            self._idf = idf
+            self._built_at = time.time()
+
+    def search(self, query, limit=3):
+        """
+        Find the recipes that best match a chatbot message
+
+        Args:
+            query: User message
+            limit: Maximum number of matches
+
+        Returns:
+            List of RecipeMatch, best first
+        """
+        query_terms = set(tokenize(query, QUERY_STOPWORDS))
+        if not query_terms:
+            return []
+
+        with self._lock:
+            docs = self._docs
+            idf = self._idf
+
+        query_weights = {term: idf[term] for term in query_terms if term in idf}
+        if not query_weights:
+            return []
+        query_norm = math.sqrt(sum(w * w for w in query_weights.values()))
+
+        matches = []
+        for recipe, title_terms, weights, norm in docs:
+            dot = sum(w * weights[term] for term, w in query_weights.items() if term in weights)
+            if not dot:
+                continue
+            score = dot / (query_norm * norm)
+            coverage = len(query_terms & title_terms) / len(query_terms)
+            matches.append(RecipeMatch(recipe, score, coverage))
+
+        matches.sort(key=lambda m: (m.title_coverage, m.score), reverse=True)
+        return matches[:limit]
+
+    def confident_match(self, matches):
+        """
+        Return the match that can be served without calling Gemini, if any
+
+        A match is confident when every meaningful word of the question is in
+        the recipe title, its score clears the threshold and no other recipe
+        title matches the question equally well.
+        """
+        if not matches:
+            return None
+        best = matches[0]
+        if best.title_coverage < 1.0 or best.score < self.confidence:
+            return None
+        if len(matches) > 1:
+            runner_up = matches[1]
+            if runner_up.title_coverage >= 1.0 and best.score - runner_up.score < self.margin:
+                return None
+        return best
+
+    def grounding_matches(self, matches):
+        """Return the matches relevant enough to be passed to Gemini as context"""
+        return [m for m in matches if m.score >= self.min_score]
+
+
+def format_recipe_answer(recipe):
+    """
+    Format a stored recipe in the chatbot's plain-text style
+
+    Args:
+        recipe: Recipe dict
+
+    Returns:
+        Plain text answer with ingredients and method
+    """
+    title = (recipe.get('title') or 'this dish').strip()
+    ingredients = as_list(recipe.get('ingredients'), ',')
+    steps = as_list(recipe.get('instructions'), '\n')
+
+    lines = [f"To make {title}, you will need these ingredients:"]
+    lines.extend(ingredients)
+    lines.append('')
+    lines.append('Here is the method to make it:')
+    lines.extend(re.sub(r'^(?:step\s*)?\d+[.):]\s*', '', step, flags=re.IGNORECASE) for step in steps)
+    return '\n'.join(lines).replace('*', '').replace('#', '')
+
+
+def format_grounding_context(matches, max_steps=8):
+    """
+    Format matched recipes as reference material for the Gemini prompt
+
+    Args:
+        matches: List of RecipeMatch
+        max_steps: Maximum number of instruction steps per recipe
+
+    Returns:
+        Context string, or an empty string when there are no matches
+    """
+    if not matches:
+        return ''
+    blocks = []
+    for match in matches:
+        recipe = match.recipe
+        ingredients = ', '.join(as_list(recipe.get('ingredients'), ','))
+        steps = ' '.join(as_list(recipe.get('instructions'), '\n')[:max_steps])
+        blocks.append(f"Recipe: {recipe.get('title')}\nIngredients: {ingredients}\nMethod: {steps}")
+    return ('These recipes are from our own collection. Base your answer on them when they fit the question:\n\n'
+            + '\n\n'.join(blocks))
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+Semantic Answer Cache Module
+Serves stored chatbot answers for questions that are phrased differently
+but mean the same thing, using local hashed n-gram embeddings
+"""
+import math
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from recipe_retrieval import QUERY_STOPWORDS, tokenize
+
+# Size of the hashed feature space
+EMBEDDING_DIMENSIONS = 1 << 14
+
+# Character trigrams make near-spellings ("pancakes"/"pan cakes") overlap,
+# but whole words dominate the similarity
+WORD_WEIGHT = 1.0
+TRIGRAM_WEIGHT = 0.3
+
+# Words that point back at earlier turns ("how long do I bake it?")
+FOLLOW_UP_WORDS = {
+    'it', 'its', 'that', 'this', 'these', 'those', 'them', 'they', 'their', 'one', 'ones',
+    'same', 'instead', 'also', 'again', 'another', 'else', 'above', 'previous', 'earlier',
+}
+
+# Openings that continue the previous exchange ("what about with rice?")
+FOLLOW_UP_OPENINGS = ('and', 'but', 'or', 'so', 'then', 'what about', 'how about', 'what if', 'ok', 'okay', 'yes', 'thanks')
+
+# Messages with fewer words than this ("why?", "vegan?") are taken as follow-ups
+MIN_STANDALONE_WORDS = 2
+
+# Words that exclude the term after them ("curry without chicken")
+NEGATION_WORDS = {'without', 'no', 'not', 'except', 'excluding', 'exclude', 'minus', 'skip', 'avoid', 'hold'}
+
+# Words that continue a list of excluded terms ("without garlic, onion or chilli")
+NEGATION_LIST_WORDS = {'and', 'or', 'nor', ','}
+
+# Words that exclude the term before them ("dairy free pancakes")
+NEGATION_SUFFIXES = {'free', 'less'}
+
+
+def _feature_index(feature):
+    """Map a feature string to a stable bucket and sign"""
+    digest = zlib.crc32(feature.encode('utf-8'))
+    sign = 1.0 if digest & 1 else -1.0
+    return (digest >> 1) % EMBEDDING_DIMENSIONS, sign
+
+
+def embed(text):
+    """
+    Vectorize a message as a normalized sparse hashed n-gram embedding
+
+    Args:
+        text: Message text
+
+    Returns:
+        Dict of bucket -> weight with unit length, empty if the message has no content words
+    """
+    vector = {}
+    for word in tokenize(text, QUERY_STOPWORDS):
+        features = [(f'w:{word}', WORD_WEIGHT)]
+        padded = f'#{word}#'
+        features.extend((f't:{padded[i:i + 3]}', TRIGRAM_WEIGHT) for i in range(len(padded) - 2))
+        for feature, weight in features:
+            bucket, sign = _feature_index(feature)
+            vector[bucket] = vector.get(bucket, 0.0) + sign * weight
+
+    norm = math.sqrt(sum(w * w for w in vector.values()))
+    if not norm:
+        return {}
+    return {bucket: w / norm for bucket, w in vector.items()}
+
+
+def is_follow_up(message):
+    """
+    Check whether a message only makes sense after the earlier conversation
+
+    Args:
+        message: Incoming chatbot message
+
+    Returns:
+        True for pronoun references, continuations and very short messages
+    """
+    text = ' '.join(re.findall(r"[a-z']+", (message or '').lower()))
+    if text.startswith(tuple(f'{opening} ' for opening in FOLLOW_UP_OPENINGS)) or text in FOLLOW_UP_OPENINGS:
+        return True
+    words = text.replace("'", ' ').split()
+    if FOLLOW_UP_WORDS.intersection(words):
+        return True
+    return len(words) < MIN_STANDALONE_WORDS or not tokenize(message, QUERY_STOPWORDS)
+
+
+def negated_terms(text):
+    """
+    Collect the terms a message excludes
+
+    "curry without chicken or onions" excludes chicken and onion, and
+    "gluten-free bread" excludes gluten.
+
+    Args:
+        text: Message text
+
+    Returns:
+        Frozenset of normalized terms
+    """
+    negated = set()
+    negating = in_list = False
+    previous = None
+    for word in re.findall(r'[a-z]+|[,.;:?!]', (text or '').lower()):
+        if word in NEGATION_WORDS:
+            negating = True
+        elif word in NEGATION_SUFFIXES:
+            if previous:
+                negated.add(previous)
+        elif word in NEGATION_LIST_WORDS:
+            negating = negating or in_list
+        elif word in '.;:?!':
+            negating = in_list = False
+            previous = None
+        else:
+            terms = tokenize(word, QUERY_STOPWORDS)
+            # Stopwords between the negation and its term ("without the chicken") are skipped
+            if not terms or terms[0] == 'any':
+                continue
+            previous = terms[0]
+            in_list = negating
+            if negating:
+                negated.add(previous)
+                negating = False
+    return frozenset(negated)
+
+
+def cosine(a, b):
+    """Cosine similarity of two normalized sparse vectors"""
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(w * b[bucket] for bucket, w in a.items() if bucket in b)
+
+
+class SemanticCache:
+    """
+    Thread-safe nearest-neighbour answer cache
+
+    Entries expire after ``ttl`` seconds and the least recently used entry
+    is evicted once ``max_entries`` is reached. The cache is shared by all
+    users, so questions asked with conversation context are neither served
+    from it nor stored in it. A stored answer only matches questions that
+    exclude the same terms, so "chicken curry" is not served for "chicken
+    curry without chicken".
+    """
+
+    def __init__(self, threshold=0.85, max_entries=2000, ttl=86400):
+        """
+        Initialize an empty cache
+
+        Args:
+            threshold: Minimum cosine similarity for a hit
+            max_entries: Maximum number of cached questions
+            ttl: Seconds an entry stays valid
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bypassed = 0
+
+    def lookup(self, message, context=''):
+        """
+        Find a stored answer for a semantically equivalent question
+
+        Args:
+            message: Incoming question
+            context: Conversation context the answer would be generated with;
+                questions with context always miss
+
+        Returns:
+            Tuple of (response, similarity), or (None, best_similarity) on a miss
+        """
+        if context:
+            with self._lock:
+                self.bypassed += 1
+            return None, 0.0
+
+        vector = embed(message)
+        if not vector:
+            with self._lock:
+                self.misses += 1
+            return None, 0.0
+
+        negated = negated_terms(message)
+        now = time.time()
+        with self._lock:
+            best_key, best_score = None, 0.0
+            expired = []
+            for key, entry in self._entries.items():
+                if now - entry['timestamp'] > self.ttl:
+                    expired.append(key)
+                    continue
+                if entry['negated'] != negated:
+                    continue
+                score = cosine(vector, entry['vector'])
+                if score > best_score:
+                    best_key, best_score = key, score
+            for key in expired:
+                del self._entries[key]
+                self.evictions += 1
+
+            if best_key is not None and best_score >= self.threshold:
+                self._entries.move_to_end(best_key)
+                self.hits += 1
+                return self._entries[best_key]['response'], best_score
+            self.misses += 1
+            return None, best_score
+
+    def add(self, message, response, timestamp=None, context=''):
+        """
+        Store an answer
+
+        Args:
+            message: Question text
+            response: Answer to serve for similar questions
+            timestamp: Optional creation time (epoch seconds), for warming from history
+            context: Conversation context the answer was generated with;
+                answers that depend on one user's conversation are not stored
+        """
+        if context:
+            return
+        vector = embed(message)
+        if not vector or not response:
+            return
+        negated = negated_terms(message)
+        key = ' '.join(sorted(tokenize(message, QUERY_STOPWORDS)) + [f'-{term}' for term in sorted(negated)])
+        with self._lock:
+            self._entries[key] = {'vector': vector, 'negated': negated, 'response': response,
+                                  'timestamp': timestamp or time.time()}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        """Return hit-rate metrics"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'threshold': self.threshold,
+                'lookups': lookups,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'bypassed': self.bypassed,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -12,6 +12,10 @@ CREATE TABLE IF NOT EXISTS users (
     dietary_preferences TEXT,
     allergies TEXT,
     image_url VARCHAR(255),
+    image_width INT,
+    image_height INT,
+    image_color CHAR(7),
+    image_lqip VARCHAR(1024),
     otp_secret VARCHAR(16),
     is_2fa_enabled BOOLEAN DEFAULT FALSE,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
@@ -27,7 +31,12 @@ CREATE TABLE IF NOT EXISTS recipes (
     difficulty ENUM('Easy', 'Medium', 'Hard'),
     category VARCHAR(100),
     image_url VARCHAR(300),
+    image_width INT,
+    image_height INT,
+    image_color CHAR(7),
+    image_lqip VARCHAR(1024),
     image_prompt TEXT,
+    audio_url VARCHAR(300),
     nutritional_info TEXT,
     created_by INT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -62,24 +71,51 @@ CREATE TABLE IF NOT EXISTS chat_history (
     user_id INT,
     message TEXT NOT NULL,
     response TEXT NOT NULL,
+    cacheable BOOLEAN NOT NULL DEFAULT FALSE,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL
 );
 
+-- Create chat_memory table (running summary of older chatbot turns per user)
+CREATE TABLE IF NOT EXISTS chat_memory (
+    user_id INT PRIMARY KEY,
+    summary TEXT,
+    summarized_through INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
 -- Create generated_recipes table
 CREATE TABLE IF NOT EXISTS generated_recipes (
     id INT AUTO_INCREMENT PRIMARY KEY,
     user_id INT,
     prompt TEXT NOT NULL,
     recipe_data TEXT NOT NULL,
+    saved_recipe_id INT,
+    -- File name of recipe_data's image_url, indexed for image reference counts
+    image_name VARCHAR(255) AS (
+        IF(JSON_VALID(recipe_data),
+           LEFT(SUBSTRING_INDEX(SUBSTRING_INDEX(
+               NULLIF(JSON_UNQUOTE(JSON_EXTRACT(recipe_data, '$.image_url')), 'null'), '?', 1), '/', -1), 255),
+           NULL)
+    ) STORED,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL,
+    FOREIGN KEY (saved_recipe_id) REFERENCES recipes(id) ON DELETE SET NULL
+);
+
+-- Create image_hashes table (perceptual hash of each stored image)
+CREATE TABLE IF NOT EXISTS image_hashes (
+    filename VARCHAR(255) PRIMARY KEY,
+    dhash BIGINT UNSIGNED NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
 -- Create nutrition_analysis table (NEW)
 CREATE TABLE IF NOT EXISTS nutrition_analysis (
     id INT AUTO_INCREMENT PRIMARY KEY,
     user_id INT NOT NULL,
+    name VARCHAR(255),
     ingredients TEXT NOT NULL,
     analysis TEXT NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -177,6 +213,17 @@ CREATE TABLE IF NOT EXISTS recipe_reviews (
     UNIQUE(recipe_id, user_id)
 );
 
+-- Create recipe_views table (latest view of each recipe per user)
+CREATE TABLE IF NOT EXISTS recipe_views (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    user_id INT NOT NULL,
+    recipe_id INT NOT NULL,
+    viewed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (recipe_id) REFERENCES recipes(id) ON DELETE CASCADE,
+    UNIQUE(user_id, recipe_id)
+);
+
 -- OLD TABLES (keep these for backward compatibility)
 -- Create views table (for tracking recipe views)
 CREATE TABLE IF NOT EXISTS views (
@@ -250,6 +297,9 @@ INSERT INTO recipes (title, ingredients, instructions, cooking_time, difficulty,
 CREATE INDEX idx_recipes_category ON recipes(category);
 CREATE INDEX idx_recipes_difficulty ON recipes(difficulty);
 CREATE INDEX idx_recipes_created_at ON recipes(created_at);
+CREATE INDEX idx_recipes_image_url ON recipes(image_url);
+CREATE INDEX idx_users_image_url ON users(image_url);
+CREATE INDEX idx_generated_recipes_image_name ON generated_recipes(image_name);
 CREATE INDEX idx_favorites_user_id ON favorites(user_id);
 CREATE INDEX idx_favorites_recipe_id ON favorites(recipe_id);
 CREATE INDEX idx_ratings_recipe_id ON ratings(recipe_id);
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""
+Blob Storage Module
+One interface for storing uploads, generated images and audio, with a
+local-filesystem backend and an S3-API backend (AWS S3, MinIO and other
+compatible stores) so several app nodes can share the same files
+"""
+import mimetypes
+import os
+import shutil
+import tempfile
+from abc import ABC, abstractmethod
+
+from werkzeug.security import safe_join
+
+try:
+    import boto3
+    from botocore.config import Config as BotoConfig
+    from botocore.exceptions import ClientError
+    BOTO3_AVAILABLE = True
+except ImportError:
+    BOTO3_AVAILABLE = False
+
+# Bytes read per chunk when streaming
+CHUNK_SIZE = 64 * 1024
+
+# Stored names never get new content, so object stores may cache them forever
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def guess_content_type(key):
+    """MIME type for a storage key, from its extension"""
+    return mimetypes.guess_type(key)[0] or 'application/octet-stream'
+
+
+class StorageBackend(ABC):
+    """
+    Interface of a blob store addressed by '/'-separated keys
+
+    Missing keys raise FileNotFoundError from get() and stream(). Backends
+    must implement every abstract method; exists(), presigned_url() and
+    local_path() have defaults.
+    """
+
+    # Directory temp files should be spooled to before put_file(), or None for the system default
+    spool_dir = None
+
+    @abstractmethod
+    def put(self, key, data, content_type=None):
+        """Store bytes under key, replacing any existing blob"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def put_file(self, key, source_path, content_type=None, move=False):
+        """Store a local file under key, removing the source if move is set"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get(self, key):
+        """Return the bytes stored under key"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def stream(self, key, chunk_size=CHUNK_SIZE):
+        """Iterate the bytes stored under key in chunks"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, key):
+        """Delete key, returning True if it existed"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def stat(self, key):
+        """Return (size, mtime) of key, or None if it does not exist"""
+        raise NotImplementedError
+
+    def exists(self, key):
+        """Check whether key is stored"""
+        return self.stat(key) is not None
+
+    @abstractmethod
+    def touch(self, key):
+        """Refresh key's modification time"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def move(self, key, new_key):
+        """Rename a blob"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def list(self, prefix=''):
+        """Yield (key, size, mtime) for every blob under prefix"""
+        raise NotImplementedError
+
+    def presigned_url(self, key, expires=3600):
+        """URL clients can fetch key from directly, or None if the app must serve it"""
+        return None
+
+    def local_path(self, key):
+        """Filesystem path of key for backends on local disk, otherwise None"""
+        return None
+
+
+class LocalStorage(StorageBackend):
+    """Blobs as files under a root directory; writes are atomic renames"""
+
+    def __init__(self, root):
+        self.root = root
+        self.spool_dir = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        path = safe_join(self.root, key)
+        if path is None:
+            raise ValueError(f'Invalid storage key: {key}')
+        return path
+
+    def put(self, key, data, content_type=None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.root, prefix='.tmp_')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def put_file(self, key, source_path, content_type=None, move=False):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.root, prefix='.tmp_')
+        os.close(fd)
+        try:
+            if move:
+                shutil.move(source_path, temp_path)
+            else:
+                shutil.copyfile(source_path, temp_path)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def get(self, key):
+        with open(self._path(key), 'rb') as f:
+            return f.read()
+
+    def stream(self, key, chunk_size=CHUNK_SIZE):
+        f = open(self._path(key), 'rb')
+
+        def chunks():
+            with f:
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    yield chunk
+
+        return chunks()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def stat(self, key):
+        try:
+            path = self._path(key)
+            if not os.path.isfile(path):
+                return None
+            stat = os.stat(path)
+        except (OSError, ValueError):
+            return None
+        return stat.st_size, stat.st_mtime
+
+    def touch(self, key):
+        os.utime(self._path(key))
+
+    def move(self, key, new_key):
+        target = self._path(new_key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(self._path(key), target)
+
+    def list(self, prefix=''):
+        start = os.path.join(self.root, prefix) if prefix else self.root
+        for directory, subdirectories, files in os.walk(start):
+            # Dot-directories and dotfiles hold in-progress writes and bookkeeping
+            subdirectories[:] = [d for d in subdirectories if not d.startswith('.')]
+            for name in files:
+                if name.startswith('.'):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield os.path.relpath(path, self.root).replace(os.sep, '/'), stat.st_size, stat.st_mtime
+
+    def local_path(self, key):
+        return self._path(key)
+
+
+class S3Storage(StorageBackend):
+    """
+    Blobs as objects in an S3-API bucket
+
+    Works against AWS S3 and S3-compatible servers such as MinIO via
+    endpoint_url. Clients are sent presigned GET URLs (or public_url links
+    for a public bucket/CDN) so image bytes never pass through the app.
+    """
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None, access_key=None, secret_key=None,
+                 public_url=None, max_connections=20):
+        """
+        Initialize the client
+
+        Args:
+            bucket: Bucket name
+            prefix: Optional key prefix inside the bucket, e.g. "uploads/"
+            endpoint_url: S3 endpoint for compatible servers, e.g. "http://localhost:9000"
+            region: Bucket region
+            access_key: Access key id (default: boto3 credential chain)
+            secret_key: Secret access key
+            public_url: Base URL objects are publicly readable under; presigned URLs are used if unset
+            max_connections: Keep-alive connection pool size
+        """
+        if not BOTO3_AVAILABLE:
+            raise RuntimeError('S3 storage requires boto3. Please install: pip install boto3')
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix and prefix.strip('/') else ''
+        self.public_url = public_url.rstrip('/') if public_url else None
+        self.client = boto3.client(
+            's3', endpoint_url=endpoint_url, region_name=region,
+            aws_access_key_id=access_key, aws_secret_access_key=secret_key,
+            config=BotoConfig(max_pool_connections=max_connections, retries={'max_attempts': 3, 'mode': 'standard'},
+                              s3={'addressing_style': 'path'} if endpoint_url else None)
+        )
+
+    def _key(self, key):
+        return self.prefix + key
+
+    @staticmethod
+    def _missing(error):
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    def _extra_args(self, key, content_type):
+        return {'ContentType': content_type or guess_content_type(key), 'CacheControl': IMMUTABLE_CACHE_CONTROL}
+
+    def put(self, key, data, content_type=None):
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data, **self._extra_args(key, content_type))
+
+    def put_file(self, key, source_path, content_type=None, move=False):
+        # upload_file switches to parallel multipart uploads for large files
+        self.client.upload_file(source_path, self.bucket, self._key(key), ExtraArgs=self._extra_args(key, content_type))
+        if move:
+            os.remove(source_path)
+
+    def _get_object(self, key):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if self._missing(e):
+                raise FileNotFoundError(key) from e
+            raise
+
+    def get(self, key):
+        body = self._get_object(key)['Body']
+        try:
+            return body.read()
+        finally:
+            body.close()
+
+    def stream(self, key, chunk_size=CHUNK_SIZE):
+        body = self._get_object(key)['Body']
+
+        def chunks():
+            try:
+                yield from body.iter_chunks(chunk_size)
+            finally:
+                body.close()
+
+        return chunks()
+
+    def delete(self, key):
+        if not self.exists(key):
+            return False
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+        return True
+
+    def stat(self, key):
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if self._missing(e):
+                return None
+            raise
+        return head['ContentLength'], head['LastModified'].timestamp()
+
+    def touch(self, key):
+        # Copying an object onto itself (with replaced metadata) resets LastModified
+        self.client.copy_object(Bucket=self.bucket, Key=self._key(key),
+                                CopySource={'Bucket': self.bucket, 'Key': self._key(key)},
+                                MetadataDirective='REPLACE', **self._extra_args(key, None))
+
+    def move(self, key, new_key):
+        self.client.copy_object(Bucket=self.bucket, Key=self._key(new_key),
+                                CopySource={'Bucket': self.bucket, 'Key': self._key(key)})
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def list(self, prefix=''):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self._key(prefix)):
+            for item in page.get('Contents', ()):
+                key = item['Key'][len(self.prefix):]
+                if any(part.startswith('.') for part in key.split('/')):
+                    continue
+                yield key, item['Size'], item['LastModified'].timestamp()
+
+    def presigned_url(self, key, expires=3600):
+        if self.public_url:
+            return f"{self.public_url}/{self._key(key)}"
+        return self.client.generate_presigned_url('get_object', Params={'Bucket': self.bucket, 'Key': self._key(key)},
+                                                  ExpiresIn=expires)
+
+
+def create_storage(config, local_root):
+    """
+    Build the storage backend selected by app config
+
+    Args:
+        config: Mapping with STORAGE_BACKEND ('local' or 's3') and the S3_* settings
+        local_root: Directory used by the local backend
+
+    Returns:
+        StorageBackend
+    """
+    if (config.get('STORAGE_BACKEND') or 'local') == 's3':
+        return S3Storage(
+            bucket=config['S3_BUCKET'],
+            prefix=config.get('S3_PREFIX') or '',
+            endpoint_url=config.get('S3_ENDPOINT_URL'),
+            region=config.get('S3_REGION'),
+            access_key=config.get('S3_ACCESS_KEY'),
+            secret_key=config.get('S3_SECRET_KEY'),
+            public_url=config.get('S3_PUBLIC_URL')
+        )
+    return LocalStorage(local_root)
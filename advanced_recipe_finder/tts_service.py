@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Text-to-Speech Module
+Synthesizes recipe narration with one long-lived Google Cloud TTS client,
+splitting long texts into chunks that are synthesized in parallel, and
+keeps each result in blob storage under a hash of (text, voice, encoding)
+so replaying a recipe never calls the API again
+"""
+import hashlib
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+try:
+    from google.cloud import texttospeech
+    TTS_AVAILABLE = True
+except ImportError:
+    TTS_AVAILABLE = False
+
+# Google TTS rejects inputs over 5000 bytes; leave headroom
+MAX_CHUNK_BYTES = 4500
+
+# Sentence ends that are safe places to split narration
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+
+def tts_cache_key(text, voice, encoding, ssml_gender=''):
+    """
+    Cache key of a synthesis
+
+    Args:
+        text: Text to speak
+        voice: Voice name, e.g. "en-US-Neural2-F"
+        encoding: Audio encoding name, e.g. "MP3"
+        ssml_gender: Voice gender name, e.g. "FEMALE"
+
+    Returns:
+        Hex SHA-256 key
+    """
+    return hashlib.sha256(f"{voice}\0{ssml_gender or ''}\0{encoding}\0{text}".encode('utf-8')).hexdigest()
+
+
+def split_text(text, max_bytes=MAX_CHUNK_BYTES):
+    """
+    Split text into chunks of at most max_bytes UTF-8 bytes at sentence ends
+
+    A single sentence longer than max_bytes is split at word boundaries.
+
+    Returns:
+        List of non-empty chunks, in order
+    """
+    chunks = []
+    current = ''
+    for sentence in SENTENCE_END.split(text.strip()):
+        pieces = [sentence]
+        if len(sentence.encode('utf-8')) > max_bytes:
+            pieces, piece = [], ''
+            for word in sentence.split():
+                if piece and len(f"{piece} {word}".encode('utf-8')) > max_bytes:
+                    pieces.append(piece)
+                    piece = word
+                else:
+                    piece = f"{piece} {word}" if piece else word
+            if piece:
+                pieces.append(piece)
+        for piece in pieces:
+            candidate = f"{current} {piece}" if current else piece
+            if current and len(candidate.encode('utf-8')) > max_bytes:
+                chunks.append(current)
+                current = piece
+            else:
+                current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class TTSService:
+    """
+    Cached, chunked speech synthesis into blob storage
+
+    Identical requests running at the same time share one synthesis.
+    """
+
+    def __init__(self, storage, voice='en-US-Neural2-F', language_code='en-US', ssml_gender='FEMALE', encoding='MP3',
+                 workers=4, max_chunk_bytes=MAX_CHUNK_BYTES, layout=None):
+        """
+        Initialize the service (the API client is created on first use)
+
+        Args:
+            storage: storage.StorageBackend the audio is written to
+            voice: Voice name
+            language_code: Voice language
+            ssml_gender: texttospeech.SsmlVoiceGender member name, or None to leave it to the voice
+            encoding: texttospeech.AudioEncoding member name; chunks are concatenated, so use MP3
+            workers: Chunks synthesized in parallel
+            max_chunk_bytes: Maximum UTF-8 bytes per API request
+            layout: Optional callable mapping a filename to its storage key
+        """
+        self.storage = storage
+        self.voice = voice
+        self.language_code = language_code
+        self.ssml_gender = ssml_gender
+        self.encoding = encoding
+        self.max_chunk_bytes = max_chunk_bytes
+        self.layout = layout or (lambda filename: filename)
+        self._client = None
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tts')
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.chunks = 0
+        self.characters = 0
+
+    def is_available(self):
+        """Check whether the Google Cloud TTS library is installed"""
+        return TTS_AVAILABLE
+
+    def _get_client(self):
+        with self._lock:
+            if self._client is None:
+                if not TTS_AVAILABLE:
+                    raise RuntimeError('google-cloud-texttospeech is not installed')
+                # The client keeps one gRPC channel and is safe to share between threads
+                self._client = texttospeech.TextToSpeechClient()
+            return self._client
+
+    def filename(self, text):
+        """Storage key the audio for text is cached under"""
+        key = tts_cache_key(text, self.voice, self.encoding, self.ssml_gender)
+        return self.layout(f"tts_{key}.{self.encoding.lower()}")
+
+    def synthesize(self, text):
+        """
+        Return stored audio for text, synthesizing it on a cache miss
+
+        Args:
+            text: Text to speak
+
+        Returns:
+            Tuple of (storage key, cached)
+        """
+        filename = self.filename(text)
+        if self.storage.exists(filename):
+            try:
+                # Reuse restarts the upload garbage collector's grace period
+                self.storage.touch(filename)
+                with self._lock:
+                    self.hits += 1
+                return filename, True
+            except FileNotFoundError:
+                pass
+
+        with self._lock:
+            future = self._inflight.get(filename)
+            owner = future is None
+            if owner:
+                future = self._inflight[filename] = Future()
+                self.misses += 1
+        if not owner:
+            return future.result(), True
+
+        try:
+            self.storage.put(filename, self._synthesize_chunks(text), 'audio/mpeg')
+            future.set_result(filename)
+            return filename, False
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(filename, None)
+
+    def _synthesize_chunks(self, text):
+        """Synthesize text chunk by chunk in parallel and concatenate the audio"""
+        chunks = split_text(text, self.max_chunk_bytes)
+        client = self._get_client()
+        voice_options = {'language_code': self.language_code, 'name': self.voice}
+        if self.ssml_gender:
+            voice_options['ssml_gender'] = getattr(texttospeech.SsmlVoiceGender, self.ssml_gender)
+        voice = texttospeech.VoiceSelectionParams(**voice_options)
+        audio_config = texttospeech.AudioConfig(audio_encoding=getattr(texttospeech.AudioEncoding, self.encoding))
+
+        def synthesize_chunk(chunk):
+            response = client.synthesize_speech(input=texttospeech.SynthesisInput(text=chunk),
+                                                voice=voice, audio_config=audio_config)
+            return response.audio_content
+
+        # MP3 streams are sequences of self-contained frames, so parts concatenate cleanly
+        audio = b''.join(self._executor.map(synthesize_chunk, chunks))
+        with self._lock:
+            self.chunks += len(chunks)
+            self.characters += len(text)
+        return audio
+
+    def stats(self):
+        """Return cache and synthesis metrics"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'chunks_synthesized': self.chunks,
+                'characters_synthesized': self.characters,
+            }
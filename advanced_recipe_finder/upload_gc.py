@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Upload Garbage Collector Module
+Finds files in upload storage that no database row references any more
+(replaced or deleted recipe images, purged generations, unsaved audio)
+and deletes or quarantines them in batches
+"""
+import os
+import time
+
+from image_pipeline import parse_derivative_name
+from upload_layout import TEMP_DIR
+
+# Unreferenced files are moved here (relative to the upload folder) instead of deleted
+QUARANTINE_DIR = '.quarantine'
+
+
+def referenced_name(value):
+    """
+    Normalize a stored image or audio reference to the file's base name
+
+    Base names are unique (content hashes or uuids), so comparing them
+    matches references written before and after the sharded layout.
+
+    Args:
+        value: Column value, e.g. "ab/cd/<hash>.png", "/uploads/<name>" or an http URL
+
+    Returns:
+        Base name, or None for remote URLs and empty values
+    """
+    if not value or not isinstance(value, str) or value.startswith(('http://', 'https://')):
+        return None
+    return os.path.basename(value.split('?', 1)[0]) or None
+
+
+def iter_upload_files(storage):
+    """
+    Yield (key, size, mtime) of collectable files in upload storage
+
+    Dotfiles (in-progress writes, checkpoints), the quarantine and the temp
+    directory (cleaned by cleanup_temp_files) are skipped.
+    """
+    for key, size, modified in storage.list():
+        if key.startswith((f'{TEMP_DIR}/', f'{QUARANTINE_DIR}/')):
+            continue
+        yield key, size, modified
+
+
+def _is_live(name, referenced):
+    """Check whether a file or, for derivatives, its source image is referenced"""
+    derivative = parse_derivative_name(name)
+    return (derivative[0] if derivative else name) in referenced
+
+
+def _collect_batch(storage, batch, grace, quarantine, report):
+    """Delete or quarantine a batch of orphans, re-checking each one's age first"""
+    cutoff = time.time() - grace
+    for key in batch:
+        try:
+            stat = storage.stat(key)
+            if not stat:
+                continue
+            # A dedup hit since the scan refreshes the mtime and rescues the file
+            if stat[1] >= cutoff:
+                report['skipped_recent'] += 1
+                continue
+            if quarantine:
+                storage.move(key, f'{QUARANTINE_DIR}/{key}')
+                report['quarantined'] += 1
+            else:
+                storage.delete(key)
+                report['deleted'] += 1
+            report['bytes_collected'] += stat[0]
+        except FileNotFoundError:
+            continue
+        except Exception as e:
+            report['errors'].append(f'{key}: {e}')
+
+
+def collect_garbage(storage, referenced, grace=86400, quarantine=True, dry_run=True, batch_size=500, log=None):
+    """
+    Remove upload files that nothing references
+
+    Args:
+        storage: storage.StorageBackend holding uploads
+        referenced: Set of referenced base names (see referenced_name)
+        grace: Seconds since a file was written or reused before it may be collected
+        quarantine: Move orphans to QUARANTINE_DIR instead of deleting them
+        dry_run: Only report what would be collected
+        batch_size: Orphans handled per batch
+        log: Optional callable receiving progress lines
+
+    Returns:
+        Report dict with scanned/live/recent/orphaned counts, orphaned_bytes,
+        deleted/quarantined counts, bytes_collected, errors and, for dry runs,
+        a sample of orphan paths
+    """
+    log = log or (lambda message: None)
+    report = {
+        'scanned': 0, 'live': 0, 'recent': 0, 'orphaned': 0, 'orphaned_bytes': 0,
+        'deleted': 0, 'quarantined': 0, 'skipped_recent': 0, 'bytes_collected': 0,
+        'errors': [], 'sample': [], 'dry_run': dry_run
+    }
+    cutoff = time.time() - grace
+    batch = []
+
+    for key, size, modified in iter_upload_files(storage):
+        report['scanned'] += 1
+        if _is_live(os.path.basename(key), referenced):
+            report['live'] += 1
+            continue
+        if modified >= cutoff:
+            report['recent'] += 1
+            continue
+
+        report['orphaned'] += 1
+        report['orphaned_bytes'] += size
+        if dry_run:
+            if len(report['sample']) < 20:
+                report['sample'].append(key)
+            continue
+        batch.append(key)
+        if len(batch) >= batch_size:
+            _collect_batch(storage, batch, grace, quarantine, report)
+            log(f"Collected {report['deleted'] + report['quarantined']} of {report['orphaned']} orphans so far")
+            batch = []
+
+    if batch:
+        _collect_batch(storage, batch, grace, quarantine, report)
+    return report
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Upload Layout Module
+Spreads uploads over a two-level hashed directory tree (ab/cd/<name>) so
+no single directory grows to tens of thousands of entries, and resolves
+names written before or during the move to the sharded layout
+"""
+import hashlib
+import os
+
+from werkzeug.security import safe_join
+
+from content_store import file_digest, is_content_filename
+from image_pipeline import parse_derivative_name
+
+# Unsaved AI generator images live in their own small directory
+TEMP_DIR = 'tmp'
+TEMP_PREFIX = 'temp_'
+
+
+def _shard_key(name):
+    """Hex key whose first four characters pick the shard directories"""
+    if is_content_filename(name):
+        return name[:4]
+    return hashlib.sha256(name.encode('utf-8')).hexdigest()[:4]
+
+
+def shard_name(name):
+    """
+    Relative path of an upload in the sharded layout
+
+    Derivatives are placed next to their source image, and temp_ images
+    go to TEMP_DIR.
+
+    Args:
+        name: Upload filename, flat or already sharded
+
+    Returns:
+        Relative path, e.g. "ab/cd/abcd1234....png"
+    """
+    base = os.path.basename(name)
+    if base.startswith(TEMP_PREFIX):
+        return f"{TEMP_DIR}/{base}"
+    derivative = parse_derivative_name(base)
+    key = _shard_key(derivative[0] if derivative else base)
+    return f"{key[:2]}/{key[2:4]}/{base}"
+
+
+def is_sharded(name):
+    """Check whether name is already at its sharded location"""
+    return name == shard_name(name)
+
+
+def candidates(name):
+    """
+    Locations an upload may be at while the layout is being migrated
+
+    Returns:
+        Relative paths, most likely first
+    """
+    base = os.path.basename(name)
+    paths = [name, shard_name(base), base]
+    return [path for i, path in enumerate(paths) if path not in paths[:i]]
+
+
+def reference_forms(name):
+    """
+    Every way a database row may reference an upload
+
+    Rows written before, during and after the move to the sharded layout
+    store the flat or the sharded path, with or without the /uploads/ prefix.
+
+    Args:
+        name: Upload filename, URL path or storage key
+
+    Returns:
+        List of distinct reference strings
+    """
+    base = os.path.basename(name.split('?', 1)[0])
+    paths = [base, shard_name(base)]
+    forms = paths + [f"/uploads/{path}" for path in paths]
+    return [form for i, form in enumerate(forms) if form not in forms[:i]]
+
+
+def resolve(storage, name):
+    """
+    Find a stored upload
+
+    Args:
+        storage: storage.StorageBackend holding uploads
+        name: Filename as stored in the database or requested in a URL
+
+    Returns:
+        Storage key of the existing file, or None
+    """
+    for path in candidates(name):
+        if safe_join('/', path) and storage.exists(path):
+            return path
+    return None
+
+
+def ensure_parent(root, name):
+    """Create the shard directories for name and return its absolute path"""
+    path = os.path.join(root, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def flat_uploads(root):
+    """Yield the names of files still at the top level of the upload folder"""
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_file() and not entry.name.startswith('.'):
+                yield entry.name
+
+
+def move_to_shard(root, name):
+    """
+    Move a flat upload to its sharded location
+
+    The move is a rename, so readers see the file at one location or the
+    other and resolve() finds it either way.
+
+    Args:
+        root: Upload folder
+        name: Flat filename
+
+    Returns:
+        New relative path, or None if a different file already occupies it
+    """
+    target = shard_name(name)
+    source_path = os.path.join(root, name)
+    target_path = ensure_parent(root, target)
+    if os.path.exists(target_path):
+        if file_digest(target_path) != file_digest(source_path):
+            return None
+        os.remove(source_path)
+        return target
+    os.replace(source_path, target_path)
+    return target
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the blocking MySQL connection pool
+Run with: python -m pytest test_connection_pool.py
+"""
+import sys
+import os
+import threading
+import time
+
+import pytest
+
+# Add the advanced_recipe_finder directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'advanced_recipe_finder'))
+
+from connection_pool import BlockingConnectionPool, PoolTimeoutError
+
+
+class FakeConnection:
+    """Stand-in for a mysql.connector connection"""
+
+    def __init__(self, number):
+        self.number = number
+        self.in_transaction = False
+        self.closed = False
+        self.ping_error = None
+        self.resets = 0
+
+    def ping(self):
+        if self.ping_error:
+            raise self.ping_error
+
+    def reset_session(self):
+        self.resets += 1
+
+    def rollback(self):
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnect:
+    """connect() callable numbering the connections it opens"""
+
+    def __init__(self):
+        self.opened = []
+        self.fail_next = None
+
+    def __call__(self):
+        if self.fail_next:
+            error, self.fail_next = self.fail_next, None
+            raise error
+        connection = FakeConnection(len(self.opened) + 1)
+        self.opened.append(connection)
+        return connection
+
+
+def _wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'condition not reached in time'
+        time.sleep(0.005)
+
+
+def test_waiters_are_served_in_arrival_order():
+    """A returned connection goes to the longest-waiting caller"""
+    pool = BlockingConnectionPool(FakeConnect(), size=1, max_overflow=0, timeout=2)
+    held = pool.checkout()
+    served = []
+    got_first = threading.Event()
+    release_first = threading.Event()
+
+    def first():
+        connection = pool.checkout()
+        served.append('first')
+        got_first.set()
+        release_first.wait(2)
+        connection.close()
+
+    def second():
+        connection = pool.checkout()
+        served.append('second')
+        connection.close()
+
+    threads = [threading.Thread(target=first)]
+    threads[0].start()
+    _wait_for(lambda: pool.stats()['waiting'] == 1)
+    threads.append(threading.Thread(target=second))
+    threads[1].start()
+    _wait_for(lambda: pool.stats()['waiting'] == 2)
+
+    held.close()
+    assert got_first.wait(2)
+    # The second caller keeps waiting while the first holds the only connection
+    assert served == ['first'] and pool.stats()['waiting'] == 1
+    release_first.set()
+    for thread in threads:
+        thread.join(2)
+    assert served == ['first', 'second']
+    assert pool.stats()['in_use'] == 0
+
+
+def test_checkout_times_out_when_pool_is_exhausted():
+    """Callers get PoolTimeoutError instead of waiting forever, and leave the queue"""
+    pool = BlockingConnectionPool(FakeConnect(), size=1, max_overflow=0)
+    held = pool.checkout()
+    with pytest.raises(PoolTimeoutError):
+        pool.checkout(timeout=0.05)
+    stats = pool.stats()
+    assert stats['timeouts'] == 1 and stats['waiting'] == 0 and stats['in_use'] == 1
+    held.close()
+    pool.checkout(timeout=0.05).close()
+
+
+def test_overflow_connections_are_closed_on_return():
+    """Connections beyond size are discarded once nobody is waiting for them"""
+    connect = FakeConnect()
+    pool = BlockingConnectionPool(connect, size=1, max_overflow=1)
+    first, second = pool.checkout(), pool.checkout()
+    first.close()
+    second.close()
+    assert [c.closed for c in connect.opened] == [True, False]
+    stats = pool.stats()
+    assert stats['open'] == 1 and stats['idle'] == 1 and stats['discarded'] == 1
+    # A second close() of the same proxy is a no-op
+    second.close()
+    assert pool.stats()['idle'] == 1
+
+
+def test_dead_idle_connection_is_replaced():
+    """A connection that fails its ping is closed and a new one handed out"""
+    connect = FakeConnect()
+    pool = BlockingConnectionPool(connect, size=1, max_overflow=0, ping_interval=0)
+    pool.checkout().close()
+    connect.opened[0].ping_error = OSError('server has gone away')
+
+    connection = pool.checkout()
+    assert connection.number == 2
+    assert connect.opened[0].closed
+    stats = pool.stats()
+    assert stats['failed_pings'] == 1 and stats['created'] == 2 and stats['open'] == 1
+
+
+def test_failed_connect_frees_its_slot():
+    """When connect() raises, the slot it reserved is given back"""
+    connect = FakeConnect()
+    connect.fail_next = OSError("Can't connect to MySQL server")
+    pool = BlockingConnectionPool(connect, size=1, max_overflow=0)
+    with pytest.raises(OSError):
+        pool.checkout(timeout=0.05)
+    stats = pool.stats()
+    assert stats['open'] == 0 and stats['in_use'] == 0
+    # The single slot is usable again rather than leaked
+    pool.checkout(timeout=0.05).close()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for request-scoped database connections
+Run with: python -m pytest test_db_session.py
+"""
+import sys
+import os
+from types import SimpleNamespace
+
+import pytest
+
+# Add the advanced_recipe_finder directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'advanced_recipe_finder'))
+
+from db_session import ConnectionManager, ConnectionReleasedError
+
+
+class FakeConnection:
+    """Stand-in for a pooled connection"""
+
+    def __init__(self):
+        self.in_transaction = False
+        self.closed = False
+        self.rollbacks = 0
+
+    def cursor(self, *args, **kwargs):
+        return kwargs
+
+    def commit(self):
+        self.in_transaction = False
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = True
+
+
+class ListLogger:
+    def __init__(self):
+        self.warnings = []
+
+    def warning(self, message):
+        self.warnings.append(message)
+
+
+def _manager():
+    acquired = []
+
+    def acquire():
+        acquired.append(FakeConnection())
+        return acquired[-1]
+
+    logger = ListLogger()
+    return ConnectionManager(acquire, logger=logger), acquired, logger
+
+
+def test_connection_is_shared_and_returned_after_last_close():
+    """Callers in one request share a connection that goes back after the last close()"""
+    manager, acquired, _ = _manager()
+    scope = SimpleNamespace()
+    outer = manager.acquire(scope)
+    inner = manager.acquire(scope)
+    assert inner is outer and len(acquired) == 1
+    assert inner.cursor() == {'buffered': True}
+
+    inner.close()
+    assert not acquired[0].closed
+    outer.close()
+    assert acquired[0].closed
+    assert manager.current(scope) is None
+    stats = manager.stats()
+    assert stats['checkouts'] == 1 and stats['reused'] == 1 and stats['in_use'] == 0
+
+
+def test_teardown_force_returns_leaked_connection():
+    """teardown() returns a connection someone forgot to close and reports where it was opened"""
+    manager, acquired, logger = _manager()
+    scope = SimpleNamespace()
+    connection = manager.acquire(scope)
+    manager.acquire(scope)
+    connection.close()
+    acquired[0].in_transaction = True
+
+    manager.teardown(scope, label='recipes')
+    assert acquired[0].closed and acquired[0].rollbacks == 1
+    assert manager.stats()['leaks'] == 1
+    assert 'recipes' in logger.warnings[0] and 'test_db_session.py' in logger.warnings[0]
+
+
+def test_teardown_rolls_back_on_error():
+    """The open work of a failed request is rolled back before its connection is returned"""
+    manager, acquired, logger = _manager()
+    scope = SimpleNamespace()
+    manager.acquire(scope)
+    manager.teardown(scope, error=RuntimeError('boom'))
+    assert acquired[0].closed and acquired[0].rollbacks == 1
+    assert manager.stats()['leaks'] == 1
+
+
+def test_use_after_release_raises():
+    """A connection closed one time too many cannot be used once it is back in the pool"""
+    manager, acquired, _ = _manager()
+    scope = SimpleNamespace()
+    first = manager.acquire(scope)
+    second = manager.acquire(scope)
+    first.close()
+    first.close()
+    with pytest.raises(ConnectionReleasedError):
+        second.cursor()
+    with pytest.raises(ConnectionReleasedError):
+        second.commit()
+    # Closing again stays harmless, and the next checkout gets a fresh connection
+    second.close()
+    assert manager.acquire(scope) is not second and len(acquired) == 2
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the image derivative backfill
+Run with: python -m pytest test_image_backfill.py
+"""
+import sys
+import os
+
+# Add the advanced_recipe_finder directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'advanced_recipe_finder'))
+
+from image_backfill import find_sources
+
+
+def _touch(folder, relative):
+    path = os.path.join(folder, *relative.split('/'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'')
+
+
+def test_find_sources_skips_quarantine_and_temp_dirs(tmp_path):
+    """Quarantined, temporary and hidden files get no derivatives"""
+    folder = str(tmp_path)
+    _touch(folder, 'ab/cd/live.png')
+    _touch(folder, 'flat.jpg')
+    _touch(folder, '.quarantine/ab/cd/orphan.png')
+    _touch(folder, '.cache/old.png')
+    _touch(folder, 'tmp/temp_generated.png')
+
+    sources, missing = find_sources(folder, ['/uploads/ab/cd/live.png', 'ab/cd/gone.png'])
+    assert sources == ['ab/cd/live.png', 'flat.jpg']
+    assert missing == ['ab/cd/gone.png']
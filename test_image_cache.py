@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the generated image cache
+Run with: python -m pytest test_image_cache.py
+"""
+import sys
+import os
+
+# Add the advanced_recipe_finder directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'advanced_recipe_finder'))
+
+from image_cache import GeneratedImageCache
+
+
+def test_shared_file_is_released_only_after_last_key():
+    """Two prompts sharing one file keep it until both have been evicted"""
+    released = []
+    cache = GeneratedImageCache(max_entries=2, on_evict=released.append)
+    cache.put('pancakes', 'ab/cd/shared.png', 100)
+    cache.put('pancake stack', 'ab/cd/shared.png', 100)
+
+    # Evicting the first key must not release the file the second still serves
+    cache.put('waffles', 'ef/01/waffles.png', 100)
+    assert released == []
+    assert cache.get('pancake stack') == 'ab/cd/shared.png'
+
+    # Evicting the last key pointing at it does
+    cache.put('crepes', '23/45/crepes.png', 100)
+    cache.put('toast', '67/89/toast.png', 100)
+    assert released == ['ef/01/waffles.png', 'ab/cd/shared.png']
+
+
+def test_shared_file_counts_once_towards_size():
+    cache = GeneratedImageCache(max_bytes=150)
+    cache.put('a', 'shared.png', 100)
+    cache.put('b', 'shared.png', 100)
+    assert cache.stats()['bytes'] == 100
+    assert cache.stats()['files'] == 1
+    assert cache.get('a') == cache.get('b') == 'shared.png'
+
+
+def test_repointing_a_key_releases_its_old_file():
+    released = []
+    cache = GeneratedImageCache(on_evict=released.append)
+    cache.put('a', 'old.png', 10)
+    cache.put('a', 'old.png', 10)
+    assert released == []
+    cache.put('a', 'new.png', 10)
+    assert released == ['old.png']
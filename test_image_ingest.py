@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for upload ingestion
+Run with: python -m pytest test_image_ingest.py
+"""
+import sys
+import os
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+# Add the advanced_recipe_finder directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'advanced_recipe_finder'))
+
+from image_ingest import IngestError, ingest_image
+
+
+def test_metadata_describes_the_stored_image():
+    """Width, height, colour and placeholder are computed at ingest from the resized image"""
+    buffer = BytesIO()
+    Image.new('RGB', (3000, 1500), (200, 40, 40)).save(buffer, 'JPEG')
+
+    data, ext, metadata = ingest_image(buffer.getvalue(), max_edge=1000)
+    assert ext == 'jpg'
+    assert Image.open(BytesIO(data)).size == (1000, 500)
+    assert (metadata['width'], metadata['height']) == (1000, 500)
+    assert metadata['color'].startswith('#') and metadata['lqip'].startswith('data:image/webp;base64,')
+
+
+def test_non_image_is_rejected():
+    """Content that does not decode as an image raises IngestError"""
+    with pytest.raises(IngestError):
+        ingest_image(b'<?php echo 1; ?>')
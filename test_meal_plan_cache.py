@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for meal plan template personalization
+Run with: python -m pytest test_meal_plan_cache.py
+"""
+import sys
+import os
+import random
+
+# Add the advanced_recipe_finder directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'advanced_recipe_finder'))
+
+from meal_plan_cache import MealLibrary, contains_allergen, personalize_plan
+
+
+def _meal(name, ingredients, meal_type='Lunch'):
+    return {'name': name, 'type': meal_type, 'ingredients': ingredients}
+
+
+def test_allergen_groups_cover_their_ingredients():
+    """Group allergies rule out ingredients that do not repeat the group's name"""
+    assert contains_allergen(_meal('Trail mix', ['almonds', 'raisins']), ['nuts'])
+    assert contains_allergen(_meal('Palak paneer', ['spinach', 'paneer']), ['dairy'])
+    assert contains_allergen(_meal('Cheese toastie', ['bread', 'cheddar']), ['lactose intolerance'])
+    assert not contains_allergen(_meal('Eggplant curry', ['eggplant', 'rice']), ['eggs'])
+
+
+def test_template_is_not_personalized_for_unknown_allergy():
+    """Allergies outside the allergen table fall back to generating a plan"""
+    library = MealLibrary()
+    plan = {'days': [{'day': 'Day 1', 'meals': [_meal('Rice bowl', ['rice', 'beans'])]}]}
+    assert personalize_plan(plan, library, (), ['nightshades'], rng=random.Random(0)) is None
+
+
+def test_group_allergen_is_substituted_from_library():
+    """A meal with an ingredient from the allergen group is swapped for a safe one"""
+    library = MealLibrary()
+    library.add_plan((), {'days': [{'meals': [_meal('Lentil soup', ['lentils', 'carrots'])]}]})
+    plan = {'days': [{'day': 'Day 1', 'meals': [_meal('Almond salad', ['almonds', 'lettuce'])]}]}
+    personalized = personalize_plan(plan, library, (), ['tree nuts'], substitution_rate=0, rng=random.Random(0))
+    assert [meal['name'] for meal in personalized['days'][0]['meals']] == ['Lentil soup']
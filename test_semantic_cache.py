@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the chatbot's shared semantic answer cache
+Run with: python -m pytest test_semantic_cache.py
+"""
+import sys
+import os
+
+# Add the advanced_recipe_finder directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'advanced_recipe_finder'))
+
+from semantic_cache import SemanticCache, is_follow_up, negated_terms
+
+
+def test_rephrased_question_is_served():
+    """A context-free answer is shared with a rephrased question"""
+    cache = SemanticCache(threshold=0.5)
+    cache.add('How do I make pancakes?', 'Mix flour, milk and eggs...')
+
+    response, similarity = cache.lookup('how to make pancakes')
+    assert response == 'Mix flour, milk and eggs...'
+    assert similarity >= 0.5
+
+
+def test_context_dependent_reply_is_not_shared_between_users():
+    """User A's follow-up, answered with A's conversation, never reaches user B"""
+    cache = SemanticCache(threshold=0.5)
+    user_a_context = 'Summary: allergic to nuts, asked about banana bread.\n\n'
+    question = 'How long should I bake it?'
+    user_a_reply = 'Bake your nut-free banana bread for 60 minutes.'
+
+    # User A has context: the lookup misses and the reply is not stored
+    assert cache.lookup(question, context=user_a_context) == (None, 0.0)
+    cache.add(question, user_a_reply, context=user_a_context)
+
+    # User B asks the same follow-up without context and must not get A's answer
+    response, _ = cache.lookup(question)
+    assert response is None
+    assert cache.stats()['entries'] == 0
+    assert cache.stats()['bypassed'] == 1
+
+
+def test_cached_answers_are_not_served_to_users_with_context():
+    """Even context-free cached answers are bypassed once a user has a conversation"""
+    cache = SemanticCache(threshold=0.5)
+    cache.add('How do I make pancakes?', 'Mix flour, milk and eggs...')
+
+    response, _ = cache.lookup('how to make pancakes', context='User: I am vegan\nAssistant: Noted.\n\n')
+    assert response is None
+
+
+def test_only_follow_ups_need_the_conversation():
+    """Standalone questions can use the shared cache; pronouns and continuations cannot"""
+    assert not is_follow_up('How do I make pancakes?')
+    assert not is_follow_up('chicken curry')
+    assert is_follow_up('How long should I bake it?')
+    assert is_follow_up('what about with rice?')
+    assert is_follow_up('vegan?')
+
+
+def test_negated_question_does_not_hit_plain_answer():
+    """"chicken curry without chicken" must not get the chicken curry answer"""
+    cache = SemanticCache()
+    cache.add('chicken curry', 'Brown the chicken, then...')
+
+    assert cache.lookup('chicken curry without chicken')[0] is None
+    assert cache.lookup('how to make chicken curry')[0] == 'Brown the chicken, then...'
+
+
+def test_negated_terms_cover_lists_and_free_suffix():
+    """Exclusions are read from "without"/"no" lists and "-free" suffixes"""
+    assert negated_terms('pasta with no garlic, onions or chilli') == {'garlic', 'onion', 'chilli'}
+    assert negated_terms('gluten-free bread') == {'gluten'}
+    assert negated_terms('soup without onion served with rice') == {'onion'}